@@ -23,32 +23,29 @@ import wx
 import wx.stc as stc
 from threading import Thread
 
-from tools.GenerateConcept import ConceptGenerator
+from tools.GenerateConcept import getSharedConceptGenerator
 from tools.Text2XML import Text2XMLConverter
+from tools.annotationServer import AnnotationClient
 from tools.annotationEvaluator import listErroneousUtterances
+from tools.CorpusIndex import CorpusIndex, getExtensionBit
 from tools.FileTools import stripXML, alphanum_key
+from tools.CommandSchema import getAnnotationTags
+from tools.FileTools import WAV_EXT, HYP_EXT, CMD_HYP_EXT, TEXT_ANNO_EXT, XML_ANNO_EXT, CMD_ANNO_EXT, COMMENT_EXT
 
 DEFAULT_AIRLINE_FILE = 'data/airlines/callsigns.txt'
 DEFAULT_OPENFST_GRAMMAR_FILE = 'data/grammars/default.fst'
 
-WAV_EXT = '.wav'
-HYP_EXT = '.txt'
-CMD_HYP_EXT = '.cpt'
-TEXT_ANNO_EXT = '.cor'
-XML_ANNO_EXT = '.tra'
-CMD_ANNO_EXT = '.cmd'
-COMMENT_EXT = '.nfo'
-
 BUTTON_GENERATE = 0
 BUTTON_ABORT = 1
 BUTTON_REVERT = 2
 
 
 class MyListCtrl(wx.ListCtrl):
-    def __init__(self, parent, idnum, conceptGenerator):
+    def __init__(self, parent, idnum, conceptGenerator, filterCacheFile=None):
         wx.ListCtrl.__init__(self, parent, idnum, pos=(10, 50), size=(300, 290), style=wx.LC_REPORT | wx.BORDER_SUNKEN)
 
         self.conceptGenerator = conceptGenerator
+        self.filterCacheFile = filterCacheFile
 
         self.InsertColumn(0, 'Name')
         self.SetColumnWidth(0, 290)
@@ -71,7 +68,8 @@ class MyListCtrl(wx.ListCtrl):
 
         # Update play list
         if filterFiles:
-            for utterance in set(listErroneousUtterances(workDir, self.conceptGenerator)):
+            for utterance in set(listErroneousUtterances(workDir, self.conceptGenerator,
+                                                         self.filterCacheFile)):
                 for ext in utterance.extensions:
                     ext = '.' + ext
                     if ext == WAV_EXT:
@@ -79,13 +77,16 @@ class MyListCtrl(wx.ListCtrl):
                     elif ext in fileSets:
                         fileSets[ext].add(utterance.root)
         else:
-            all_files = os.listdir(workDir)
-            for filename in all_files:
-                (root, ext) = path.splitext(filename)
-                if ext == WAV_EXT:
-                    files.append(filename)
-                elif ext in fileSets:
-                    fileSets[ext].add(root)
+            dirIndex = CorpusIndex(workDir, recurse=False, statFiles=False).getDir(workDir)
+            if dirIndex is not None:
+                wavBit = getExtensionBit(WAV_EXT)
+                fileBits = [(getExtensionBit(ext), fileSet) for ext, fileSet in fileSets.iteritems()]
+                for root, mask in dirIndex.iterItems():
+                    if mask & wavBit:
+                        files.append(root + WAV_EXT)
+                    for bit, fileSet in fileBits:
+                        if mask & bit:
+                            fileSet.add(root)
 
         self.DeleteAllItems()
         sorted_files = sorted(files, key=alphanum_key, reverse=False)
@@ -210,45 +211,7 @@ tagsXML = ['s', 'commands',
            'flightlevel', 'altitude', 'feet_per_minute', 'direction', 'distance',
            'more', 'less', 'above', 'below', 'neg', 'runway', 'qnh_value', 'frequency',
            'information', 'holdpoint']
-cmdsXML = {'cleared_ils': ['runway'],
-           'descend': ['flightlevel', 'altitude'],
-           'expect_ils': ['runway'],
-           'direct_to': ['direction', 'waypoint'],
-           'give_altitude': ['flightlevel', 'altitude'],
-           'give_speed': ['speed', 'more', 'less', 'distance'],
-           'handover': ['contact', 'frequency'],
-           'heading': ['degree_absolute'],
-           'increase': ['speed', 'more', 'less', 'distance'],
-           'information': ['information'],
-           'init_response': [],
-           'maintain_altitude': ['flightlevel', 'altitude'],
-           'maintain_speed': ['speed', 'more', 'less', 'distance'],
-           'rate_of_descent': ['feet_per_minute', 'more', 'less'],
-           'reduce': ['speed', 'more', 'less', 'distance'],
-           'reduce_final_app': [],
-           'reduce_min_clean': [],
-           'report_established': [],
-           'report_speed': [],
-           'speed_own': [],
-           'transition': ['waypoint', 'degree_absolute'],
-           'touchdown': ['distance'],
-           'turn': ['direction', 'degree_relative'],
-           'turn_heading': ['direction', 'degree_absolute'],
-           'vector': ['runway'],
-           'qnh': ['qnh_value'],
-           'cleared_ndb': ['runway'],
-           'cleared_rnav': ['runway'],
-           'intercept_localizer': ['runway'],
-           'expect_runway': ['runway'],
-           'climb': ['flightlevel', 'altitude'],
-           'rate_of_descent_own': [],
-           'rate_of_climb': ['feet_per_minute', 'more', 'less'],
-           'rate_of_climb_own': [],
-           'holding': ['holdpoint', 'flightlevel'],
-           'leave_holding': ['holdpoint'],
-           'go_around': [],
-           'navigation_own': [],
-           }
+cmdsXML = getAnnotationTags()
 keywordsXml = tagsXML + specialTagsXML + cmdsXML.keys()
 autocompXML = ['<callsign><airline></airline><flightnumber></flightnumber></callsign>']
 for tag in tagsXML:
@@ -429,7 +392,7 @@ class FileHunter(wx.Frame):
     def __init__(self, parent, ident=wx.ID_ANY, title=wx.EmptyString, scriptpath=None, filterFiles=False,
                  manageSVN=True, enableTimers=True, grammarFile=DEFAULT_OPENFST_GRAMMAR_FILE,
                  airlineFile=DEFAULT_AIRLINE_FILE, disableASRInput=False, disableAssistance=False,
-                 disableAutocomplete=False):
+                 disableAutocomplete=False, serverSocket=None, filterCacheFile=None):
 
         # Init variables
         self.ident = ident
@@ -438,8 +401,13 @@ class FileHunter(wx.Frame):
 
         self.manageSVN = manageSVN
 
-        # Prepare concept generator
-        self.conceptGenerator = ConceptGenerator(airlineFile)
+        # Prepare concept generator and XML converter, either locally or via an annotation server
+        if serverSocket is None:
+            self.conceptGenerator = getSharedConceptGenerator(airlineFile)
+            self.converter = Text2XMLConverter(grammarFile, airlineFile)
+        else:
+            self.conceptGenerator = AnnotationClient(serverSocket)
+            self.converter = self.conceptGenerator
 
         # current directory
         self.orgDir = scriptpath
@@ -455,7 +423,6 @@ class FileHunter(wx.Frame):
         self.showsAssistance = not disableAssistance
         self.hasAutocomplete = not disableAutocomplete
 
-        self.converter = Text2XMLConverter(grammarFile, airlineFile)
         self.grammar_name = self.converter.getGrammarName()
 
         wx.Frame.__init__(self, parent, -1, title, size=(995, 735))
@@ -571,7 +538,7 @@ class FileHunter(wx.Frame):
 
         # Playlist
         self.filterFiles = filterFiles
-        self.PlayList = MyListCtrl(panel, 1, self.conceptGenerator)
+        self.PlayList = MyListCtrl(panel, 1, self.conceptGenerator, filterCacheFile=filterCacheFile)
         self.PlayList.Bind(wx.EVT_LIST_ITEM_SELECTED, self.OnItemSelected, self.PlayList)
         self.updatePlaylist()
 
@@ -1224,6 +1191,9 @@ def main(args):
                            help='Also change the SVN status of files (i.e. run svn add or svn rm).')
     argparser.add_argument('--filter', '-f', action='store_true',
                            help='List only utterances for which bad utterances (e.g. annotation errors) were detected.')
+    argparser.add_argument('--filtercache', metavar='FILE',
+                           help='Cache the results of --filter in the given sqlite file, so that refreshing the '
+                                'playlist only checks utterances that changed.')
     argparser.add_argument('--timer', '-t', action='store_true',
                            help='Show timer buttons')
     # Auxiliary file paths
@@ -1231,6 +1201,9 @@ def main(args):
                            help='Path to file storing OpenFST-formatted grammar.')
     argparser.add_argument('--airlines', '--airlinesfile', '-i', default=DEFAULT_AIRLINE_FILE,
                            help='Path to file storing airline callsign information.')
+    argparser.add_argument('--server', metavar='SOCKET',
+                           help='Use a running annotation server (see tools/annotationServer.py) listening on the '
+                                'given socket instead of loading grammar and airline files.')
     # Feature deactivation flags
     argparser.add_argument('--noasr', '-r', action='store_true',
                            help='Do not display ASR recognition, even if available.')
@@ -1239,6 +1212,8 @@ def main(args):
     argparser.add_argument('--noautocomp', '-c', action='store_true',
                            help='Do not offer autocomplete and syntax highlighting.')
     pargs = argparser.parse_args()
+    if pargs.filtercache and pargs.server:
+        argparser.error('--filtercache can not be used with --server')
 
     if pargs.logfile:
         logging.basicConfig(filename=pargs.logfile, level=logging.INFO, format='%(asctime)s;%(message)s')
@@ -1249,7 +1224,8 @@ def main(args):
     app = wx.App(0)
     FileHunter(None, -1, 'ATC-Anno', scriptpath=abspath, filterFiles=pargs.filter, manageSVN=pargs.svn,
                enableTimers=pargs.timer, grammarFile=pargs.grammar, airlineFile=pargs.airlines,
-               disableASRInput=pargs.noasr, disableAssistance=pargs.noassist, disableAutocomplete=pargs.noautocomp)
+               disableASRInput=pargs.noasr, disableAssistance=pargs.noassist, disableAutocomplete=pargs.noautocomp,
+               serverSocket=pargs.server, filterCacheFile=pargs.filtercache)
 
     logging.info('START TOOL')
     if pargs.noautocomp:
@@ -0,0 +1,170 @@
+"""
+Compact records of commands in AMAN-interface format and their serialization.
+
+An AMAN command is written as a space-separated string of callsign, concept, value and metric (each only if present),
+followed by its confidence scores, e.g. "DLH123 DESCEND 3000 ALT 0.93 0.87 1.0 0.81".
+AMANCommand keeps these fields apart, so that they can be compared without splitting strings,
+and only formats the string when it is asked for.
+
+Lists of commands (e.g. those of one utterance) can be serialized as a line of JSON,
+in which each command is an array [callsign, concept, value, metric, [confidences...]],
+or as a compact binary string for caches.
+"""
+
+import json
+import marshal
+
+# Version of the binary format. Increase it when the fields of AMANCommand change.
+BINARY_FORMAT_VERSION = 1
+
+
+class AMANCommand(object):
+    """
+    A single command in AMAN-interface format.
+    Fields that are not part of the command are None. Confidences are a tuple of floats, in output order.
+    """
+    __slots__ = ('callsign', 'concept', 'value', 'metric', 'confidences')
+
+    def __init__(self, callsign, concept=None, value=None, metric=None, confidences=()):
+        self.callsign = callsign
+        self.concept = concept
+        self.value = value
+        self.metric = metric
+        self.confidences = tuple(confidences)
+
+    @classmethod
+    def fromString(cls, string, numConfidences=0):
+        """
+        Parses a command string, e.g. a line of a cmd file.
+        Strings don't mark which tokens are confidences, so the number of trailing confidence scores must be given.
+        Any tokens after concept and value are treated as the metric.
+        """
+        tokens = string.split(' ')
+        confidences = ()
+        if numConfidences > 0:
+            confidences = [float(token) for token in tokens[-numConfidences:]]
+            tokens = tokens[:-numConfidences]
+        fields = [None, None, None]
+        if len(tokens) > 1:
+            fields[0] = tokens[1]
+        if len(tokens) > 2:
+            fields[1] = tokens[2]
+        if len(tokens) > 3:
+            fields[2] = ' '.join(tokens[3:])
+        return cls(tokens[0], fields[0], fields[1], fields[2], confidences)
+
+    @classmethod
+    def fromFields(cls, fields):
+        """
+        Creates a command from the tuple returned by getFields.
+        """
+        return cls(*fields)
+
+    def getFields(self):
+        return self.callsign, self.concept, self.value, self.metric, self.confidences
+
+    def getConceptParts(self):
+        """
+        Returns the tokens of the command string that follow the callsign.
+        """
+        parts = [token for token in (self.concept, self.value, self.metric) if token is not None]
+        parts.extend(str(confidence) for confidence in self.confidences)
+        return parts
+
+    def getParts(self):
+        """
+        Returns the tokens of the command string.
+        """
+        parts = self.getConceptParts()
+        parts.insert(0, self.callsign)
+        return parts
+
+    def __str__(self):
+        return ' '.join(self.getParts())
+
+    def __repr__(self):
+        return 'AMANCommand({0!r}, {1!r}, {2!r}, {3!r}, {4!r})'.format(*self.getFields())
+
+    def __reduce__(self):
+        return AMANCommand, self.getFields()
+
+    def __eq__(self, other):
+        return isinstance(other, AMANCommand) and self.getFields() == other.getFields()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.getFields())
+
+
+def formatCommands(commands):
+    """
+    Returns the strings of a list of AMANCommands.
+    """
+    return [str(command) for command in commands]
+
+
+def dumpJSON(commands):
+    """
+    Returns a list of AMANCommands as a single line of JSON.
+    """
+    return json.dumps([command.getFields() for command in commands], separators=(',', ':'))
+
+
+def loadJSON(line):
+    """
+    Returns the list of AMANCommands of a line created by dumpJSON.
+    """
+    commands = list()
+    for callsign, concept, value, metric, confidences in json.loads(line):
+        commands.append(AMANCommand(_toStr_(callsign), _toStr_(concept), _toStr_(value), _toStr_(metric),
+                                    confidences))
+    return commands
+
+
+def writeJSONL(commandLists, stream):
+    """
+    Writes one line of JSON per list of AMANCommands.
+    """
+    for commands in commandLists:
+        stream.write(dumpJSON(commands))
+        stream.write('\n')
+
+
+def iterJSONL(stream):
+    """
+    Yields the lists of AMANCommands of a stream written by writeJSONL. Empty lines are skipped.
+    """
+    for line in stream:
+        line = line.strip()
+        if len(line) > 0:
+            yield loadJSON(line)
+
+
+def packCommands(commands):
+    """
+    Returns a list of AMANCommands as a binary string.
+    The format is only meant to be read again by the same version of Python (e.g. for caches).
+    """
+    return marshal.dumps((BINARY_FORMAT_VERSION, [command.getFields() for command in commands]))
+
+
+def unpackCommands(data):
+    """
+    Returns the list of AMANCommands of a binary string created by packCommands.
+    Raises a ValueError if the string has a different format version.
+    """
+    version, fieldsList = marshal.loads(data)
+    if version != BINARY_FORMAT_VERSION:
+        raise ValueError('Unsupported format version of packed commands: {0}'.format(version))
+    return [AMANCommand(*fields) for fields in fieldsList]
+
+
+def _toStr_(value):
+    """
+    Turns unicode strings loaded from JSON back into byte strings, as they are used by the concept generator.
+    """
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
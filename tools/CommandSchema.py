@@ -0,0 +1,163 @@
+"""
+Declarative schema of all commands that can be annotated, shared by the concept generator and the annotation tool.
+
+Each command is described by an entry with the following fields (all but command and kind are optional):
+    command:           Name of the command, as in <command="name">.
+    kind:              COMMAND_RELEVANT if the command is converted to an AMAN concept,
+                       COMMAND_IRRELEVANT if it is recognized but has no AMAN concept,
+                       COMMAND_UNSUPPORTED if it can be annotated but is not recognized by the concept generator.
+    concept:           AMAN concept of the command. Defaults to the upper-cased command name.
+    valueTags:         List of (tag, metric) pairs of the tags that contain the command's value, in order of preference.
+                       metric is given after the value (e.g. DESCEND 3000 ALT) or None if the command has no metric.
+    limit:             LIMIT_ABOVE, LIMIT_BELOW or LIMIT_EITHER if the concept can be extended by a limit
+                       (e.g. DESCEND_OR_BELOW).
+    limitedConcept:    Concept that the limit extension is appended to. Defaults to concept.
+    directionConcepts: Pair (concept without direction, concept template with direction) for commands whose concept
+                       depends on a direction tag.
+    isValueOptional:   True if the command can be recognized without a value.
+    noValueConcept:    Concept of the command if it has no value.
+    annotationTags:    Tags that the annotation tool inserts when it autocompletes the command.
+
+The schema is compiled once into COMMAND_SPECS, a dictionary mapping command names to CommandSpecs.
+"""
+
+from collections import namedtuple
+
+COMMAND_RELEVANT = 'relevant'
+COMMAND_IRRELEVANT = 'irrelevant'
+COMMAND_UNSUPPORTED = 'unsupported'
+
+LIMIT_ABOVE = 'above'
+LIMIT_BELOW = 'below'
+LIMIT_EITHER = 'either'
+
+VALUE_NUMBER = 'number'
+VALUE_WAYPOINT = 'waypoint'
+VALUE_RUNWAY = 'runway'
+VALUE_CONTACT = 'contact'
+VALUE_FREQUENCY = 'frequency'
+
+# How the content of value tags is parsed. Tags that are not listed contain numbers.
+TAG_VALUE_TYPES = dict(waypoint=VALUE_WAYPOINT,
+                       fix=VALUE_WAYPOINT,
+                       runway=VALUE_RUNWAY,
+                       contact=VALUE_CONTACT,
+                       frequency=VALUE_FREQUENCY)
+# Value tags that determine the concept of their command
+TAG_CONCEPTS = dict(frequency='HANDOVER_FREQUENCY')
+
+HEIGHT_TAGS = [('flightlevel', 'FL'), ('altitude', 'ALT')]
+FPM_TAGS = [('feet_per_minute', None)]
+SPEED_TAGS = [('speed', None)]
+DEGREE_REL_TAGS = [('degree_relative', None)]
+DEGREE_ABS_TAGS = [('degree_absolute', None)]
+WAYPOINT_TAGS = [('waypoint', None), ('fix', None)]
+RUNWAY_TAGS = [('runway', None)]
+CONTACT_TAGS = [('contact', None), ('frequency', None)]
+
+COMMAND_SCHEMA = [
+    # ############# Relevant commands ##############
+    dict(command='descend', kind=COMMAND_RELEVANT, valueTags=HEIGHT_TAGS, limit=LIMIT_BELOW,
+         annotationTags=['flightlevel', 'altitude']),
+    dict(command='climb', kind=COMMAND_RELEVANT, valueTags=HEIGHT_TAGS, limit=LIMIT_ABOVE,
+         annotationTags=['flightlevel', 'altitude']),
+    dict(command='give_altitude', kind=COMMAND_RELEVANT, concept='ALTITUDE', valueTags=HEIGHT_TAGS,
+         limit=LIMIT_EITHER, annotationTags=['flightlevel', 'altitude']),
+    dict(command='maintain_altitude', kind=COMMAND_RELEVANT, valueTags=HEIGHT_TAGS, limit=LIMIT_EITHER,
+         limitedConcept='ALTITUDE', isValueOptional=True, annotationTags=['flightlevel', 'altitude']),
+    dict(command='rate_of_descent', kind=COMMAND_RELEVANT, valueTags=FPM_TAGS, limit=LIMIT_ABOVE,
+         annotationTags=['feet_per_minute', 'more', 'less']),
+    dict(command='rate_of_climb', kind=COMMAND_RELEVANT, valueTags=FPM_TAGS, limit=LIMIT_BELOW,
+         annotationTags=['feet_per_minute', 'more', 'less']),
+    dict(command='reduce', kind=COMMAND_RELEVANT, valueTags=SPEED_TAGS, limit=LIMIT_BELOW,
+         annotationTags=['speed', 'more', 'less', 'distance']),
+    dict(command='increase', kind=COMMAND_RELEVANT, valueTags=SPEED_TAGS, limit=LIMIT_ABOVE,
+         annotationTags=['speed', 'more', 'less', 'distance']),
+    dict(command='give_speed', kind=COMMAND_RELEVANT, concept='SPEED', valueTags=SPEED_TAGS, limit=LIMIT_EITHER,
+         annotationTags=['speed', 'more', 'less', 'distance']),
+    dict(command='maintain_speed', kind=COMMAND_RELEVANT, valueTags=SPEED_TAGS, limit=LIMIT_EITHER,
+         limitedConcept='SPEED', isValueOptional=True, annotationTags=['speed', 'more', 'less', 'distance']),
+    dict(command='speed_own', kind=COMMAND_RELEVANT, isValueOptional=True),
+    dict(command='reduce_final_app', kind=COMMAND_RELEVANT, isValueOptional=True),
+    dict(command='reduce_min_clean', kind=COMMAND_RELEVANT, isValueOptional=True),
+    dict(command='turn', kind=COMMAND_RELEVANT, valueTags=DEGREE_REL_TAGS,
+         directionConcepts=('TURN_BY', 'TURN_{0}_BY'), annotationTags=['direction', 'degree_relative']),
+    dict(command='turn_heading', kind=COMMAND_RELEVANT, valueTags=DEGREE_ABS_TAGS,
+         directionConcepts=(None, 'TURN_{0}_HEADING'),  # Turn_Heading requires direction information
+         annotationTags=['direction', 'degree_absolute']),
+    dict(command='heading', kind=COMMAND_RELEVANT, valueTags=DEGREE_ABS_TAGS, noValueConcept='MAINTAIN_HEADING',
+         annotationTags=['degree_absolute']),
+    dict(command='transition', kind=COMMAND_RELEVANT, valueTags=WAYPOINT_TAGS,
+         annotationTags=['waypoint', 'degree_absolute']),
+    dict(command='direct_to', kind=COMMAND_RELEVANT, valueTags=WAYPOINT_TAGS, annotationTags=['direction', 'waypoint']),
+    dict(command='cleared_ils', kind=COMMAND_RELEVANT, valueTags=RUNWAY_TAGS, annotationTags=['runway']),
+    dict(command='handover', kind=COMMAND_RELEVANT, valueTags=CONTACT_TAGS, annotationTags=['contact', 'frequency']),
+    # ############# Irrelevant commands ##############
+    dict(command='init_response', kind=COMMAND_IRRELEVANT),
+    dict(command='report_speed', kind=COMMAND_IRRELEVANT),
+    dict(command='expect_ils', kind=COMMAND_IRRELEVANT, annotationTags=['runway']),
+    dict(command='vector', kind=COMMAND_IRRELEVANT, annotationTags=['runway']),
+    dict(command='information', kind=COMMAND_IRRELEVANT, annotationTags=['information']),
+    dict(command='report_established', kind=COMMAND_IRRELEVANT),
+    dict(command='touchdown', kind=COMMAND_IRRELEVANT, annotationTags=['distance']),
+    # ############# Commands that are only annotated ##############
+    dict(command='qnh', kind=COMMAND_UNSUPPORTED, annotationTags=['qnh_value']),
+    dict(command='cleared_ndb', kind=COMMAND_UNSUPPORTED, annotationTags=['runway']),
+    dict(command='cleared_rnav', kind=COMMAND_UNSUPPORTED, annotationTags=['runway']),
+    dict(command='intercept_localizer', kind=COMMAND_UNSUPPORTED, annotationTags=['runway']),
+    dict(command='expect_runway', kind=COMMAND_UNSUPPORTED, annotationTags=['runway']),
+    dict(command='rate_of_descent_own', kind=COMMAND_UNSUPPORTED),
+    dict(command='rate_of_climb_own', kind=COMMAND_UNSUPPORTED),
+    dict(command='holding', kind=COMMAND_UNSUPPORTED, annotationTags=['holdpoint', 'flightlevel']),
+    dict(command='leave_holding', kind=COMMAND_UNSUPPORTED, annotationTags=['holdpoint']),
+    dict(command='go_around', kind=COMMAND_UNSUPPORTED),
+    dict(command='navigation_own', kind=COMMAND_UNSUPPORTED),
+]
+
+CommandSpec = namedtuple('CommandSpec', ['command', 'kind', 'concept', 'valueTags', 'limit', 'limitedConcept',
+                                         'directionConcepts', 'isValueOptional', 'noValueConcept', 'annotationTags'])
+
+
+def compileCommandSchema(schema):
+    """
+    Checks a command schema and returns a dictionary mapping each command name to its CommandSpec.
+    """
+    specs = dict()
+    for entry in schema:
+        fields = dict(entry)
+        command = fields.pop('command')
+        if command in specs:
+            raise ValueError('Command {0} is defined twice'.format(command))
+        kind = fields.pop('kind')
+        if kind not in (COMMAND_RELEVANT, COMMAND_IRRELEVANT, COMMAND_UNSUPPORTED):
+            raise ValueError('Unknown kind of command {0}: {1}'.format(command, kind))
+        limit = fields.pop('limit', None)
+        if limit not in (None, LIMIT_ABOVE, LIMIT_BELOW, LIMIT_EITHER):
+            raise ValueError('Unknown limit of command {0}: {1}'.format(command, limit))
+        concept = fields.pop('concept', command.upper())
+        spec = CommandSpec(command=command,
+                           kind=kind,
+                           concept=concept,
+                           valueTags=tuple(fields.pop('valueTags', ())),
+                           limit=limit,
+                           limitedConcept=fields.pop('limitedConcept', concept),
+                           directionConcepts=fields.pop('directionConcepts', None),
+                           isValueOptional=fields.pop('isValueOptional', False),
+                           noValueConcept=fields.pop('noValueConcept', None),
+                           annotationTags=tuple(fields.pop('annotationTags', ())))
+        if len(fields) > 0:
+            raise ValueError('Unknown fields for command {0}: {1}'.format(command, ', '.join(sorted(fields))))
+        specs[command] = spec
+    return specs
+
+
+COMMAND_SPECS = compileCommandSchema(COMMAND_SCHEMA)
+
+
+def getAnnotationTags(specs=None):
+    """
+    Returns a dictionary mapping each command name to the list of tags the annotation tool inserts for it.
+    """
+    if specs is None:
+        specs = COMMAND_SPECS
+    return dict((command, list(spec.annotationTags)) for command, spec in specs.iteritems())
@@ -0,0 +1,245 @@
+"""
+Index of the utterances in a directory tree, built in a single pass over the directories.
+
+For every directory, the index records each utterance root (file name without extension) with a bitmask of the
+utterance files that exist for it (see INDEXED_EXTENSIONS) and, optionally, their modification times and sizes.
+The data of a directory is kept in a few flat arrays, so that even directories with a million files take little
+memory, and directories are read with scandir, which avoids a separate stat call per entry to tell files and
+subdirectories apart (os.scandir, or the scandir package on Python 2; without either, os.listdir is used).
+Hidden subdirectories (starting with '.') are skipped, as are directories that can't be read.
+"""
+
+import os
+import stat
+from array import array
+from bisect import bisect_left
+from os import path
+
+from FileTools import WAV_EXT, HYP_EXT, CMD_HYP_EXT, TEXT_ANNO_EXT, XML_ANNO_EXT, CMD_ANNO_EXT, COMMENT_EXT
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+# File extensions that are recorded in the bitmask of an utterance. The position in the list is the extension's bit.
+INDEXED_EXTENSIONS = [WAV_EXT, HYP_EXT, CMD_HYP_EXT, TEXT_ANNO_EXT, XML_ANNO_EXT, CMD_ANNO_EXT, COMMENT_EXT]
+EXTENSION_BITS = dict((extension, 1 << i) for i, extension in enumerate(INDEXED_EXTENSIONS))
+OTHER_EXTENSION_BIT = 1 << len(INDEXED_EXTENSIONS)  # Set if the root also has files with any other extension
+
+
+def getExtensionBit(extension):
+    """
+    Returns the bit of an extension, given with or without leading dot (e.g. '.tra' or 'tra').
+    """
+    if not extension.startswith('.'):
+        extension = '.' + extension
+    return EXTENSION_BITS[extension]
+
+
+def getMaskExtensions(mask):
+    """
+    Returns the indexed extensions (with leading dot) whose bits are set in a bitmask.
+    """
+    return [extension for extension in INDEXED_EXTENSIONS if mask & EXTENSION_BITS[extension]]
+
+
+def _countBits_(mask):
+    return bin(mask).count('1')
+
+
+def _splitExtension_(name):
+    """
+    Returns root and extension of a file name like path.splitext, which is too slow for millions of files.
+    """
+    i = name.rfind('.')
+    if i <= 0 or (name[0] == '.' and len(name[:i].lstrip('.')) == 0):
+        return name, ''
+    return name[:i], name[i:]
+
+
+def _listDir_(dirpath):
+    """
+    Returns the names of the files and of the subdirectories of a directory. Symbolic links to directories are in
+    neither list. Without scandir, entries are only checked for being directories if the directory's link count
+    shows that it has subdirectories (a directory has two links plus one per subdirectory on most file systems).
+    """
+    fileNames = list()
+    dirNames = list()
+    if scandir is not None:
+        for entry in scandir(dirpath):
+            try:
+                if not entry.is_dir():
+                    fileNames.append(entry.name)
+                elif not entry.is_symlink():
+                    dirNames.append(entry.name)
+            except OSError:
+                pass  # Removed since the directory was listed
+    else:
+        names = os.listdir(dirpath)
+        if os.stat(dirpath).st_nlink == 2:
+            return names, dirNames
+        for name in names:
+            filename = path.join(dirpath, name)
+            try:
+                fileStat = os.lstat(filename)
+            except OSError:
+                continue
+            if stat.S_ISDIR(fileStat.st_mode):
+                dirNames.append(name)
+            elif not stat.S_ISLNK(fileStat.st_mode) or not path.isdir(filename):
+                fileNames.append(name)
+    return fileNames, dirNames
+
+
+class DirIndex(object):
+    """
+    The utterances of a single directory. Roots are sorted; the files of a root are stored in order of their bits,
+    so that the position of a file's stat info follows from the bitmask.
+    """
+    __slots__ = ('dirpath', 'roots', 'masks', 'offsets', 'mtimes', 'sizes')
+
+    def __init__(self, dirpath, roots, masks, offsets=None, mtimes=None, sizes=None):
+        """
+        :param roots: Sorted list of utterance roots.
+        :param masks: array of extension bitmasks, one per root.
+        :param offsets: array of the positions of the roots' first file in mtimes and sizes, or None without stats.
+        :param mtimes: array of the modification times of the indexed files.
+        :param sizes: array of the sizes of the indexed files.
+        """
+        self.dirpath = dirpath
+        self.roots = roots
+        self.masks = masks
+        self.offsets = offsets
+        self.mtimes = mtimes
+        self.sizes = sizes
+
+    def __len__(self):
+        return len(self.roots)
+
+    def _find_(self, root):
+        i = bisect_left(self.roots, root)
+        if i < len(self.roots) and self.roots[i] == root:
+            return i
+        return None
+
+    def getMask(self, root):
+        """
+        Returns the extension bitmask of a root, or 0 if the directory has no files of that root.
+        """
+        i = self._find_(root)
+        if i is None:
+            return 0
+        return self.masks[i]
+
+    def has(self, root, extension):
+        return bool(self.getMask(root) & getExtensionBit(extension))
+
+    def iterItems(self, extension=None):
+        """
+        Yields (root, mask) pairs in order of the roots, optionally only for roots that have a file of an extension.
+        """
+        bit = None
+        if extension is not None:
+            bit = getExtensionBit(extension)
+        for root, mask in zip(self.roots, self.masks):
+            if bit is None or mask & bit:
+                yield root, mask
+
+    def getFileStat(self, root, extension):
+        """
+        Returns (modification time, size) of the file of a root with an indexed extension,
+        or None if it doesn't exist or stats were not indexed.
+        """
+        if self.offsets is None:
+            return None
+        i = self._find_(root)
+        if i is None:
+            return None
+        bit = getExtensionBit(extension)
+        mask = self.masks[i]
+        if not mask & bit:
+            return None
+        position = self.offsets[i] + _countBits_(mask & (bit - 1))
+        return self.mtimes[position], self.sizes[position]
+
+
+class CorpusIndex(object):
+    """
+    Index of all utterances in a directory tree (or a single directory), see module documentation.
+    """
+
+    def __init__(self, topdir, recurse=True, statFiles=True):
+        """
+        :param topdir: Directory to index.
+        :param recurse: If False, only topdir itself is indexed.
+        :param statFiles: If True, modification time and size of the files with indexed extensions are recorded.
+        """
+        self.topdir = topdir
+        self.statFiles = statFiles
+        self.dirs = dict()
+        pendingDirs = [topdir]
+        while pendingDirs:
+            dirpath = pendingDirs.pop()
+            subdirs = self._indexDir_(dirpath)
+            if recurse:
+                pendingDirs.extend(reversed(subdirs))
+
+    def _indexDir_(self, dirpath):
+        """
+        Indexes the files of a directory and returns its visible subdirectories.
+        Directories without files are not added to the index.
+        """
+        try:
+            fileNames, dirNames = _listDir_(dirpath)
+        except OSError:
+            return []  # Unreadable directory
+        if len(fileNames) > 0:
+            self.dirs[dirpath] = self._buildDirIndex_(dirpath, fileNames)
+        return [path.join(dirpath, name) for name in sorted(dirNames) if not name.startswith('.')]
+
+    def _buildDirIndex_(self, dirpath, fileNames):
+        rootMasks = dict()
+        for name in fileNames:
+            root, extension = _splitExtension_(name)
+            if len(extension) > 0:
+                rootMasks[root] = rootMasks.get(root, 0) | EXTENSION_BITS.get(extension, OTHER_EXTENSION_BIT)
+        roots = sorted(rootMasks)
+        masks = array('B', [rootMasks[root] for root in roots])
+        if not self.statFiles:
+            return DirIndex(dirpath, roots, masks)
+
+        prefix = path.join(dirpath, '')
+        offsets = array('L')
+        mtimes = array('d')
+        sizes = array('l')
+        for i, root in enumerate(roots):
+            offsets.append(len(mtimes))
+            for extension in getMaskExtensions(masks[i]):
+                try:
+                    fileStat = os.stat(prefix + root + extension)
+                except OSError:  # Removed since the directory was listed, or a broken link
+                    masks[i] &= ~EXTENSION_BITS[extension]
+                    continue
+                mtimes.append(fileStat.st_mtime)
+                sizes.append(fileStat.st_size)
+        return DirIndex(dirpath, roots, masks, offsets, mtimes, sizes)
+
+    def getDir(self, dirpath):
+        """
+        Returns the DirIndex of a directory, or None if it contains no files.
+        """
+        return self.dirs.get(dirpath)
+
+    def iterDirs(self):
+        """
+        Yields the DirIndex of every directory, sorted by path.
+        """
+        for dirpath in sorted(self.dirs):
+            yield self.dirs[dirpath]
+
+    def getNumRoots(self):
+        return sum(len(dirIndex) for dirIndex in self.dirs.itervalues())
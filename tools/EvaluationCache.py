@@ -0,0 +1,153 @@
+"""
+Persistent cache of the results of CommandEvaluator, so that evaluating a corpus again only evaluates the utterances
+whose annotations changed.
+
+The cache is a sqlite database with one row per utterance, identified by its directory (with symbolic links and
+relative parts resolved, so that every way of naming a directory finds the same rows) and file root. A row stores
+the state of the utterance's sidecar files (cor, tra and cmd) as (modification time, size, content hash) and the
+version of the evaluation, which changes with the code of the evaluator and the version of the concept generator
+(see ConceptGenerator.getVersion). Its results are how often each check counted the utterance, the content key of its
+tra annotation, the commands generated from it and the warnings printed while evaluating it.
+
+A row is only used if the version is the same and all sidecar files have the same content as before. Content hashes
+are only computed again for files whose modification time or size changed.
+"""
+
+import json
+import sqlite3
+from os import path
+from collections import namedtuple
+
+from FileTools import hashFile
+from AMANRecords import packCommands, unpackCommands
+
+CACHED_EXTENSIONS = ['cor', 'tra', 'cmd']  # Sidecar files whose content the evaluation of an utterance depends on
+
+# Result of evaluating a single utterance:
+#   statCounts: Dictionary mapping names of CommandEvaluator.STAT_NAMES to how often the utterance was counted.
+#   traKey: Content key of the tra annotation if commands were generated from it, otherwise None.
+#   commands: List of AMANCommands generated from the tra annotation, or None.
+#   output: Text that was printed while evaluating the utterance.
+UtteranceResult = namedtuple('UtteranceResult', ['statCounts', 'traKey', 'commands', 'output'])
+
+
+class EvaluationCache:
+    """
+    Stores UtteranceResults in a sqlite database. Changes are only saved by commit.
+    """
+
+    def __init__(self, dbFile):
+        self.dbFile = dbFile
+        self.connection = sqlite3.connect(dbFile)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS utterances ('
+                                'dirpath TEXT NOT NULL, root TEXT NOT NULL, version TEXT NOT NULL, '
+                                'files TEXT NOT NULL, results TEXT NOT NULL, commands BLOB, '
+                                'PRIMARY KEY (dirpath, root))')
+        self.dirRows = dict()  # Directory key -> root -> (version, files, results, commands), loaded once per directory
+        self.dirKeys = dict()  # dirpath -> directory key, see _getDirKey_
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        self.connection.close()
+
+    def commit(self):
+        self.connection.commit()
+        self.dirRows.clear()
+        self.dirKeys.clear()
+
+    def _getDirKey_(self, dirpath):
+        """
+        Returns the key of a directory in the database, its canonical absolute path.
+        """
+        dirKey = self.dirKeys.get(dirpath)
+        if dirKey is None:
+            dirKey = path.realpath(dirpath)
+            self.dirKeys[dirpath] = dirKey
+        return dirKey
+
+    def _getDirRows_(self, dirpath):
+        dirKey = self._getDirKey_(dirpath)
+        rows = self.dirRows.get(dirKey)
+        if rows is None:
+            rows = dict()
+            cursor = self.connection.execute('SELECT root, version, files, results, commands FROM utterances '
+                                             'WHERE dirpath = ?', (dirKey,))
+            for root, version, files, results, commands in cursor:
+                rows[root] = (version, files, results, commands)
+            self.dirRows[dirKey] = rows
+        return rows
+
+    @staticmethod
+    def _getFilename_(utterance, extension):
+        return '{0}.{1}'.format(utterance.absolute_root, extension)
+
+    def lookup(self, utterance, version):
+        """
+        Returns a pair (result, fileStates). result is the cached UtteranceResult of the utterance, or None if it has
+        to be evaluated. fileStates describes the current sidecar files and must be passed to store with the new
+        result. It is taken before the evaluation, so that changes during the evaluation are noticed next time.
+        """
+        row = self._getDirRows_(utterance.dirpath).get(utterance.root)
+        extensions = [extension for extension in CACHED_EXTENSIONS if utterance.has(extension)]
+        try:
+            stamps = dict((extension, utterance.getFileStamp(extension))
+                          for extension in extensions)
+            if row is not None and row[0] == version:
+                cachedStates = json.loads(row[1])
+                if sorted(cachedStates) == sorted(extensions):
+                    fileStates = dict()
+                    for extension in extensions:
+                        mtime, size, contentHash = cachedStates[extension]
+                        if stamps[extension] != (mtime, size):  # Possibly changed, compare the content
+                            newHash = hashFile(self._getFilename_(utterance, extension))
+                            if newHash != contentHash:
+                                break
+                        fileStates[extension] = list(stamps[extension]) + [contentHash]
+                    else:
+                        if fileStates != cachedStates:  # Only the modification times changed
+                            self._updateFileStates_(utterance, fileStates)
+                        self.hits += 1
+                        return self._decodeResult_(row[2], row[3]), fileStates
+            fileStates = dict()
+            for extension in extensions:
+                fileStates[extension] = list(stamps[extension]) + [hashFile(self._getFilename_(utterance, extension))]
+        except (IOError, OSError):
+            fileStates = None  # Files changed while looking at them, don't cache the result
+        self.misses += 1
+        return None, fileStates
+
+    def store(self, utterance, version, fileStates, result):
+        """
+        Stores the result of an utterance, given the fileStates returned by lookup.
+        """
+        if fileStates is None:
+            return
+        results = json.dumps(dict(statCounts=result.statCounts, traKey=result.traKey, output=result.output),
+                             sort_keys=True)
+        commands = None
+        if result.commands is not None:
+            commands = sqlite3.Binary(packCommands(result.commands))
+        self.connection.execute('INSERT OR REPLACE INTO utterances (dirpath, root, version, files, results, commands) '
+                                'VALUES (?, ?, ?, ?, ?, ?)',
+                                (self._getDirKey_(utterance.dirpath), utterance.root, version,
+                                 json.dumps(fileStates, sort_keys=True), results, commands))
+
+    def _updateFileStates_(self, utterance, fileStates):
+        self.connection.execute('UPDATE utterances SET files = ? WHERE dirpath = ? AND root = ?',
+                                (json.dumps(fileStates, sort_keys=True), self._getDirKey_(utterance.dirpath),
+                                 utterance.root))
+
+    @staticmethod
+    def _decodeResult_(results, commands):
+        results = json.loads(results)
+        statCounts = dict((str(name), count) for name, count in results['statCounts'].iteritems())
+        traKey = results['traKey']
+        if traKey is not None:
+            traKey = str(traKey)
+        if commands is not None:
+            commands = unpackCommands(str(commands))
+        return UtteranceResult(statCounts, traKey, commands, results['output'].encode('utf-8'))
+
+    def __str__(self):
+        return '{0} cached, {1} evaluated'.format(self.hits, self.misses)
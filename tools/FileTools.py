@@ -5,10 +5,31 @@ Collection of tools that help with file management.
 """
 
 import sys
+import os
 import re
+import stat
+import hashlib
+import tempfile
+from array import array
+from collections import namedtuple
 from warnings import warn
 from os import path
 
+# File extensions of the files that make up an utterance
+WAV_EXT = '.wav'  # Audio recording
+HYP_EXT = '.txt'  # Speech recogniser hypothesis
+CMD_HYP_EXT = '.cpt'  # Speech recogniser commands
+TEXT_ANNO_EXT = '.cor'  # Text annotation
+XML_ANNO_EXT = '.tra'  # XML annotation
+CMD_ANNO_EXT = '.cmd'  # Command annotation
+COMMENT_EXT = '.nfo'  # Annotator comments
+
+# Tokens of one utterance in an MBR/CTM file. Confidences are stored in an array('d') parallel to the tokens.
+# confidenceStrings are the confidences as written in the file, or None if they were not kept.
+MBRUtterance = namedtuple('MBRUtterance', ['utteranceID', 'tokens', 'confidences', 'confidenceStrings'])
+
+_umask_ = None  # See _getUmask_
+
 
 def _tryint_(s):
     """
@@ -105,3 +126,167 @@ def stripXML(text):
     text = re.sub(r'\s+', ' ', text)
     text = text.strip()
     return text
+
+
+def _getUmask_():
+    """
+    Returns the umask of the process. It can only be read by setting it, so it is read once and then remembered.
+    """
+    global _umask_
+    if _umask_ is None:
+        _umask_ = os.umask(0)
+        os.umask(_umask_)
+    return _umask_
+
+
+def writeFileAtomic(filename, text):
+    """
+    Write text to a file so that readers (and crashes) never see a partially written file.
+    The text is written to a temporary file in the same directory, which then replaces the target file.
+    The file keeps the permissions of the file it replaces; new files get the permissions that open would give them.
+    """
+    directory, basename = path.split(path.abspath(filename))
+    fd, tmpFilename = tempfile.mkstemp(prefix='.{0}.'.format(basename), suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as w:
+            w.write(text)
+            w.flush()
+            os.fsync(w.fileno())
+        try:
+            mode = stat.S_IMODE(os.stat(filename).st_mode)
+        except OSError:
+            mode = 0o666 & ~_getUmask_()
+        os.chmod(tmpFilename, mode)
+        if os.name == 'nt' and path.exists(filename):
+            os.remove(filename)  # Windows does not allow renaming onto an existing file
+        os.rename(tmpFilename, filename)
+    except:
+        if path.exists(tmpFilename):
+            os.remove(tmpFilename)
+        raise
+
+
+def hashFile(filename, blocksize=65536):
+    """
+    Returns the SHA-1 hex digest of a file's content.
+    """
+    sha = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        block = f.read(blocksize)
+        while block:
+            sha.update(block)
+            block = f.read(blocksize)
+    return sha.hexdigest()
+
+
+def hashModules(modules):
+    """
+    Returns a hash of the source code of imported modules, e.g. to notice that results cached by an earlier
+    version of the code may be outdated.
+    """
+    sha = hashlib.sha1()
+    for module in modules:
+        filename = module.__file__
+        if filename.endswith(('.pyc', '.pyo')) and path.exists(filename[:-1]):
+            filename = filename[:-1]  # Hash the source, not the compiled file
+        sha.update(hashFile(filename))
+    return sha.hexdigest()
+
+
+def getContentKey(lines, ignoreCase=False):
+    """
+    Returns a hash that identifies the content of a text irrespective of differences in whitespace.
+    Texts with the same key yield the same result when they are processed token by token,
+    so they only need to be processed once.
+    @param lines: A string or a list of strings (e.g. the lines of a file). Line boundaries are kept.
+    @param ignoreCase: If True, texts that only differ in upper/lower case get the same key.
+    """
+    if isinstance(lines, basestring):
+        lines = [lines]
+    text = '\n'.join(' '.join(line.split()) for line in lines)
+    if ignoreCase:
+        text = text.lower()
+    return hashlib.sha1(text).hexdigest()
+
+
+class DedupStats:
+    """
+    Counts how many processed items had the same content as an earlier item.
+    """
+
+    def __init__(self):
+        self.numItems = 0
+        self.numUnique = 0
+
+    def add(self, isDuplicate):
+        self.numItems += 1
+        if not isDuplicate:
+            self.numUnique += 1
+
+    def getNumDuplicates(self):
+        return self.numItems - self.numUnique
+
+    def getRatio(self):
+        """
+        Returns the fraction of items that did not have to be processed because they were duplicates.
+        """
+        if self.numItems == 0:
+            return 0.0
+        return float(self.getNumDuplicates()) / self.numItems
+
+    def __str__(self):
+        return '{0} items, {1} distinct, {2} duplicates ({3:.1%} saved)'.format(
+            self.numItems, self.numUnique, self.getNumDuplicates(), self.getRatio())
+
+
+def iterMBRUtterances(filename, hasUtteranceIDs=False, keepConfidenceStrings=False):
+    """
+    Reads a file with one token per line, such as the MBR or CTM output of a speech recogniser,
+    and yields an MBRUtterance for each utterance in it.
+    The last two columns of each line are the token and its confidence, other columns are ignored.
+    Utterances are separated by empty lines. Lines starting with ";;" are comments.
+    Each line is split only once and the token strings are interned,
+    so that large files are read without building intermediate strings.
+    @param filename: Path of the file.
+    @param hasUtteranceIDs: If True, the first column is an utterance ID (as in CTM files)
+                            and a new utterance starts whenever it changes.
+                            Otherwise, utterances are numbered, starting at 0.
+    @param keepConfidenceStrings: If True, the confidences are also kept as written in the file,
+                                  e.g. to write them again without changing their format.
+    """
+    utteranceID = None
+    numUtterances = 0
+    tokens = list()
+    confidences = array('d')
+    confidenceStrings = list() if keepConfidenceStrings else None
+    with open(filename) as f:
+        for lineNumber, line in enumerate(f):
+            columns = line.split()
+            if len(columns) == 0 or columns[0].startswith(';;'):
+                if len(columns) == 0 and len(tokens) > 0:
+                    yield MBRUtterance(utteranceID, tokens, confidences, confidenceStrings)
+                    numUtterances += 1
+                    utteranceID = None
+                    tokens = list()
+                    confidences = array('d')
+                    confidenceStrings = list() if keepConfidenceStrings else None
+                continue
+            if len(columns) < 2:
+                raise ValueError('Bad line in MBR file {0} at line {1}: {2}'.format(filename, lineNumber + 1, line))
+
+            if hasUtteranceIDs:
+                if columns[0] != utteranceID and len(tokens) > 0:
+                    yield MBRUtterance(utteranceID, tokens, confidences, confidenceStrings)
+                    numUtterances += 1
+                    tokens = list()
+                    confidences = array('d')
+                    confidenceStrings = list() if keepConfidenceStrings else None
+                utteranceID = columns[0]
+            elif utteranceID is None:
+                utteranceID = numUtterances
+            tokens.append(intern(columns[-2]))
+            confidences.append(float(columns[-1]))
+            if keepConfidenceStrings:
+                confidenceStrings.append(columns[-1])
+    if len(tokens) > 0:
+        yield MBRUtterance(utteranceID, tokens, confidences, confidenceStrings)
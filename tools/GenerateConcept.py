@@ -1,10 +1,29 @@
+import os
 import sys
 import re
+import math
 import operator
 import itertools
+import threading
+import hashlib
 from os import path
-
-from FileTools import loadAirlineCallsigns
+from array import array
+from collections import OrderedDict, namedtuple
+from bisect import bisect_left
+from multiprocessing import Pool
+
+from FileTools import loadAirlineCallsigns, iterMBRUtterances, hashModules
+from ParallelTools import getNumWorkers, iterPoolResults
+from ResourceRegistry import getSharedResource, RESOURCE_AIRLINES, RESOURCE_CONCEPT_GENERATOR
+from CommandSchema import COMMAND_SPECS, COMMAND_RELEVANT, COMMAND_IRRELEVANT, TAG_VALUE_TYPES, TAG_CONCEPTS
+from CommandSchema import CommandSpec, LIMIT_ABOVE, LIMIT_BELOW, LIMIT_EITHER
+from CommandSchema import VALUE_NUMBER, VALUE_WAYPOINT, VALUE_RUNWAY, VALUE_CONTACT, VALUE_FREQUENCY
+from AMANRecords import AMANCommand, formatCommands
+
+try:
+    import numpy
+except ImportError:  # NumPy is optional, confidence scores are then computed without it
+    numpy = None
 
 reOpenTag = re.compile('^<([a-z_]+)>$')
 reOpenAnyTag = re.compile('^<([a-z_="]+)>$')
@@ -14,6 +33,7 @@ xml_temp2 = '.*<{0}>([a-z ]*?)</{0}>.*'
 
 reCmdStart = re.compile('<command=\"([a-z_]+)\">')
 reConfid = re.compile(':[0-9].[0-9]*')
+reChunk = re.compile('<?[^\s<>]*>?')  # Whitespace separated string, with tags split off from adjacent words
 
 NO_CALLSIGN = 'NO_CALLSIGN'
 NO_AIRLINE = 'NO_AIRLINE_'
@@ -24,6 +44,13 @@ DEFAULT_SCORE = 1.0
 NOISE_TOKENS = ['_spn_', '_nsn_']
 PRECISION = 4
 CONF_SEPARATOR = ':'
+CONTEXT_EVENT_ADD = 'add'
+CONTEXT_EVENT_REMOVE = 'remove'
+BATCH_CHUNK_SIZE = 200  # Number of strings that recognizeBatch sends to a worker process at a time
+MIN_NORMAL_FLOAT = sys.float_info.min
+NUMPY_MIN_VALUES = 512  # Minimum number of confidence values for which scoring with NumPy pays off
+DEFAULT_MEMO_SIZE = 4096  # Number of recognition results a ConceptGenerator keeps
+MAX_VOCABULARY_SIZE = 65536  # Number of tokens after which a new TokenVocabulary is started
 
 CONFMODE_OFF = 0
 CONFMODE_MIN = 1
@@ -37,10 +64,90 @@ CONFIDENCE_SUM_MODES = dict(off=CONFMODE_OFF,
                             gmean=CONFMODE_GEOMEAN)
 
 
+RecognitionResult = namedtuple('RecognitionResult', ['commands', 'error'])
+
+# Generator and callsign context used by worker processes of ConceptGenerator.recognizeBatch.
+# They are set before the worker pool is forked.
+_workerGenerator_ = None
+_workerContext_ = None
+_codeVersion_ = None  # See _getCodeVersion_
+
+
 def prod(iterable):
     return reduce(operator.mul, iterable, 1)
 
 
+def getConfidenceScore(confidences, mode):
+    """
+    Combines a sequence of confidence values into a single score according to a CONFMODE.
+    Returns None for CONFMODE_OFF and -1.0 if there are no confidence values.
+    Products and geometric means whose product would underflow (e.g. on long utterances) are computed in log space.
+    Otherwise the product is computed directly, which gives the same results as before for decimal confidences
+    that are rounded to PRECISION.
+    """
+    if mode == CONFMODE_OFF:
+        return None
+    elif len(confidences) == 0:
+        return -1.0
+    elif mode == CONFMODE_MIN:
+        return min(confidences)
+    elif mode == CONFMODE_ARITMEAN:
+        return (1.0 / len(confidences)) * sum(confidences)
+    elif mode == CONFMODE_PROD or mode == CONFMODE_GEOMEAN:
+        product = prod(confidences)
+        if abs(product) < MIN_NORMAL_FLOAT and min(confidences) > 0:  # Underflow
+            logSum = math.fsum(map(math.log, confidences))
+            return math.exp(logSum) if mode == CONFMODE_PROD else math.exp(logSum / len(confidences))
+        return product if mode == CONFMODE_PROD else pow(product, 1.0 / len(confidences))
+    else:
+        e = "Unknown confidence calculation mode: {0}".format(mode)
+        raise ValueError(e)
+
+
+def getConfidenceScores(confidenceGroups, mode):
+    """
+    Computes the score (see getConfidenceScore) of each sequence of confidence values in confidenceGroups.
+    If NumPy is available and there are enough values, all scores are computed in a few vectorized operations.
+    """
+    if numpy is not None and mode != CONFMODE_OFF:
+        lengths = [len(confidences) for confidences in confidenceGroups]
+        if sum(lengths) >= NUMPY_MIN_VALUES:
+            return _getConfidenceScoresNumPy_(confidenceGroups, lengths, mode)
+    return [getConfidenceScore(confidences, mode) for confidences in confidenceGroups]
+
+
+def _getConfidenceScoresNumPy_(confidenceGroups, lengths, mode):
+    if mode not in (CONFMODE_MIN, CONFMODE_PROD, CONFMODE_ARITMEAN, CONFMODE_GEOMEAN):
+        e = "Unknown confidence calculation mode: {0}".format(mode)
+        raise ValueError(e)
+    lengths = numpy.array(lengths, dtype=numpy.int64)
+    values = numpy.fromiter(itertools.chain.from_iterable(confidenceGroups), dtype=numpy.float64,
+                            count=int(lengths.sum()))
+    hasValues = lengths > 0
+    groupLengths = lengths[hasValues]
+    groupStarts = (numpy.cumsum(lengths) - lengths)[hasValues]
+
+    scores = numpy.full(len(lengths), -1.0)
+    if len(groupStarts) > 0:
+        if mode == CONFMODE_MIN:
+            groupScores = numpy.minimum.reduceat(values, groupStarts)
+        elif mode == CONFMODE_ARITMEAN:
+            groupScores = (1.0 / groupLengths) * numpy.add.reduceat(values, groupStarts)
+        else:
+            with numpy.errstate(under='ignore'):
+                products = numpy.multiply.reduceat(values, groupStarts)
+            if mode == CONFMODE_PROD:
+                groupScores = products
+            else:
+                groupScores = numpy.power(products, 1.0 / groupLengths)
+            # Groups whose product underflows are computed in log space
+            for i in numpy.flatnonzero(numpy.abs(products) < MIN_NORMAL_FLOAT):
+                start = groupStarts[i]
+                groupScores[i] = getConfidenceScore(values[start:start + groupLengths[i]].tolist(), mode)
+        scores[hasValues] = groupScores
+    return scores.tolist()
+
+
 def reIsNotEmpty(re_groups, group_id=1):
     if re_groups is not None and len(re_groups.group(group_id).strip()) > 0:
         return True
@@ -74,101 +181,355 @@ def parseConfidenceMode(confidenceKey):
     return CONFIDENCE_SUM_MODES.get(confidenceKey, CONFMODE_OFF)
 
 
+def _getFileStamp_(filename):
+    """
+    Returns the (modification time, size) pair that is used to notice changes of a file.
+    """
+    try:
+        fileStat = os.stat(filename)
+    except OSError as e:
+        raise IOError(e.errno, e.strerror, filename)
+    return fileStat.st_mtime, fileStat.st_size
+
+
+def normalizeXML(string):
+    """
+    Returns a normalized form of an XML string, which only differs from that of another string
+    if the concept generator may give different results for them. Whitespace and case are normalized.
+    """
+    if string is None:
+        return None
+    return ' '.join(str(string).lower().split())
+
+
+class TokenVocabulary(object):
+    """
+    Maps token strings to IDs and back. Token IDs are only valid within the vocabulary that assigned them,
+    so every TokenBuffer keeps a reference to its vocabulary.
+    """
+    __slots__ = ('strings', 'ids', 'lock')
+
+    def __init__(self):
+        self.strings = list()  # Token strings, indexed by token ID
+        self.ids = dict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.strings)
+
+    def getID(self, token):
+        """
+        Returns the ID of a token string, adding the token to the vocabulary if it is new.
+        """
+        tokenID = self.ids.get(token)
+        if tokenID is None:
+            with self.lock:
+                tokenID = self.ids.get(token)
+                if tokenID is None:
+                    tokenID = len(self.strings)
+                    self.strings.append(intern(token))
+                    self.ids[token] = tokenID
+        return tokenID
+
+    def getIDs(self, tokens):
+        ids = self.ids
+        tokenIDs = [ids.get(token) for token in tokens]
+        if None in tokenIDs:  # Add new tokens to the vocabulary
+            tokenIDs = [self.getID(token) for token in tokens]
+        return tokenIDs
+
+
+_vocabulary = TokenVocabulary()
+_vocabularyLock = threading.Lock()
+
+
+def getVocabulary():
+    """
+    Returns the vocabulary for new TokenBuffers. Once it holds MAX_VOCABULARY_SIZE tokens, a new one is started,
+    so that long-running processes (e.g. the annotation server) don't keep every word they have ever seen.
+    Buffers of the previous vocabulary keep it alive for as long as they exist.
+    """
+    global _vocabulary
+    vocabulary = _vocabulary
+    if len(vocabulary) >= MAX_VOCABULARY_SIZE:
+        with _vocabularyLock:
+            if len(_vocabulary) >= MAX_VOCABULARY_SIZE:
+                _vocabulary = TokenVocabulary()
+            vocabulary = _vocabulary
+    return vocabulary
+
+
+def _mergeRanges_(ranges):
+    """
+    Sorts a list of (start, end) index ranges and merges ranges that overlap or touch.
+    """
+    merged = list()
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return tuple(merged)
+
+
+_openingTagInfos = dict()
+
+
+def getOpeningTagInfo(openingTag):
+    """
+    Returns a tuple (closingTag, isCommand, hasNoAttributes) for an opening tag.
+    The information is cached, as the same tags occur in most utterances.
+    """
+    info = _openingTagInfos.get(openingTag)
+    if info is None:
+        if openingTag.startswith('<command='):  # The ending tag for commands is just </command>
+            closingTag = '</command>'
+        else:
+            closingTag = '</' + openingTag[1:]
+        info = (closingTag, reCmdStart.match(openingTag) is not None, reOpenTag.match(openingTag) is not None)
+        _openingTagInfos[openingTag] = info
+    return info
+
+
+class TagIndex(object):
+    """
+    Index of the tags in a token sequence, mapping each opening tag to the positions at which it occurs
+    and each occurrence to the position after its closing tag.
+    As when scanning the tokens, an opening tag is closed by the first matching closing tag that follows it.
+    """
+    __slots__ = ('starts', 'ends', 'commandStarts', 'plainTagStarts', 'noisePositions', 'pending')
+
+    def __init__(self):
+        self.starts = dict()  # Opening tag -> positions of the tag
+        self.ends = dict()  # Position of an opening tag -> position after its closing tag
+        self.commandStarts = list()  # Positions of opening command tags
+        self.plainTagStarts = list()  # Positions of opening tags without attributes
+        self.noisePositions = list()
+        self.pending = dict()  # Closing tag -> positions of opening tags that are not closed yet
+
+    @classmethod
+    def fromTokens(cls, tokens):
+        tagIndex = cls()
+        for position, token in enumerate(tokens):
+            tagIndex.addToken(position, token)
+        return tagIndex
+
+    def addToken(self, position, token):
+        """
+        Adds the token at the given position. Tokens must be added in order.
+        """
+        if token[:2] == '</':
+            self.addClosingTag(position, token)
+        elif token[:1] == '<':
+            self.addOpeningTag(position, token)
+        elif token in NOISE_TOKENS:
+            self.noisePositions.append(position)
+
+    def addOpeningTag(self, position, token):
+        closingTag, isCommand, hasNoAttributes = getOpeningTagInfo(token)
+        if isCommand:
+            self.commandStarts.append(position)
+        elif hasNoAttributes:
+            self.plainTagStarts.append(position)
+        self.starts.setdefault(token, list()).append(position)
+        self.pending.setdefault(closingTag, list()).append(position)
+
+    def addClosingTag(self, position, token):
+        waiting = self.pending.pop(token, None)
+        if waiting is not None:
+            for start in waiting:
+                self.ends[start] = position + 1
+
+
+class TokenBuffer(object):
+    """
+    Columnar storage of the tokens of an utterance: an array of token IDs (see TokenVocabulary) and an array of
+    confidence values. All TagFrames extracted from an utterance are views on the same buffer.
+    """
+    __slots__ = ('vocabulary', 'tokenIDs', 'confidences', 'tagIndex')
+
+    def __init__(self, tokenPairs, tagIndex=None):
+        """
+        :param tokenPairs: List of (token, confidence) pairs.
+        :param tagIndex: TagIndex of the tokens. Is created from the tokens if not given.
+        """
+        self.vocabulary = getVocabulary()
+        self.tokenIDs = array('i', self.vocabulary.getIDs([token for token, _ in tokenPairs]))
+        self.confidences = array('d', [confidence for _, confidence in tokenPairs])
+        if tagIndex is None:
+            tagIndex = TagIndex.fromTokens(token for token, _ in tokenPairs)
+        self.tagIndex = tagIndex
+
+    def __len__(self):
+        return len(self.tokenIDs)
+
+    def __reduce__(self):
+        # Token IDs differ between processes, so pickle the token strings instead
+        tokenStrings = self.vocabulary.strings
+        return TokenBuffer, (zip([tokenStrings[tokenID] for tokenID in self.tokenIDs], self.confidences),)
+
+    def getToken(self, i):
+        return self.vocabulary.strings[self.tokenIDs[i]]
+
+
 class TagFrame(object):
     """
     A token sequence surrounded by an XML tag.
     Each token consists of a word/tag string and a confidence value.
+
+    The tokens are not stored in the frame itself. A frame is a view on a TokenBuffer,
+    covering the tokens from start up to (excluding) end, minus the excluded (start, end) ranges.
+    Extracting a subframe therefore creates a new view on the same buffer instead of copying tokens.
     """
+    __slots__ = ('buffer', 'start', 'end', 'exclusions', 'isStrict', 'ranges', 'length', 'indexCache')
     DEFAULT_CONFIDENCE = DEFAULT_SCORE
 
-    def __init__(self, tokenPairs, isStrict=False):
-        # Validate
-        if isStrict:
-            # Validate length of list
-            if len(tokenPairs) < 2:
-                raise ValueError("token pair list too short (len={0}): {1}".format(len(tokenPairs), tokenPairs))
-            # Validate tokenPairs is a pair list
-            if len(tokenPairs[0]) != 2:
-                raise ValueError("Invalid format for token pairs: {0}".format(tokenPairs))
+    def __init__(self, tokenPairs, isStrict=False, tagIndex=None):
+        # Validate tokenPairs is a pair list
+        if isStrict and len(tokenPairs) > 0 and len(tokenPairs[0]) != 2:
+            raise ValueError("Invalid format for token pairs: {0}".format(tokenPairs))
+        self._setView_(TokenBuffer(tokenPairs, tagIndex), 0, len(tokenPairs), (), isStrict)
+        self._validate_()
+
+    @classmethod
+    def fromBuffer(cls, buffer, start, end, exclusions=(), isStrict=False):
+        """
+        Creates a frame that is a view on part of an existing TokenBuffer.
+        exclusions is a sorted tuple of non-overlapping (start, end) ranges inside the view that are left out.
+        """
+        frame = cls.__new__(cls)
+        frame._setView_(buffer, start, end, exclusions, isStrict)
+        frame._validate_()
+        return frame
+
+    def _setView_(self, buffer, start, end, exclusions, isStrict):
+        self.buffer = buffer
+        self.start = start
+        self.end = end
+        self.exclusions = exclusions
+        self.isStrict = isStrict
+        # Buffer ranges of the visible tokens
+        if not exclusions:
+            self.ranges = [(start, end)] if start < end else []
+            self.length = max(0, end - start)
+        else:
+            ranges = list()
+            length = end - start
+            position = start
+            for excludedStart, excludedEnd in exclusions:
+                if excludedStart > position:
+                    ranges.append((position, excludedStart))
+                position = excludedEnd
+                length -= excludedEnd - excludedStart
+            if position < end:
+                ranges.append((position, end))
+            self.ranges = ranges
+            self.length = length
+        self.indexCache = None
+
+    def _validate_(self):
+        if not self.isStrict:
+            if self.length == 0:
+                raise IndexError("TagFrame has no tokens")
+            return
+
+        # Validate length of list
+        if self.length < 2:
+            raise ValueError("token pair list too short (len={0}): {1}".format(self.length, self.getFramePairs()))
 
         # Validate a tag is surrounding the sentence
-        firstToken = tokenPairs[0][0]
-        lastToken = tokenPairs[-1][0]
+        firstToken = self.getToken(0)
+        lastToken = self.getToken(-1)
         matchTag = reOpenTag.match(firstToken)
         matchCmd = reCmdStart.match(firstToken)
-
-        # More validation
-        if isStrict:
-            if not (matchCmd and lastToken == '</command>') and not (
-                    matchTag and lastToken == '</{0}>'.format(matchTag.group(1))):
-                raise ValueError(
-                    "First/Last item must be matching opening/closing xml tags: {0} ... {1}".format(firstToken,
-                                                                                                    lastToken))
-
-        self.tokenPairs = tokenPairs
-        self.isStrict = isStrict
+        if not (matchCmd and lastToken == '</command>') and not (
+                matchTag and lastToken == '</{0}>'.format(matchTag.group(1))):
+            raise ValueError(
+                "First/Last item must be matching opening/closing xml tags: {0} ... {1}".format(firstToken, lastToken))
 
     def __str__(self):
-        return 'TagFrame({0})'.format(self.tokenPairs)
+        return 'TagFrame({0})'.format(self.getFramePairs())
 
     @classmethod
     def loadFromMBR(cls, inputFile, isStrict=False):
         # mdr input (one token per line, multiple token features)
-        with open(inputFile) as f:
-            tokenPairs = list()
-            for line in f:
-                items = line.strip().lower().split()
-                token = items[-2]
-                confidence = float(items[-1])
-                tokenPairs.append((token, confidence))
-        tokenPairs = cls.repairTagStructure(tokenPairs)
-        return TagFrame(tokenPairs, isStrict)
+        # All utterances of the file are combined into a single frame
+        tokenPairs = list()
+        for utterance in iterMBRUtterances(inputFile):
+            tokenPairs.extend(zip([token.lower() for token in utterance.tokens], utterance.confidences))
+        tagIndex = TagIndex()
+        tokenPairs = cls.repairTagStructure(tokenPairs, tagIndex)
+        return TagFrame(tokenPairs, isStrict, tagIndex)
 
     @classmethod
     def loadFromString(cls, string, isStrict=False):
         if string is None:
             return None
 
+        tokenPairs = cls.tokenizeString(string)
+        if len(tokenPairs) == 0:
+            return None
+        else:
+            tagIndex = TagIndex()
+            tokenPairs = cls.repairTagStructure(tokenPairs, tagIndex)
+            return TagFrame(tokenPairs, isStrict, tagIndex)
+
+    @classmethod
+    def tokenizeString(cls, string):
+        """
+        Splits an xml-enhanced sentence into a list of (token, confidence) pairs in a single pass.
+        Tags are split off from adjacent words (workaround for faulty spacing around tags)
+        and a word:confidence token is split into its lowercased word and its confidence.
+        A confidence that is separated from its word (e.g. "word :0.9") is reattached to it.
+        """
         string = str(string)  # Ensure we are dealing with str, not unicode object
-        string = string.strip()
-        string = string.replace('>', '> ')  # Workaround for faulty spacing around tags
-        string = string.replace('<', ' <')
-        string = string.replace('  ', ' ')
-
-        stringtmp = ''
-        for s in string.split():
-            reSearch = re.search(reConfid, s)
-            if reSearch is not None:
-                stringtmp = stringtmp + ' ' + s.replace(reSearch.group(0), ' ' + reSearch.group(0) + ' ')
+        tokenPairs = list()
+        token = None
+        for chunk in reChunk.findall(string):
+            if not chunk:
+                continue
+            if CONF_SEPARATOR in chunk:
+                parts = [chunk]
+                reSearch = reConfid.search(chunk)
+                if reSearch is not None:  # Split off confidence and anything that follows it
+                    confidence = reSearch.group(0)
+                    parts = chunk.replace(confidence, ' ' + confidence + ' ').split()
             else:
-                stringtmp = stringtmp + ' ' + s
-        string = (' '.join(stringtmp.split())).replace(' :', ':')
+                parts = [chunk]
+            for part in parts:
+                if part[0] == CONF_SEPARATOR and token is not None:
+                    token += part  # Belongs to the preceding token
+                else:
+                    if token is not None:
+                        tokenPairs.append(cls._toTokenPair_(token))
+                    token = part
+        if token is not None:
+            tokenPairs.append(cls._toTokenPair_(token))
+        return tokenPairs
 
-        string = string.strip().lower()
-        if len(string) == 0:
-            return None
+    @classmethod
+    def _toTokenPair_(cls, token):
+        token = token.lower()
+        if CONF_SEPARATOR in token:
+            word, confidence = token.split(CONF_SEPARATOR, 1)
+            return word, float(confidence)
         else:
-            tokenPairs = list()
-            for word in string.split():
-                confidence = cls.DEFAULT_CONFIDENCE
-                if CONF_SEPARATOR in word:
-                    word, confidence = word.split(CONF_SEPARATOR, 1)
-                    confidence = float(confidence)
-                tokenPairs.append((word, confidence))
-            tokenPairs = cls.repairTagStructure(tokenPairs)
-            return TagFrame(tokenPairs, isStrict)
+            return token, cls.DEFAULT_CONFIDENCE
 
     @classmethod
-    def repairTagStructure(cls, tokenPairs):
+    def repairTagStructure(cls, tokenPairs, tagIndex=None):
         """
         Fixes a sentence so that all XML tags that were opened are also closed at the end.
         Input is a list of token pairs (i.e. (word,confidence))
+        If tagIndex is given, the tokens of the repaired sentence are added to this TagIndex in the same pass.
         """
         repairedTokenPairs = list()
         openTags = list()
         for tokenPair in tokenPairs:
             word = tokenPair[0]
-            if reOpenAnyTag.match(word):
+            isTag = word[:1] == '<'  # Cheap test before the regular expressions
+            if isTag and reOpenAnyTag.match(word):
                 # The only tags surrounding a command should be <s> and <commands>
                 # Close all other tags when a new command starts
                 if word.startswith('<command='):
@@ -177,17 +538,19 @@ class TagFrame(object):
                             break
                         else:
                             openTag = openTags.pop()
-                            cls._appendClosingPair_(repairedTokenPairs, openTag)
+                            cls._appendClosingPair_(repairedTokenPairs, openTag, tagIndex)
 
                 # Add the opened tag
                 openTags.append(word)
+                if tagIndex is not None:
+                    tagIndex.addOpeningTag(len(repairedTokenPairs), word)
                 repairedTokenPairs.append(tokenPair)
-            elif reCloseTag.match(word):
+            elif isTag and reCloseTag.match(word):
                 matchFound = False
                 # Close all tags up until and including the current one
                 while not matchFound and len(openTags) > 0:
                     openTag = openTags.pop()
-                    cls._appendClosingPair_(repairedTokenPairs, openTag)
+                    cls._appendClosingPair_(repairedTokenPairs, openTag, tagIndex)
                     closeTag = repairedTokenPairs[-1][0]
                     if word == closeTag:
                         matchFound = True
@@ -196,15 +559,20 @@ class TagFrame(object):
                 # This should make bug hunting easier than just not printing it.
                 if not matchFound:
                     openPair = ('<' + word[2:], cls.DEFAULT_CONFIDENCE)
+                    if tagIndex is not None:
+                        tagIndex.addOpeningTag(len(repairedTokenPairs), openPair[0])
+                        tagIndex.addClosingTag(len(repairedTokenPairs) + 1, word)
                     repairedTokenPairs.append(openPair)
                     repairedTokenPairs.append(tokenPair)  # This is the closing tag
             else:  # Regular word
+                if tagIndex is not None and (isTag or word in NOISE_TOKENS):
+                    tagIndex.addToken(len(repairedTokenPairs), word)
                 repairedTokenPairs.append(tokenPair)
 
         # If there are any tags left open, close them at the end of the utterance.
         while len(openTags) > 0:
             openTag = openTags.pop()
-            cls._appendClosingPair_(repairedTokenPairs, openTag)
+            cls._appendClosingPair_(repairedTokenPairs, openTag, tagIndex)
 
         return repairedTokenPairs
 
@@ -221,53 +589,81 @@ class TagFrame(object):
         return closingTag
 
     @classmethod
-    def _appendClosingPair_(cls, tokenPairs, openTag):
+    def _appendClosingPair_(cls, tokenPairs, openTag, tagIndex=None):
         """
         Convenience method that takes an opening tag,
         calculates its closing tag, turns it into a (tag,confidence) pair
         and appends it to the given token pair list.
+        If tagIndex is given, the closing tag is also added to the index.
         """
-        closeTag = cls.getClosingTag(openTag)
+        closeTag = getOpeningTagInfo(openTag)[0]
         closePair = (closeTag, cls.DEFAULT_CONFIDENCE)
+        if tagIndex is not None:
+            tagIndex.addClosingTag(len(tokenPairs), closeTag)
         tokenPairs.append(closePair)
 
     def __len__(self):
-        return len(self.tokenPairs)
+        return self.length
 
     def isEmptyTag(self):
         return len(self) <= 2
 
-    def getFramePairs(self, contentOnly=False):
+    def _getIndices_(self, contentOnly=False):
+        """
+        Returns the buffer indices of the tokens in this frame.
+        If contentOnly is true, the indices of the surrounding tags are left out.
+        """
+        if self.indexCache is None:
+            if len(self.ranges) == 1:
+                self.indexCache = range(*self.ranges[0])
+            else:
+                self.indexCache = list()
+                for rangeStart, rangeEnd in self.ranges:
+                    self.indexCache.extend(xrange(rangeStart, rangeEnd))
         if contentOnly:
-            return self.tokenPairs[1:-1]
+            return self.indexCache[1:-1]
         else:
-            return self.tokenPairs
+            return self.indexCache
+
+    def _getIndex_(self, i):
+        """
+        Returns the buffer index of the ith token in this frame. Negative values count from the end.
+        """
+        if i < 0:
+            i += self.length
+        if not 0 <= i < self.length:
+            raise IndexError("TagFrame index out of range")
+        if len(self.ranges) == 1:
+            return self.ranges[0][0] + i
+        for rangeStart, rangeEnd in self.ranges:
+            if i < rangeEnd - rangeStart:
+                return rangeStart + i
+            i -= rangeEnd - rangeStart
+
+    def getFramePairs(self, contentOnly=False):
+        return zip(self.getTokens(contentOnly), self.getConfidenceValues(contentOnly))
 
     def getSplitPairs(self, contentOnly=False):
-        tokenPairs = self.getFramePairs(contentOnly)
-        tokens = list()
-        confidences = list()
-        for token, confidence in tokenPairs:
-            tokens.append(token)
-            confidences.append(confidence)
-        return tokens, confidences
+        return self.getTokens(contentOnly), self.getConfidenceValues(contentOnly)
 
     def getTokens(self, contentOnly=False):
-        tokenPairs = self.getFramePairs(contentOnly)
-        return [token for token, _ in tokenPairs]
+        tokenIDs = self.buffer.tokenIDs
+        tokenStrings = self.buffer.vocabulary.strings
+        return [tokenStrings[tokenIDs[i]] for i in self._getIndices_(contentOnly)]
 
     def getConfidenceValues(self, contentOnly=False):
-        tokenPairs = self.getFramePairs(contentOnly)
-        return [confidence for _, confidence in tokenPairs]
+        confidences = self.buffer.confidences
+        return [confidences[i] for i in self._getIndices_(contentOnly)]
 
     def getFramePair(self, i):
-        return self.tokenPairs[i]
+        i = self._getIndex_(i)
+        return self.buffer.getToken(i), self.buffer.confidences[i]
 
     def getToken(self, i):
-        return self.tokenPairs[i][0]
+        return self.buffer.getToken(self._getIndex_(i))
 
     def getConfidenceValue(self, i):
-        return self.tokenPairs[i][1]
+        return self.buffer.confidences[self._getIndex_(i)]
 
     def containsTerm(self, term, termIsSet=False):
         if termIsSet:
@@ -282,35 +678,114 @@ class TagFrame(object):
     def toString(self, contentOnly=False):
         return ' '.join(self.getTokens(contentOnly=contentOnly))
 
-    @staticmethod
-    def _splitByMatch_(tokenPairs, matchFunc, n=0, assignMatchToHead=False):
-        """
-        Splits a list of tuples according to a matching function.
-        The matching function is applied to the nth item of the tuple (default 0).
-        Returns two lists. The second list starts with the matched item.
-        If no match was found, returns the full list as first element and None as second element.
-        """
-        for i in range(len(tokenPairs)):
-            token = tokenPairs[i][n]
-            if matchFunc(token):
-                if assignMatchToHead:
-                    head = tokenPairs[:i + 1]
-                    tail = tokenPairs[i + 1:]
-                else:
-                    head = tokenPairs[:i]
-                    tail = tokenPairs[i:]
-                return head, tail
-        # In case no item matched
-        return tokenPairs, None
+    def _findMatch_(self, matchFunc, n=0, fromIndex=None, toIndex=None):
+        """
+        Returns the buffer index of the first visible token for which matchFunc returns true, or None.
+        The matching function is applied to the token (n=0) or its confidence value (n=1).
+        If fromIndex or toIndex are given, only tokens from fromIndex up to (excluding) toIndex are searched.
+        """
+        if n == 0:
+            values = self.buffer.tokenIDs
+            tokenStrings = self.buffer.vocabulary.strings
+        else:
+            values = self.buffer.confidences
+            tokenStrings = None
+        for rangeStart, rangeEnd in self._iterRanges_(fromIndex, toIndex):
+            for i in xrange(rangeStart, rangeEnd):
+                value = values[i] if tokenStrings is None else tokenStrings[values[i]]
+                if matchFunc(value):
+                    return i
+        return None
+
+    def _iterRanges_(self, fromIndex=None, toIndex=None):
+        """
+        Yields the visible buffer ranges, limited to the buffer indices from fromIndex up to (excluding) toIndex.
+        """
+        for rangeStart, rangeEnd in self.ranges:
+            if fromIndex is not None and rangeStart < fromIndex:
+                rangeStart = fromIndex
+            if toIndex is not None and rangeEnd > toIndex:
+                rangeEnd = toIndex
+            if rangeStart < rangeEnd:
+                yield rangeStart, rangeEnd
+
+    def _isVisible_(self, i):
+        if len(self.ranges) == 1:
+            return self.ranges[0][0] <= i < self.ranges[0][1]
+        for rangeStart, rangeEnd in self.ranges:
+            if rangeStart <= i < rangeEnd:
+                return True
+        return False
+
+    def _findIndexed_(self, positions, fromIndex=None, toIndex=None):
+        """
+        Returns the first of the sorted buffer positions that is visible in the frame, or None.
+        If fromIndex or toIndex are given, only positions from fromIndex up to (excluding) toIndex are considered.
+        """
+        if fromIndex is None and toIndex is None and len(self.ranges) == 1:  # Shortcut for the most common case
+            i = bisect_left(positions, self.ranges[0][0])
+            if i < len(positions) and positions[i] < self.ranges[0][1]:
+                return positions[i]
+            return None
+        for rangeStart, rangeEnd in self._iterRanges_(fromIndex, toIndex):
+            i = bisect_left(positions, rangeStart)
+            if i < len(positions) and positions[i] < rangeEnd:
+                return positions[i]
+        return None
+
+    def _extractRange_(self, extractStart, extractEnd):
+        """
+        Splits the frame into a view on the buffer range from extractStart to extractEnd
+        and a view on the rest of the frame.
+        Both indices must be visible in the frame or at its end.
+        """
+        exclusions = self.exclusions
+        # Exclusions never overlap partially with the extracted range, as its limits are visible tokens
+        before = [exclusion for exclusion in exclusions if exclusion[1] <= extractStart]
+        after = [exclusion for exclusion in exclusions if exclusion[0] >= extractEnd]
+        innerExclusions = exclusions[len(before):len(exclusions) - len(after)]
+        # Merge adjacent exclusions, so that repeated extractions don't fragment the frame
+        excluded = (extractStart, extractEnd)
+        if before and before[-1][1] == extractStart:
+            excluded = (before.pop()[0], excluded[1])
+        if after and after[0][0] == extractEnd:
+            excluded = (excluded[0], after.pop(0)[1])
+        outerExclusions = tuple(before) + (excluded,) + tuple(after)
+        extractedFrame = TagFrame.fromBuffer(self.buffer, extractStart, extractEnd, innerExclusions, self.isStrict)
+        outerFrame = TagFrame.fromBuffer(self.buffer, self.start, self.end, outerExclusions, self.isStrict)
+        return extractedFrame, outerFrame
 
     def _extractSubframe_(self, startMatch, endMatch, n=0):
-        head, rest = TagFrame._splitByMatch_(self.tokenPairs, startMatch, n=n, assignMatchToHead=False)
-        if rest is None:
+        """
+        Extracts the tokens from the first token matching startMatch up to the next one matching endMatch.
+        If no token matches endMatch, the extracted frame extends to the end of the frame.
+        Returns views on the buffer of this frame, no tokens are copied.
+        """
+        extractStart = self._findMatch_(startMatch, n)
+        if extractStart is None:
             return None, self
-        body, tail = TagFrame._splitByMatch_(rest, endMatch, n=n, assignMatchToHead=True)
-        extractedFrame = TagFrame(body, self.isStrict)
-        outerFrame = TagFrame(head + tail, self.isStrict)
-        return extractedFrame, outerFrame
+        extractEnd = self._findMatch_(endMatch, n, fromIndex=extractStart)
+        if extractEnd is None:
+            extractEnd = self.ranges[-1][1]
+        else:
+            extractEnd += 1
+        return self._extractRange_(extractStart, extractEnd)
+
+    def _extractIndexed_(self, positions, startMatch, endMatch):
+        """
+        Extracts the tag that starts at the first visible one of the given positions, using the TagIndex of the buffer.
+        startMatch and endMatch are only used if the tag is not closed inside this frame,
+        in which case the frame is scanned like _extractSubframe_ does.
+        """
+        extractStart = self._findIndexed_(positions)
+        if extractStart is None:
+            return None, self
+        extractEnd = self.buffer.tagIndex.ends.get(extractStart)
+        if extractEnd is None:  # Tag is never closed
+            extractEnd = self.ranges[-1][1]
+        elif not self._isVisible_(extractEnd - 1):
+            return self._extractSubframe_(startMatch, endMatch)
+        return self._extractRange_(extractStart, extractEnd)
 
     def extractTag(self, tag, is_command=False):
         """
@@ -327,7 +802,10 @@ class TagFrame(object):
         else:
             startTag = '<{0}>'.format(tag)
             endTag = '</{0}>'.format(tag)
-        return self._extractSubframe_(startTag.__eq__, endTag.__eq__, n=0)
+        positions = self.buffer.tagIndex.starts.get(startTag)
+        if positions is None:
+            return None, self
+        return self._extractIndexed_(positions, startTag.__eq__, endTag.__eq__)
 
     def extractCommand(self):
         """
@@ -336,7 +814,7 @@ class TagFrame(object):
             extracted command frame and the later is the remaindEr of the parent frame
             without the extracted bit.
         """
-        return self._extractSubframe_(reCmdStart.match, '</command>'.__eq__, n=0)
+        return self._extractIndexed_(self.buffer.tagIndex.commandStarts, reCmdStart.match, '</command>'.__eq__)
 
     def extractNoise(self, startMatches=None, endMatches=None, contentOnly=False):
         """
@@ -350,76 +828,109 @@ class TagFrame(object):
            If endMatches is None, search continues until the end of the frame.
         """
         noiseSequence = [('<noise>', 1.0)]
-        if startMatches is None:
-            hasStarted = True  # If no start string is given, start immediately
-            startMatches = []
-        else:
-            hasStarted = False
-        if endMatches is None:
-            endMatches = []
-
-        for pair in self.getFramePairs(contentOnly):
-            token = pair[0]
-            if not hasStarted:  # Before noise sequence
-                # Look for start of search space 
-                if multiMatch(token, startMatches):
-                    hasStarted = True
-                    continue
-            else:  # Part of noise sequence
-                # Check if search space has ended
-                if multiMatch(token, endMatches):
-                    break
-                else:
-                    # Append noise words to sequence
-                    if token in NOISE_TOKENS:
-                        noiseSequence.append(pair)
+        if self.length > (2 if contentOnly else 0):
+            if contentOnly:
+                searchStart, searchEnd = self._getIndex_(1), self._getIndex_(-2) + 1
+            else:
+                searchStart, searchEnd = self._getIndex_(0), self._getIndex_(-1) + 1
+
+            if startMatches is not None:  # If no start string is given, start immediately
+                start = self._findMatch_(lambda token: multiMatch(token, startMatches), 0, searchStart, searchEnd)
+                searchStart = searchEnd if start is None else start + 1
+            if endMatches is not None and searchStart < searchEnd:
+                end = self._findMatch_(lambda token: multiMatch(token, endMatches), 0, searchStart, searchEnd)
+                if end is not None:
+                    searchEnd = end
+
+            # Look up the noise words between start and end
+            noisePositions = self.buffer.tagIndex.noisePositions
+            for i in noisePositions[bisect_left(noisePositions, searchStart):bisect_left(noisePositions, searchEnd)]:
+                if self._isVisible_(i):
+                    noiseSequence.append((self.buffer.getToken(i), self.buffer.confidences[i]))
 
         noiseSequence.append(('</noise>', 1.0))
 
         return TagFrame(noiseSequence, self.isStrict)
 
     def filterFrame(self):
-        filteredTokens = [self.getFramePair(0)]
+        """
+        Returns a view on the frame without the tags inside it and the tokens they surround.
+        A tag that is opened while another one is still open ends the exclusion at its own closing tag.
+        """
+        if self.length <= 2:
+            return self._filterFrameByScan_()
+        tagIndex = self.buffer.tagIndex
+        contentStart, contentEnd = self._getIndex_(1), self._getIndex_(-1)
+        exclusions = list(self.exclusions)
+        position = contentStart
+        while True:
+            tagStart = self._findIndexed_(tagIndex.plainTagStarts, position, contentEnd)
+            if tagStart is None:
+                break
+            current = tagStart
+            while True:
+                tagEnd = tagIndex.ends.get(current)
+                if tagEnd is None or tagEnd > contentEnd:  # Not closed inside the frame
+                    searchEnd = contentEnd
+                elif self._isVisible_(tagEnd - 1):
+                    searchEnd = tagEnd - 1
+                else:  # The closing tag was removed from this frame, there may be a later one
+                    return self._filterFrameByScan_()
+                nested = self._findIndexed_(tagIndex.plainTagStarts, current + 1, searchEnd)
+                if nested is None:
+                    break
+                current = nested  # Nested tags replace the tag whose end is searched for
+            exclusions.append((tagStart, searchEnd if searchEnd == contentEnd else tagEnd))
+            position = searchEnd + 1
+            if searchEnd == contentEnd:
+                break
+        return TagFrame.fromBuffer(self.buffer, self.start, self.end, _mergeRanges_(exclusions), self.isStrict)
+
+    def _filterFrameByScan_(self):
+        exclusions = list(self.exclusions)
         activeTag = None
-        for tokenPair in self.getFramePairs(contentOnly=True):
-            token = tokenPair[0]
+        tokenIDs = self.buffer.tokenIDs
+        tokenStrings = self.buffer.vocabulary.strings
+        for i in self._getIndices_(contentOnly=True):
+            token = tokenStrings[tokenIDs[i]]
             m_open = reOpenTag.match(token)
             if m_open:  # Opening a tag
                 activeTag = m_open.group(1)
             elif activeTag is None:  # Token is outside of tag and not a tag itself
-                filteredTokens.append(tokenPair)
+                continue
             elif token == '</{0}>'.format(activeTag):  # Token is closing the open tag
                 activeTag = None
-        filteredTokens.append(self.getFramePair(-1))
-        return TagFrame(filteredTokens, self.isStrict)
+            exclusions.append((i, i + 1))
+        return TagFrame.fromBuffer(self.buffer, self.start, self.end, _mergeRanges_(exclusions), self.isStrict)
 
     def getConfidenceScore(self, mode, contentOnly=False):
         return self.getJointConfidenceScore([self], mode, contentOnly)
 
     @staticmethod
-    def getJointConfidenceScore(frames, mode, contentOnly=False):
-        confidences = list()
+    def getJointConfidenceValues(frames, contentOnly=False):
+        confidences = array('d')
         for frame in frames:
             if frame is not None:
-                confidences.extend(frame.getConfidenceValues(contentOnly))
+                bufferConfidences = frame.buffer.confidences
+                confidences.extend(bufferConfidences[i] for i in frame._getIndices_(contentOnly))
+        return confidences
 
-        if mode is CONFMODE_OFF:
-            return None
-        else:
-            if len(confidences) == 0:
-                return -1.0
-            else:
-                if mode is CONFMODE_MIN:
-                    return min(confidences)
-                elif mode is CONFMODE_PROD:
-                    return prod(confidences)
-                elif mode is CONFMODE_ARITMEAN:
-                    return (1.0 / len(confidences)) * sum(confidences)
-                elif mode is CONFMODE_GEOMEAN:
-                    return pow(prod(confidences), 1.0 / len(confidences))
-                else:
-                    e = "Unknown confidence calculation mode: {0}".format(mode)
-                    raise ValueError(e)
+    @staticmethod
+    def getJointConfidenceScore(frames, mode, contentOnly=False):
+        return getConfidenceScore(TagFrame.getJointConfidenceValues(frames, contentOnly), mode)
+
+    @staticmethod
+    def getJointConfidenceScores(frameGroups, mode, contentOnly=False):
+        """
+        Computes the joint confidence scores of several lists of frames at once.
+        A list of frames that is None gets the score None.
+        """
+        if mode == CONFMODE_OFF:
+            return [None] * len(frameGroups)
+        scoredGroups = [frames for frames in frameGroups if frames is not None]
+        confidenceGroups = [TagFrame.getJointConfidenceValues(frames, contentOnly) for frames in scoredGroups]
+        scores = iter(getConfidenceScores(confidenceGroups, mode))
+        return [None if frames is None else next(scores) for frames in frameGroups]
 
 
 class UtteranceUnit(object):
@@ -470,6 +981,20 @@ class UtteranceUnit(object):
     NUMBER_VOCABULARY.update(MULTIPLIERS)
     NUMBER_VOCABULARY.add('and')
 
+    # Number of zeros that "thousand" and "hundred" stand for, depending on the type of the following word
+    NUMBER_END = 0  # No following word
+    NUMBER_TENS = 1  # Tens and teens, which fill two digits
+    NUMBER_SINGLE = 2
+    NUMBER_OTHER = 3
+    THOUSAND_ZEROS = {NUMBER_END: 3, NUMBER_TENS: 1, NUMBER_SINGLE: 2, NUMBER_OTHER: 3}
+    HUNDRED_ZEROS = {NUMBER_END: 2, NUMBER_TENS: 0, NUMBER_SINGLE: 1, NUMBER_OTHER: 2}
+    # Tens followed by other tens (e.g. "twenty thirty") get a zero unless the following one comes earlier
+    # in this order, in which the tens used to be replaced one after the other
+    TENS_ORDER = dict((tenner, order) for order, tenner in enumerate(TENS_DIGITS))
+
+    NUMBER_CACHE_SIZE = 10000
+    _numberCache = dict()  # Word tuple -> digit string, shared by all utterance units
+
     def __init__(self, utteranceFrame):
         self.utteranceFrame = utteranceFrame
 
@@ -481,84 +1006,105 @@ class UtteranceUnit(object):
         Converts a series of words into the correct digit representation.
         If isFrame is true, numberFrame must be a TagFrame object,
            if false, numberFrame must be a list of word strings.
+        Results are cached, as the same numbers occur over and over again.
         """
         if isFrame:
-            items = numberFrame.getTokens(contentOnly=True)
+            words = tuple(numberFrame.getTokens(contentOnly=True))
         else:
-            items = numberFrame
+            words = tuple(numberFrame)
 
-        # Filter out rogue words (e.g. silence markers and hesitation words)
-        items = [item for item in items if (item in self.NUMBER_VOCABULARY)]
+        number = self._numberCache.get(words)
+        if number is None:
+            number = self.parseNumberWords(words)
+            if len(self._numberCache) >= self.NUMBER_CACHE_SIZE:
+                self._numberCache.clear()
+            self._numberCache[words] = number
+        return number
 
-        # Prepare
-        while 'and' in items:  # Remove "and"
-            items.remove('and')
+    @classmethod
+    def parseNumberWords(cls, words):
+        """
+        Converts a sequence of words into the correct digit representation, without caching.
+        Each step is a single pass over the words, so parsing takes linear time.
+        """
+        # Filter out rogue words (e.g. silence markers and hesitation words) and "and"
+        items = [word for word in words if word in cls.NUMBER_VOCABULARY and word != 'and']
         # if speaker dropped the digit before thousand/hundred, it was a one
-        if len(items) > 0 and items[0] in ['thousand', 'hundred']:
+        if len(items) > 0 and items[0] in cls.SPECIAL_DIGITS:
             items.insert(0, 'one')
-        # Thousands
-        while 'thousand' in items:
-            i = items.index('thousand')
-            nxt = i + 1
-            nxt2 = nxt + 1
-            # thousand was last item
-            if nxt >= len(items):
-                items.extend(['zero'] * 3)
-            # if "x thousand y hundred", move on to parse "x y hundred"
-            elif nxt2 < len(items) and items[nxt2] == 'hundred':
-                pass
-            else:
-                if items[nxt] not in self.TENS_DIGITS and items[nxt] not in self.TEEN_DIGITS:
-                    if items[nxt] not in self.SINGLE_DIGITS:
-                        items.insert(nxt, 'zero')
-                    items.insert(nxt, 'zero')
-                items.insert(nxt, 'zero')
-            items.pop(i)
-        # Hundreds
-        while 'hundred' in items:
-            i = items.index('hundred')
-            nxt = i + 1
-            if nxt >= len(items):  # hundred was last item
-                items.extend(['zero'] * 2)
-            elif items[nxt] not in self.TENS_DIGITS and items[nxt] not in self.TEEN_DIGITS:
-                if items[nxt] not in self.SINGLE_DIGITS:
-                    items.insert(nxt, 'zero')
-                items.insert(nxt, 'zero')
-            items.pop(i)
-
-        for multiple, multiplier in self.MULTIPLIERS.iteritems():
-            while multiple in items:
-                i = items.index(multiple)
-                nxt = i + 1
-                if nxt < len(items):  # multiple wasn't last word
-                    next_item = items[nxt]
-                    for _ in range(1, multiplier):
-                        items.insert(nxt, next_item)
-                items.pop(i)
-
-        # Tens
-        for tenner, tenval in self.TENS_DIGITS.iteritems():
-            while tenner in items:
-                i = items.index(tenner)
-                nxt = i + 1
-                items[i] = tenval
-                if nxt >= len(items):  # Tenner was last item
-                    items.append('zero')
-                elif items[nxt] not in self.SINGLE_DIGITS or items[nxt] == 'zero':
-                    items.insert(nxt, 'zero')
-        # Teen values (11-19)
-        for teen, teenval in self.TEEN_DIGITS.iteritems():
-            while teen in items:
-                i = items.index(teen)
-                items[i] = teenval
-                items.insert(i, 'one')
+        # "x thousand y hundred" is parsed as "x y hundred"
+        if 'thousand' in items:
+            items = cls._replaceMagnitude_(items, 'thousand', cls.THOUSAND_ZEROS, skipBeforeHundred=True)
+        if 'hundred' in items:
+            items = cls._replaceMagnitude_(items, 'hundred', cls.HUNDRED_ZEROS)
+        for multiple, multiplier in cls.MULTIPLIERS.iteritems():
+            if multiple in items:
+                items = cls._replaceMultiple_(items, multiple, multiplier)
+
         # Parse
         num = []
+        lastIndex = len(items) - 1
         for i, item in enumerate(items):
-            if item in self.ALPHANUM:
-                num += self.ALPHANUM[item]
+            if item in cls.TENS_DIGITS:
+                num.append(cls.SINGLE_DIGITS[cls.TENS_DIGITS[item]])
+                nextItem = items[i + 1] if i < lastIndex else None
+                if nextItem in cls.TENS_DIGITS:
+                    needsZero = cls.TENS_ORDER[nextItem] >= cls.TENS_ORDER[item]
+                else:
+                    needsZero = nextItem not in cls.SINGLE_DIGITS or nextItem == 'zero'
+                if needsZero:
+                    num.append('0')
+            elif item in cls.TEEN_DIGITS:
+                num.append('1' + cls.SINGLE_DIGITS[cls.TEEN_DIGITS[item]])
+            elif item in cls.ALPHANUM:
+                num.append(cls.ALPHANUM[item])
         return ''.join(num)
 
+    @classmethod
+    def _getNumberWordType_(cls, word):
+        if word is None:
+            return cls.NUMBER_END
+        elif word in cls.TENS_DIGITS or word in cls.TEEN_DIGITS:
+            return cls.NUMBER_TENS
+        elif word in cls.SINGLE_DIGITS:
+            return cls.NUMBER_SINGLE
+        else:
+            return cls.NUMBER_OTHER
+
+    @classmethod
+    def _replaceMagnitude_(cls, items, magnitude, zeros, skipBeforeHundred=False):
+        """
+        Replaces each occurrence of magnitude (e.g. "thousand") with the number of zeros that the zeros table
+        gives for the type of the following word.
+        If skipBeforeHundred is true, the magnitude is dropped if the word after next is "hundred".
+        """
+        replaced = list()
+        lastIndex = len(items) - 1
+        for i, item in enumerate(items):
+            if item != magnitude:
+                replaced.append(item)
+            elif skipBeforeHundred and i + 1 < lastIndex and items[i + 2] == 'hundred':
+                continue
+            else:
+                nextItem = items[i + 1] if i < lastIndex else None
+                replaced.extend(['zero'] * zeros[cls._getNumberWordType_(nextItem)])
+        return replaced
+
+    @classmethod
+    def _replaceMultiple_(cls, items, multiple, multiplier):
+        """
+        Replaces each occurrence of multiple (e.g. "double") with copies of the following word.
+        A multiple that is followed by another multiple is dropped.
+        """
+        replaced = list()
+        lastIndex = len(items) - 1
+        for i, item in enumerate(items):
+            if item != multiple:
+                replaced.append(item)
+            elif i < lastIndex and items[i + 1] not in cls.MULTIPLIERS:
+                replaced.extend([items[i + 1]] * (multiplier - 1))
+        return replaced
+
 
 class Callsign(UtteranceUnit):
     """
@@ -567,17 +1113,17 @@ class Callsign(UtteranceUnit):
     AIRLINE_ALT_SPELLING = {"air_frans": "air_france",
                             "hansa": "lufthansa"}
 
-    def __init__(self, callsignFrame, airlineShorts, contextFile=None, isStrict=False):
+    def __init__(self, callsignFrame, airlineShorts, context=None, isStrict=False):
         """
         :param callsignFrame: must be a TagFrame for a callsign tag
         :param airlineShorts: is a dictionary of the official acronyms of airline names
-        :param contextFile: is the filename of the current_callsign file
+        :param context: is a CallsignContext of the currently active callsigns, or None
         :param isStrict:
         """
         super(Callsign, self).__init__(callsignFrame)
 
         self.airlineShorts = airlineShorts
-        self.contextFile = contextFile
+        self.context = context
         self.callsignFrame = self.utteranceFrame
         self.noiseFrame = None
 
@@ -591,7 +1137,7 @@ class Callsign(UtteranceUnit):
                 raise ValueError("Invalid format for callsign frame: " + str(self.callsignFrame))
 
             self.airlineFrame, self.flightnumberFrame, self.remainderFrame = self._extractSubframes_(self.callsignFrame)
-            self.callsign = self._computeCallsign_(self.airlineFrame, self.flightnumberFrame, self.contextFile)
+            self.callsign = self._computeCallsign_(self.airlineFrame, self.flightnumberFrame, self.context)
 
     def __str__(self):
         return 'Callsign({0})'.format(self.utteranceFrame)
@@ -609,7 +1155,7 @@ class Callsign(UtteranceUnit):
         flightnumberFrame, _ = remainderFrame.extractTag("flightnumber", is_command=False)
         return airlineFrame, flightnumberFrame, remainderFrame
 
-    def _computeCallsign_(self, airlineFrame, flightnumberFrame, contextFile=None):
+    def _computeCallsign_(self, airlineFrame, flightnumberFrame, context=None):
         # Check for empty tags
         hasFlightnumber = False
         if flightnumberFrame is not None:
@@ -641,7 +1187,7 @@ class Callsign(UtteranceUnit):
 
         # Try autocompleting callsign information 
         airsign, flightsign, _ = self.autocompleteCallsign(airsign, flightsign, airlineWord=airlineWord,
-                                                           contextFile=contextFile)
+                                                           context=context)
 
         callsign = airsign + flightsign
         return callsign
@@ -664,9 +1210,9 @@ class Callsign(UtteranceUnit):
 
         return callsigns
 
-    def autocompleteCallsign(self, airsign, flightsign, airlineWord=None, contextFile=None):
+    def autocompleteCallsign(self, airsign, flightsign, airlineWord=None, context=None):
         """
-        When airline or flightnumber are unknown, check the callsign context file
+        When airline or flightnumber are unknown, check the callsign context
         for possible partial matches.
         Additional functions:
         1. Checks whether ATC might have dropped a leading zero (e.g. AMB1 for AMB01)
@@ -674,65 +1220,64 @@ class Callsign(UtteranceUnit):
         2. Check whether airline could be leading flight number letter (and vice versa)
         Returns a triple (airsign, flightnumber, is_changed)
         """
-        if self.contextFile is not None:
-            context = self.loadContext(contextFile)
-            ambiguous_airsigns, ambiguous_flightsigns = self.getAmbiguousCallsigns(context)
-            # ### Complete Callsign ###
-            # Only checks for missing leading zeroes
-            if airsign is not NO_AIRLINE and flightsign != NO_FLIGHTNUMBER:
-                # First check if the regular callsign is in the context,
-                # then check if a leading zero was dropped (e.g. AMB1 for AMB01).
-                for this_flightsign in [flightsign, '0' + flightsign]:
-                    for ctx_airsign, ctx_flightsign in context:
-                        if ctx_airsign == airsign and this_flightsign == ctx_flightsign:
-                            return airsign, this_flightsign, True
-            # ### Missing Callsign ###
-            # Tries to autocomplete the callsign and checks for missing leading zeroes.
-            elif flightsign != NO_FLIGHTNUMBER:
-                # First check if the regular flightnumber is in the context,
-                # then check if a leading zero was dropped (e.g. AMB1 for AMB01).
-                for this_flightsign in [flightsign, '0' + flightsign]:
-                    if this_flightsign not in ambiguous_flightsigns:
-                        for ctx_airsign, ctx_flightsign in context:
-                            if this_flightsign == ctx_flightsign:
-                                return ctx_airsign, this_flightsign, True
-            # ### Missing Flightnumber ###
-            # Tries to autocomplete the flightnumber
-            elif airsign != NO_AIRLINE:
-                if airsign not in ambiguous_airsigns:
-                    for ctx_airsign, ctx_flightsign in context:
-                        if airsign == ctx_airsign:
-                            return airsign, ctx_flightsign, True
+        if context is not None:
+            for candidate in self._iterAutocompleteCandidates_(airsign, flightsign, airlineWord):
+                match = self._lookupContext_(context, *candidate)
+                if match is not None:
+                    return match[0], match[1], True
+
+        # In case of no good context (or no need for fixing anything), autocomplete fails and returns originals
+        return airsign, flightsign, False
+
+    def _iterAutocompleteCandidates_(self, airsign, flightsign, airlineWord=None):
+        """
+        Yields the (airsign, flightsign) readings of a callsign in the order in which they are looked up:
+        The callsign itself, the airline read as leading flight number letter and the first flight number letter
+        read as airline.
+        """
+        yield airsign, flightsign
 
         # Check whether airline should be a letter
-        if airlineWord is not None and airlineWord in self.LETTERS:
-            alt_airsign = NO_AIRLINE
-            alt_flightsign = self.LETTERS[airlineWord] + flightsign
-            new_airsign, new_flightsign, is_changed = self.autocompleteCallsign(alt_airsign, alt_flightsign,
-                                                                                airlineWord=None,
-                                                                                contextFile=contextFile)
-            if is_changed:
-                return new_airsign, new_flightsign, is_changed
+        if airlineWord in self.LETTERS:
+            for candidate in self._iterAutocompleteCandidates_(NO_AIRLINE, self.LETTERS[airlineWord] + flightsign):
+                yield candidate
 
         # Check whether first letter should be an airline
-        if len(flightsign) == 0:
-            first_letter = NO_FLIGHTNUMBER
-        else:
-            first_letter = flightsign[0]
-
-        if airsign == NO_AIRLINE and flightsign != NO_FLIGHTNUMBER and first_letter in self.LETTERWORDS:
-            for letterword in self.LETTERWORDS[first_letter]:
+        if airsign == NO_AIRLINE and flightsign != NO_FLIGHTNUMBER:
+            for letterword in self.LETTERWORDS.get(flightsign[:1], ()):
                 if letterword in self.airlineShorts:
-                    alt_airsign = self.airlineShorts[letterword]
-                    alt_flightsign = flightsign[1:]
-                    new_airsign, new_flightsign, is_changed = self.autocompleteCallsign(alt_airsign, alt_flightsign,
-                                                                                        airlineWord=None,
-                                                                                        contextFile=contextFile)
-                    if is_changed:
-                        return new_airsign, new_flightsign, is_changed
+                    for candidate in self._iterAutocompleteCandidates_(self.airlineShorts[letterword], flightsign[1:]):
+                        yield candidate
 
-        # In case of no good context (or no need for fixing anything), autocomplete fails and returns originals
-        return airsign, flightsign, False
+    @staticmethod
+    def _lookupContext_(context, airsign, flightsign):
+        """
+        Looks up a single reading of a callsign in the context.
+        Returns the completed (airsign, flightsign) pair, or None if the context has no unambiguous match.
+        """
+        # ### Complete Callsign ###
+        # Only checks for missing leading zeroes
+        if airsign is not NO_AIRLINE and flightsign != NO_FLIGHTNUMBER:
+            # First check if the regular callsign is in the context,
+            # then check if a leading zero was dropped (e.g. AMB1 for AMB01).
+            if airsign in context.airsignsByFlightsign.get(flightsign, ()):
+                return airsign, flightsign
+            paddedFlightsign = context.paddedFlightsigns.get(flightsign)
+            if paddedFlightsign is not None and airsign in context.airsignsByFlightsign[paddedFlightsign]:
+                return airsign, paddedFlightsign
+        # ### Missing Callsign ###
+        # Tries to autocomplete the callsign and checks for missing leading zeroes.
+        elif flightsign != NO_FLIGHTNUMBER:
+            for this_flightsign in (flightsign, context.paddedFlightsigns.get(flightsign)):
+                if this_flightsign in context.airsignsByFlightsign \
+                        and this_flightsign not in context.ambiguousFlightsigns:
+                    return context.airsignsByFlightsign[this_flightsign][0], this_flightsign
+        # ### Missing Flightnumber ###
+        # Tries to autocomplete the flightnumber
+        elif airsign != NO_AIRLINE:
+            if airsign in context.flightsignsByAirsign and airsign not in context.ambiguousAirsigns:
+                return airsign, context.flightsignsByAirsign[airsign][0]
+        return None
 
     @staticmethod
     def getAmbiguousCallsigns(context):
@@ -779,6 +1324,169 @@ class Callsign(UtteranceUnit):
             return [self.noiseFrame]
 
 
+class CallsignContext(object):
+    """
+    Snapshot of the currently active callsigns (e.g. of a current_callsign file), together with the information
+    that callsign autocompletion derives from them. Snapshots are never modified, so they can be shared by threads.
+    """
+    __slots__ = ('callsigns', 'ambiguousAirsigns', 'ambiguousFlightsigns', 'version',
+                 'flightsignsByAirsign', 'airsignsByFlightsign', 'paddedFlightsigns')
+
+    def __init__(self, callsigns, version=0):
+        """
+        :param callsigns: list of (airsign, flightsign) pairs
+        :param version: number that identifies this state of the context
+        """
+        self.callsigns = tuple(callsigns)
+        self.ambiguousAirsigns, self.ambiguousFlightsigns = Callsign.getAmbiguousCallsigns(self.callsigns)
+        self.version = version
+
+        # Indexes for autocompletion. Lists keep the order of the context, so the first entry is the first match.
+        self.flightsignsByAirsign = dict()
+        self.airsignsByFlightsign = dict()
+        self.paddedFlightsigns = dict()  # Flightsign without its leading zero -> flightsign
+        for airsign, flightsign in self.callsigns:
+            self.flightsignsByAirsign.setdefault(airsign, list()).append(flightsign)
+            self.airsignsByFlightsign.setdefault(flightsign, list()).append(airsign)
+            if flightsign[:1] == '0':
+                self.paddedFlightsigns[flightsign[1:]] = flightsign
+
+    def __len__(self):
+        return len(self.callsigns)
+
+
+class CallsignContextStore(object):
+    """
+    Loads a current_callsign file and keeps its CallsignContext until the file changes.
+    Whether the file changed is decided by its modification time and size, so the file is only read again
+    after it was rewritten. The store can be shared across threads.
+    """
+
+    def __init__(self, contextFile):
+        self.contextFile = contextFile
+        self.context = None
+        self.fileStamp = None
+        self.version = 0
+        self.lock = threading.Lock()
+
+    def getContext(self):
+        """
+        Returns the CallsignContext of the current file content, reloading the file if it changed.
+        """
+        fileStamp = _getFileStamp_(self.contextFile)
+        with self.lock:
+            if self.context is None or fileStamp != self.fileStamp:
+                self.version += 1
+                self.context = CallsignContext(Callsign.loadContext(self.contextFile), version=self.version)
+                self.fileStamp = fileStamp
+            return self.context
+
+
+class CallsignEventLogStore(object):
+    """
+    Follows an append-only log of callsign events, e.g. written by a radar feed, and keeps a CallsignContext of the
+    callsigns that are currently active.
+    Each line of the log is an event "add <airsign> <flightsign>" or "remove <airsign> <flightsign>". As in
+    current_callsign files, the airsign can be left out. Empty lines, lines starting with # and invalid lines are
+    ignored. Only lines that were appended since the last call are read, a line is only read once it is complete.
+    If the log is truncated or replaced by a new file, it is read again from the start.
+    The store can be shared across threads.
+    """
+
+    def __init__(self, logFile):
+        self.logFile = logFile
+        self.version = 0
+        self.lock = threading.Lock()
+        self._reset_()
+
+    def _reset_(self):
+        self.callsigns = OrderedDict()  # Active (airsign, flightsign) pairs in order of their addition
+        self.fileID = None
+        self.offset = 0
+        self.context = None
+
+    def getContext(self):
+        """
+        Returns a CallsignContext of the active callsigns, after applying all events that were added to the log.
+        """
+        with self.lock:
+            try:
+                fileStat = os.stat(self.logFile)
+            except OSError as e:
+                raise IOError(e.errno, e.strerror, self.logFile)
+            fileID = (fileStat.st_dev, fileStat.st_ino)
+            if fileID != self.fileID or fileStat.st_size < self.offset:
+                self._reset_()
+                self.fileID = fileID
+
+            isChanged = False
+            if fileStat.st_size > self.offset:
+                isChanged = self._readEvents_()
+            if self.context is None or isChanged:
+                self.version += 1
+                self.context = CallsignContext(self.callsigns.iterkeys(), version=self.version)
+            return self.context
+
+    def _readEvents_(self):
+        """
+        Applies the complete event lines that follow the current offset.
+        Returns True if the active callsigns changed.
+        """
+        with open(self.logFile, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read()
+        end = data.rfind('\n') + 1
+        self.offset += end
+        isChanged = False
+        for line in data[:end].splitlines():
+            if self.applyEvent(line):
+                isChanged = True
+        return isChanged
+
+    def applyEvent(self, line):
+        """
+        Applies a single event line to the active callsigns.
+        Returns True if the active callsigns changed.
+        """
+        elems = line.split()
+        if len(elems) == 2:
+            callsign = ('', elems[1])
+        elif len(elems) == 3:
+            callsign = (elems[1], elems[2])
+        else:
+            return False
+
+        action = elems[0]
+        if action == CONTEXT_EVENT_ADD and callsign not in self.callsigns:
+            self.callsigns[callsign] = True
+            return True
+        elif action == CONTEXT_EVENT_REMOVE and callsign in self.callsigns:
+            del self.callsigns[callsign]
+            return True
+        return False
+
+
+class CallsignEventLogWriter(object):
+    """
+    Appends callsign events to a log that is followed by a CallsignEventLogStore.
+    """
+
+    def __init__(self, logFile):
+        self.logFile = logFile
+
+    def add(self, airsign, flightsign):
+        self._writeEvent_(CONTEXT_EVENT_ADD, airsign, flightsign)
+
+    def remove(self, airsign, flightsign):
+        self._writeEvent_(CONTEXT_EVENT_REMOVE, airsign, flightsign)
+
+    def _writeEvent_(self, action, airsign, flightsign):
+        # Each event is written with a single call, so that readers never see parts of two events mixed up
+        line = ' '.join(elem for elem in [action, airsign, flightsign] if elem) + '\n'
+        with open(self.logFile, 'ab') as f:
+            f.write(line)
+
+
 class Command(UtteranceUnit):
     """
     Contains all information for a single command, including the callsign it is referring to.
@@ -794,6 +1502,16 @@ class Command(UtteranceUnit):
                      domux='DOMUX',
                      waypoint='Waypoint')
 
+    # Names of the methods that parse limits and values of the types used in the command schema
+    LIMIT_PARSERS = {LIMIT_ABOVE: 'parseAbove',
+                     LIMIT_BELOW: 'parseBelow',
+                     LIMIT_EITHER: 'parseEitherLimit'}
+    VALUE_PARSERS = {VALUE_NUMBER: 'parseNumberValue',
+                     VALUE_WAYPOINT: 'parseWaypoint',
+                     VALUE_RUNWAY: 'parseRunway',
+                     VALUE_CONTACT: 'parseContact',
+                     VALUE_FREQUENCY: 'parseFrequency'}
+
     def __init__(self, commandFrame, callsign, isStrict=False):
         """
         commandFrame must be a TagFrame surrounded by a command tag.
@@ -868,6 +1586,15 @@ class Command(UtteranceUnit):
         fix += self.parseNumber(items, isFrame=False)
         return fix
 
+    def parseNumberValue(self, valueFrame):
+        value = self.parseNumber(valueFrame)
+        try:
+            # Transform to int and back to string to get rid of leading zeroes etc.
+            value = str(int(value))
+        except ValueError:
+            pass  # If string-integer double transform fails, just use the regular word
+        return value
+
     def parseFrequency(self, frequencyFrame):
         num = self.parseNumber(frequencyFrame)
         if '.' not in num and len(num) > 3:
@@ -952,181 +1679,119 @@ class Command(UtteranceUnit):
     def computeCommand(self):
         """
         Generates the concept and value for the command and combines it with callsign to return the AMAN command for
-        this command object.
+        this command object. How a command is interpreted is defined by its entry in the command schema.
         """
         cmdType = self.getCommandType()
-        concept = cmdType.upper()
         conceptFrame = self.commandFrame
+        tagFrame = None
         # Look up and interpret command
+        spec = COMMAND_SPECS.get(cmdType)
 
         # ############# Relevant commands ##############
-        if cmdType in ['descend', 'climb', 'give_altitude', 'maintain_altitude',
-                       'rate_of_descent', 'rate_of_climb',
-                       'reduce', 'increase', 'give_speed', 'maintain_speed',
-                       'speed_own', 'reduce_final_app', 'reduce_min_clean',
-                       'turn', 'turn_heading', 'heading',
-                       'transition', 'direct_to',
-                       'cleared_ils',
-                       'handover']:
-            # Specify value frames
-            # Each tag set is a list of tuples (tagString, metricString).
-            # tagString is the name of the xml tag (e.g. speed for <speed>)
-            # metricString is the command's metric, given after the value (e.g. DESCEND 3000 ALT)
-            # If the command does not require metric info. use None for metricString
-            heightTags = [('flightlevel', 'FL'), ('altitude', 'ALT')]
-            fpmTags = [('feet_per_minute', None)]
-            speedTags = [('speed', None)]
-            degreeRelTags = [('degree_relative', None)]
-            degreeAbsTags = [('degree_absolute', None)]
-            waypointTags = [('waypoint', None), ('fix', None)]
-            runwayTags = [('runway', None)]
-            contactTags = [('contact', None), ('frequency', None)]
-            # Lists of xml tags to check for, depending on which command we are in
-            cmd2tag = [(['descend', 'climb', 'give_altitude', 'maintain_altitude'], heightTags),
-                       (['rate_of_descent', 'rate_of_climb'], fpmTags),
-                       (['reduce', 'increase', 'give_speed', 'maintain_speed'], speedTags),
-                       (['turn'], degreeRelTags),
-                       (['turn_heading', 'heading'], degreeAbsTags),
-                       (['transition', 'direct_to'], waypointTags),
-                       (['cleared_ils'], runwayTags),
-                       (['handover'], contactTags)]
-
-            tagFrame = None
+        if spec is not None and spec.kind == COMMAND_RELEVANT:
+            # Find the value frame, trying the command's value tags in order of preference
             tag = None
             metric = None
-            for cmdTypes, tags in cmd2tag:
-                if cmdType in cmdTypes:
-                    for tagString, metricString in tags:
-                        tagFrame, conceptFrame = self.commandFrame.extractTag(tagString)
-                        if tagFrame is not None:
-                            tag = tagString
-                            metric = metricString
-                            break  # Interrupt search when tag frame is found
+            for tagString, metricString in spec.valueTags:
+                tagFrame, conceptFrame = self.commandFrame.extractTag(tagString)
+                if tagFrame is not None:
+                    tag = tagString
+                    metric = metricString
+                    break  # Interrupt search when tag frame is found
 
             # Commands that can be parsed without a value
-            if cmdType in ['maintain_altitude', 'maintain_speed',
-                           'speed_own', 'reduce_final_app', 'reduce_min_clean']:
-                self.concept = concept
+            if spec.isValueOptional:
+                self.concept = spec.concept
                 self.isLegal = True  # Can be true without parsing value information
 
             # Parse concept and value information
             if self._isEmptyFrame_(tagFrame):
                 # For commands that change behaviour when they are missing a value.
-                if cmdType in ['heading']:
-                    self.concept = 'MAINTAIN_HEADING'
+                if spec.noValueConcept is not None:
+                    self.concept = spec.noValueConcept
                     self.isLegal = True
             else:
                 # Parse command type modifiers
-                if cmdType in ['descend', 'reduce', 'rate_of_climb']:
-                    concept += self.parseBelow(conceptFrame)
-                elif cmdType in ['increase', 'climb', 'rate_of_descent']:
-                    concept += self.parseAbove(conceptFrame)
-                elif cmdType in ['give_altitude', 'give_speed']:
-                    concept = cmdType[5:].upper()  # Cutting off the give_ part
-                    concept += self.parseEitherLimit(conceptFrame)
-                elif cmdType in ['maintain_speed']:
-                    limit = self.parseEitherLimit(conceptFrame)
-                    if limit != '':
-                        concept = 'SPEED' + limit
-                elif cmdType in ['maintain_altitude']:
-                    limit = self.parseEitherLimit(conceptFrame)
+                concept = spec.concept
+                if spec.limit is not None:
+                    limit = getattr(self, self.LIMIT_PARSERS[spec.limit])(conceptFrame)
                     if limit != '':
-                        concept = 'ALTITUDE' + limit
-                elif cmdType in ['turn', 'turn_heading']:
+                        concept = spec.limitedConcept + limit
+                elif spec.directionConcepts is not None:
                     directionFrame, _ = conceptFrame.extractTag('direction')
                     if self._isEmptyFrame_(directionFrame):
-                        if cmdType in ['turn']:
-                            concept = 'TURN_BY'
-                        elif cmdType in ['turn_heading']:
-                            concept = None  # Turn_Heading requires direction information
+                        concept = spec.directionConcepts[0]
                     else:
-                        direction = self.parseDirection(directionFrame)
-                        if cmdType in ['turn']:
-                            concept = 'TURN_{0}_BY'.format(direction)
-                        elif cmdType in ['turn_heading']:
-                            concept = 'TURN_{0}_HEADING'.format(direction)
+                        concept = spec.directionConcepts[1].format(self.parseDirection(directionFrame))
 
                 # Parse value
-                if tag in ['waypoint', 'fix']:
-                    value = self.parseWaypoint(tagFrame)
-                elif tag in ['runway']:
-                    value = self.parseRunway(tagFrame)
-                elif tag in ['contact']:
-                    value = self.parseContact(tagFrame)
-                elif tag in ['frequency']:
-                    value = self.parseFrequency(tagFrame)
-                    concept = 'HANDOVER_FREQUENCY'
-                else:
-                    value = self.parseNumber(tagFrame)
-                    try:
-                        # Transform to int and back to string to get rid of leading zeroes etc.
-                        value = str(int(value))
-                    except ValueError:
-                        pass  # If string-integer double transform fails, just use the regular word
+                valueType = TAG_VALUE_TYPES.get(tag, VALUE_NUMBER)
+                value = getattr(self, self.VALUE_PARSERS[valueType])(tagFrame)
+                concept = TAG_CONCEPTS.get(tag, concept)
 
                 # Update object variables
                 self.concept, self.value, self.metric = concept, value, metric
                 self.isLegal = True
 
         # ############# Irrelevant commands ##############
-        elif cmdType in ['init_response', 'report_speed', 'expect_ils', 'vector',
-                         'information', 'report_established', 'touchdown']:
+        elif spec is not None and spec.kind == COMMAND_IRRELEVANT:
             self.concept = NO_CONCEPT
             self.isLegal = True
-            tagFrame = None
 
         # ############# Unknown commands ##############
         else:
             self.concept = NO_CONCEPT
             self.isLegal = False
-            tagFrame = None
 
         conceptFrame = conceptFrame.filterFrame()
         self.conceptFrame = conceptFrame
         self.valueFrame = tagFrame
 
-    def getAMANString(self, mode, getConfidence=True, getSubconfidences=True):
+    def getAMANString(self, mode, getConfidence=True, getSubconfidences=True, scores=None):
+        return str(self.getAMANCommand(mode, getConfidence, getSubconfidences, scores=scores))
+
+    def getAMANCommand(self, mode, getConfidence=True, getSubconfidences=True, scores=None):
+        """
+        Returns the command as AMANCommand.
+        :param scores: Joint confidence scores of the frame groups of getConfidenceFrameGroups, if they were
+                       already computed (e.g. for many commands at once). Computed here if None.
+        """
         contentOnly = True
-        items = list()
-        sources = [(self.callsign, self.getCallsignConfidenceScore),
-                   (self.concept, self.getConceptConfidenceScore),
-                   (self.value, self.getValueConfidenceScore),
-                   (self.metric, self.getMetricConfidenceScore)]
 
         if mode == CONFMODE_OFF:
             getConfidence = False
             getSubconfidences = False
 
-        # Append tokens
-        for token, scoreFunc in sources:
-            if token is not None:
-                items.append(token)
-
-        # Get subconfidences
-        if getSubconfidences:
-            for token, scoreFunc in sources[:-1]:
-                score = scoreFunc(mode, contentOnly)
-                if score is None:
-                    score = DEFAULT_SCORE
-                else:
-                    score = round(score, PRECISION)
-                items.append(str(score))
-
-        # Append total confidence
-        if getConfidence:
-            score = self.getTotalConfidenceScore(mode, contentOnly)
+        # Subconfidences and total confidence
+        if scores is None:
+            frameGroups = self.getConfidenceFrameGroups(getConfidence, getSubconfidences)
+            scores = TagFrame.getJointConfidenceScores(frameGroups, mode, contentOnly=contentOnly)
+        confidences = list()
+        for score in scores:
             if score is None:
                 score = DEFAULT_SCORE
             else:
                 score = round(score, PRECISION)
-            items.append(str(score))
+            confidences.append(score)
 
-        return ' '.join(items)
+        return AMANCommand(self.callsign, self.concept, self.value, self.metric, confidences)
 
-    def getTotalConfidenceScore(self, mode, contentOnly):
+    def getConfidenceFrameGroups(self, getConfidence=True, getSubconfidences=True):
         """
-        Returns the confidence score for the entire command (including callsign).
+        Returns the lists of frames whose joint confidence scores are part of the AMAN string, in output order:
+        Callsign, concept and value (subconfidences), followed by the total confidence.
+        A value without frame is represented by None.
         """
+        frameGroups = list()
+        if getSubconfidences:
+            frameGroups.append(self.callsignObject.getFrames())
+            frameGroups.append([self.conceptFrame])
+            frameGroups.append(None if self.valueFrame is None else [self.valueFrame])
+        if getConfidence:
+            frameGroups.append(self._getTotalFrames_())
+        return frameGroups
+
+    def _getTotalFrames_(self):
         frames = list()
         funcs = self.callsignObject.getFrames()
         funcs.extend([self.conceptFrame,
@@ -1135,7 +1800,13 @@ class Command(UtteranceUnit):
         for frame in funcs:
             if frame is not None:
                 frames.append(frame)
-        return TagFrame.getJointConfidenceScore(frames, mode, contentOnly=contentOnly)
+        return frames
+
+    def getTotalConfidenceScore(self, mode, contentOnly):
+        """
+        Returns the confidence score for the entire command (including callsign).
+        """
+        return TagFrame.getJointConfidenceScore(self._getTotalFrames_(), mode, contentOnly=contentOnly)
 
     def getCallsignConfidenceScore(self, mode, contentOnly):
         return self.callsignObject.getConfidenceScore(mode, contentOnly)
@@ -1164,24 +1835,24 @@ class CommandSet:
     Collection of all commands of an utterance.
     """
 
-    def __init__(self, sentenceFrame, airlineShorts, contextFile, isStrict=False):
+    def __init__(self, sentenceFrame, airlineShorts, context, isStrict=False):
         """
         :param sentenceFrame: TagFrame of the entire utterance (i.e. the <s> tag)
         :param airlineShorts: dictionary of the official acronyms of airline names
-        :param contextFile: filename of the current_callsign file.
+        :param context: CallsignContext of the currently active callsigns, or None.
         :param isStrict:
         """
-        self.callsign, self.commands = self._extractData_(sentenceFrame, airlineShorts, contextFile, isStrict)
+        self.callsign, self.commands = self._extractData_(sentenceFrame, airlineShorts, context, isStrict)
 
     @staticmethod
-    def _extractData_(sentenceFrame, airlineShorts, contextFile, isStrict):
+    def _extractData_(sentenceFrame, airlineShorts, context, isStrict):
         cmds = list()
         if sentenceFrame is None:
-            callsign = Callsign(None, airlineShorts, contextFile, isStrict=isStrict)
+            callsign = Callsign(None, airlineShorts, context, isStrict=isStrict)
         else:
             # generate callsign object
             callsignFrame, remainderFrame = sentenceFrame.extractTag("callsign", is_command=False)
-            callsign = Callsign(callsignFrame, airlineShorts, contextFile, isStrict=isStrict)
+            callsign = Callsign(callsignFrame, airlineShorts, context, isStrict=isStrict)
             if not callsign.isCallsign():
                 callsign.addNoise(sentenceFrame)
 
@@ -1233,8 +1904,20 @@ class CommandSet:
         """
         Get a list of strings, each representing a single command in AMAN-interface format.
         """
-        # Split into proper (legal) commands and NO_CONCEPT instances
-        contentOnly = True
+        return formatCommands(self.getAMANCommands(mode, getConfidence, getSubconfidences))
+
+    def getAMANCommands(self, mode, getConfidence=True, getSubconfidences=True):
+        """
+        Get a list of AMANCommands, each representing a single command.
+        """
+        frameGroups = self.getConfidenceFrameGroups(mode, getConfidence, getSubconfidences)
+        scores = TagFrame.getJointConfidenceScores(frameGroups, mode, contentOnly=True)
+        return self.formatAMANCommands(mode, scores, getConfidence, getSubconfidences)
+
+    def _splitCommands_(self):
+        """
+        Splits the commands into proper (legal) commands and NO_CONCEPT instances.
+        """
         conceptCmds = list()
         noConceptCmds = list()
         for cmd in self.commands:
@@ -1242,81 +1925,436 @@ class CommandSet:
                 conceptCmds.append(cmd)
             else:
                 noConceptCmds.append(cmd)
+        return conceptCmds, noConceptCmds
 
-        outputs = list()
+    def getConfidenceFrameGroups(self, mode, getConfidence=True, getSubconfidences=True):
+        """
+        Returns the lists of frames whose joint confidence scores are part of the AMAN strings, in output order.
+        Computing the scores of many command sets in a single call of TagFrame.getJointConfidenceScores
+        and passing each set's scores to formatAMANCommands is faster than calling getAMANStrings for each set.
+        """
+        if mode == CONFMODE_OFF:
+            return []
+        conceptCmds, noConceptCmds = self._splitCommands_()
+        frameGroups = list()
         if len(conceptCmds) >= 1:
             # Utterance contained at least one proper command
             for cmd in conceptCmds:
-                string = cmd.getAMANString(mode, getConfidence, getSubconfidences)
-                outputs.append(string)
-        else:
-            # Utterance contained no proper command. Looking for unimportant/incomplete commands
+                frameGroups.extend(cmd.getConfidenceFrameGroups(getConfidence, getSubconfidences))
+        elif len(noConceptCmds) >= 1:
+            # Utterance contained no proper command, but at least one unimportant or incomplete command
             frames = dict(callsign=self.callsign.getFrames(),
                           concept=list(),
                           value=list(),
                           metric=list())
+            for cmd in noConceptCmds:
+                if cmd.conceptFrame is not None:
+                    frames['concept'].append(cmd.conceptFrame)
+                if cmd.valueFrame is not None:
+                    frames['value'].append(cmd.valueFrame)
+                if cmd.metricFrame is not None:
+                    frames['metric'].append(cmd.metricFrame)
+            frames['total'] = list(itertools.chain.from_iterable(frames.values()))
 
-            if len(noConceptCmds) >= 1:  # There is at least one unimportant or incomplete command
-                for cmd in noConceptCmds:
-                    if cmd.conceptFrame is not None:
-                        frames['concept'].append(cmd.conceptFrame)
-                    if cmd.valueFrame is not None:
-                        frames['value'].append(cmd.valueFrame)
-                    if cmd.metricFrame is not None:
-                        frames['metric'].append(cmd.metricFrame)
-
-            else:  # There are no commands, assume everything was noise
-                return []
-
-            # Prepare string construction
-            cmd = [self.callsign.callsign, NO_CONCEPT]
-            frames['total'] = itertools.chain.from_iterable(frames.values())
-
-            # Compute confidences
             items = list()
             if getSubconfidences:
                 items.extend(['callsign', 'concept', 'value'])
             if getConfidence:
                 items.append('total')
             for item in items:
-                score = TagFrame.getJointConfidenceScore(frames[item], mode, contentOnly=contentOnly)
-                if score is not None:
-                    score = round(score, PRECISION)
-                    cmd.append(str(score))
+                frameGroups.append(frames[item])
+        return frameGroups
 
-            outputs.append(' '.join(cmd))
+    def formatAMANStrings(self, mode, scores, getConfidence=True, getSubconfidences=True):
+        """
+        Returns the AMAN strings of the commands, given the scores of the frame groups of getConfidenceFrameGroups.
+        """
+        return formatCommands(self.formatAMANCommands(mode, scores, getConfidence, getSubconfidences))
 
+    def formatAMANCommands(self, mode, scores, getConfidence=True, getSubconfidences=True):
+        """
+        Returns the AMANCommands of the commands, given the scores of the frame groups of getConfidenceFrameGroups.
+        """
+        conceptCmds, noConceptCmds = self._splitCommands_()
+        outputs = list()
+        if len(conceptCmds) >= 1:
+            # Utterance contained at least one proper command
+            numScores = 0
+            if mode != CONFMODE_OFF:
+                numScores = (3 if getSubconfidences else 0) + (1 if getConfidence else 0)
+            for i, cmd in enumerate(conceptCmds):
+                command = cmd.getAMANCommand(mode, getConfidence, getSubconfidences,
+                                             scores=scores[i * numScores:(i + 1) * numScores])
+                outputs.append(command)
+        elif len(noConceptCmds) >= 1:
+            # Utterance contained no proper command. Looking for unimportant/incomplete commands
+            confidences = [round(score, PRECISION) for score in scores if score is not None]
+            outputs.append(AMANCommand(self.callsign.callsign, NO_CONCEPT, confidences=confidences))
+        # Otherwise there are no commands, assume everything was noise
         return outputs
 
 
+class RecognitionMemo(object):
+    """
+    Least recently used memo of the commands that were recognized for XML strings.
+    Entries are only valid for a single state of the concept generator (its airline dictionary and callsign context).
+    All entries are dropped when validate is called with a different state. The memo can be shared across threads.
+    """
+
+    def __init__(self, maxSize=DEFAULT_MEMO_SIZE):
+        self.maxSize = maxSize
+        self.entries = OrderedDict()  # Key -> tuple of AMANCommands, least recently used first
+        self.state = None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def validate(self, state):
+        """
+        Drops all entries if the generator's state changed since the last call.
+        """
+        with self.lock:
+            if state != self.state:
+                if len(self.entries) > 0:
+                    self.invalidations += 1
+                self.entries.clear()
+                self.state = state
+
+    def get(self, key):
+        """
+        Returns the commands stored for a key, or None.
+        """
+        with self.lock:
+            commands = self.entries.pop(key, None)
+            if commands is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries[key] = commands
+            return commands
+
+    def put(self, key, commands):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = tuple(commands)
+            while len(self.entries) > self.maxSize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def getNumLookups(self):
+        return self.hits + self.misses
+
+    def getHitRate(self):
+        """
+        Returns the fraction of lookups that found an entry.
+        """
+        numLookups = self.getNumLookups()
+        if numLookups == 0:
+            return 0.0
+        return float(self.hits) / numLookups
+
+    def __str__(self):
+        return '{0} lookups, {1} hits ({2:.1%} hit rate), {3} entries, {4} evictions, {5} invalidations'.format(
+            self.getNumLookups(), self.hits, self.getHitRate(), len(self.entries), self.evictions, self.invalidations)
+
+
 class ConceptGenerator:
     """
     Concept generator sets up information that is persistent across multiple
     utterances to avoid redundancy in loading files.
+
+    Commands recognized by recognizeString and recognizeBatch are memoized (see RecognitionMemo), keyed by the
+    normalized XML string, confidence mode, strictness and the versions of the airline dictionary and callsign
+    context. The airline file is loaded again when it changes, which, like a change of the context, clears the memo.
     """
 
-    def __init__(self, airlineFile, contextFile=None):
+    def __init__(self, airlineFile, contextFile=None, contextLog=None, memoSize=DEFAULT_MEMO_SIZE):
+        """
+        :param airlineFile: file storing airline callsign information
+        :param contextFile: current_callsign file listing the active callsigns, or None
+        :param contextLog: log of callsign events that is followed while recognizing (see CallsignEventLogStore),
+                           or None. Can't be combined with contextFile.
+        :param memoSize: Maximum number of recognition results that are memoized. 0 or None disables the memo.
+        """
         absolutepath = getAbsolutePath()
 
-        airlineFile = path.join(absolutepath, airlineFile)
-        self.airlineShorts = loadAirlineCallsigns(airlineFile)
+        self.airlineFile = path.join(absolutepath, airlineFile)
+        self.airlineStamp = _getFileStamp_(self.airlineFile)
+        self.airlineShorts = getSharedResource(RESOURCE_AIRLINES, self.airlineFile, loadAirlineCallsigns)
+        self.airlineVersion = 0
 
-        if contextFile is None:
-            self.contextFile = None
-        else:
+        self.memo = None
+        if memoSize:
+            self.memo = RecognitionMemo(memoSize)
+
+        if contextFile is not None and contextLog is not None:
+            raise ValueError('Use either a context file or a context log, not both')
+        self.contextFile = None
+        self.contextLog = None
+        self.contextStore = None
+        if contextFile is not None:
             self.contextFile = path.join(absolutepath, contextFile)
+            self.contextStore = CallsignContextStore(self.contextFile)
+        elif contextLog is not None:
+            self.contextLog = path.join(absolutepath, contextLog)
+            self.contextStore = CallsignEventLogStore(self.contextLog)
 
-    def recognize(self, sentenceFrame, confidenceMode=CONFMODE_OFF, isStrict=False):
-        commandSet = CommandSet(sentenceFrame, self.airlineShorts, self.contextFile, isStrict=isStrict)
-        return commandSet.getAMANStrings(confidenceMode, getConfidence=True, getSubconfidences=True)
+    def getContext(self):
+        """
+        Returns the current CallsignContext, or None if the generator has no context file.
+        """
+        if self.contextStore is None:
+            return None
+        return self.contextStore.getContext()
 
-    def recognizeString(self, string, confidenceMode=CONFMODE_OFF, isStrict=False):
-        sentenceFrame = TagFrame.loadFromString(string)
-        return self.recognize(sentenceFrame, confidenceMode=confidenceMode, isStrict=isStrict)
+    def getVersion(self):
+        """
+        Returns a string that identifies what the generator currently generates: it changes with the code of the
+        generator, the content of the airline file and the callsign context. Results that were cached with the same
+        version are still valid.
+        """
+        self._refreshAirlines_()
+        context = self.getContext()
+        sha = hashlib.sha1(_getCodeVersion_())
+        sha.update(repr(sorted(self.airlineShorts.iteritems())))
+        if context is not None:
+            sha.update(repr(context.callsigns))
+        return sha.hexdigest()
+
+    def _refreshAirlines_(self):
+        """
+        Loads the airline file again if it changed. If it can no longer be read, the loaded dictionary is kept.
+        """
+        try:
+            airlineStamp = _getFileStamp_(self.airlineFile)
+            if airlineStamp != self.airlineStamp:
+                airlineShorts = getSharedResource(RESOURCE_AIRLINES, self.airlineFile, loadAirlineCallsigns)
+                self.airlineStamp = airlineStamp
+                if airlineShorts is not self.airlineShorts:
+                    self.airlineShorts = airlineShorts
+                    self.airlineVersion += 1
+        except IOError:
+            pass
+
+    def _getMemoState_(self, context):
+        """
+        Returns the current state of the airline dictionary and the given context of this generator,
+        after dropping memoized results of earlier states.
+        """
+        state = (self.airlineVersion, None if context is None else context.version)
+        self.memo.validate(state)
+        return state
+
+    def recognize(self, sentenceFrame, confidenceMode=CONFMODE_OFF, isStrict=False, context=None, asRecords=False):
+        """
+        :param context: CallsignContext to use. Defaults to the current context of the generator.
+        :param asRecords: Return AMANCommands instead of strings.
+        """
+        if context is None:
+            self._refreshAirlines_()
+            context = self.getContext()
+        commandSet = CommandSet(sentenceFrame, self.airlineShorts, context, isStrict=isStrict)
+        commands = commandSet.getAMANCommands(confidenceMode, getConfidence=True, getSubconfidences=True)
+        if asRecords:
+            return commands
+        return formatCommands(commands)
+
+    def recognizeString(self, string, confidenceMode=CONFMODE_OFF, isStrict=False, context=None, asRecords=False):
+        """
+        Results are memoized, unless a context is given.
+        """
+        if self.memo is None or context is not None:
+            sentenceFrame = TagFrame.loadFromString(string)
+            return self.recognize(sentenceFrame, confidenceMode=confidenceMode, isStrict=isStrict, context=context,
+                                  asRecords=asRecords)
+
+        self._refreshAirlines_()
+        context = self.getContext()
+        key = (self._getMemoState_(context), confidenceMode, isStrict, normalizeXML(string))
+        commands = self.memo.get(key)
+        if commands is None:
+            sentenceFrame = TagFrame.loadFromString(string)
+            commands = self.recognize(sentenceFrame, confidenceMode=confidenceMode, isStrict=isStrict,
+                                      context=context, asRecords=True)
+            self.memo.put(key, commands)
+        if asRecords:
+            return list(commands)
+        return formatCommands(commands)
+
+    def recognizeBatch(self, strings, workers=1, confidenceMode=CONFMODE_OFF, isStrict=False,
+                       chunkSize=BATCH_CHUNK_SIZE, asRecords=False):
+        """
+        Generates the commands of many XML strings.
+        All strings are recognized with the same callsign context and identical strings are only recognized once.
+        Results are memoized like those of recognizeString.
+        Returns a list with one RecognitionResult per string, in input order. Instead of raising an exception,
+        errors are reported in the error field of a result, whose commands are then None.
+
+        :param strings: An iterable of XML strings.
+        :param workers: Number of worker processes. If None, one per CPU core is used.
+                        Batches that fit into a single chunk are always recognized in this process.
+        :param chunkSize: Number of strings that are sent to a worker process at a time.
+        :param asRecords: Return AMANCommands instead of strings.
+        """
+        uniqueIndices = dict()
+        uniqueStrings = list()
+        indices = list()
+        for string in strings:
+            if string not in uniqueIndices:
+                uniqueIndices[string] = len(uniqueStrings)
+                uniqueStrings.append(string)
+            indices.append(uniqueIndices[string])
+
+        self._refreshAirlines_()
+        context = self.getContext()
+        uniqueResults = [None] * len(uniqueStrings)
+        memoKeys = None
+        if self.memo is not None:
+            state = self._getMemoState_(context)
+            memoKeys = [(state, confidenceMode, isStrict, normalizeXML(string)) for string in uniqueStrings]
+            for i, key in enumerate(memoKeys):
+                commands = self.memo.get(key)
+                if commands is not None:
+                    uniqueResults[i] = RecognitionResult(commands, None)
+        missingIndices = [i for i, result in enumerate(uniqueResults) if result is None]
+        missingStrings = [uniqueStrings[i] for i in missingIndices]
+
+        chunkSize = max(1, chunkSize)
+        numWorkers = getNumWorkers(workers)
+        if numWorkers == 1 or len(missingStrings) <= chunkSize:
+            missingResults = self._recognizeChunk_(missingStrings, confidenceMode, isStrict, context)
+        else:
+            chunks = [missingStrings[i:i + chunkSize] for i in range(0, len(missingStrings), chunkSize)]
+            tasks = [(chunk, confidenceMode, isStrict) for chunk in chunks]
+            missingResults = list()
+            for chunkResults in self._iterWorkerPool_(tasks, numWorkers, context):
+                missingResults.extend(chunkResults)
+        for i, result in zip(missingIndices, missingResults):
+            uniqueResults[i] = result
+            if memoKeys is not None and result.commands is not None:
+                self.memo.put(memoKeys[i], result.commands)
+
+        results = list()
+        for index in indices:
+            result = uniqueResults[index]
+            if result.commands is not None:  # Callers may modify their command lists
+                if asRecords:
+                    result = result._replace(commands=list(result.commands))
+                else:
+                    result = result._replace(commands=formatCommands(result.commands))
+            results.append(result)
+        return results
+
+    def _recognizeChunk_(self, strings, confidenceMode, isStrict, context):
+        """
+        Recognizes a list of strings. Never raises an exception, errors are reported in the returned results.
+        Commands are returned as AMANCommands.
+        """
+        commandSets = list()
+        frameGroups = list()
+        groupRanges = list()
+        for string in strings:
+            try:
+                commandSet = CommandSet(TagFrame.loadFromString(string), self.airlineShorts, context,
+                                        isStrict=isStrict)
+                groups = commandSet.getConfidenceFrameGroups(confidenceMode)
+            except Exception as e:
+                commandSets.append(e)
+                groupRanges.append(None)
+                continue
+            commandSets.append(commandSet)
+            groupRanges.append((len(frameGroups), len(frameGroups) + len(groups)))
+            frameGroups.extend(groups)
+
+        # Score all command sets at once, unless there is an error, which is then reported by the affected sets
+        try:
+            scores = TagFrame.getJointConfidenceScores(frameGroups, confidenceMode, contentOnly=True)
+        except Exception:
+            scores = None
+
+        results = list()
+        for commandSet, groupRange in zip(commandSets, groupRanges):
+            try:
+                if isinstance(commandSet, Exception):
+                    raise commandSet
+                elif scores is None:
+                    commands = commandSet.getAMANCommands(confidenceMode)
+                else:
+                    commands = commandSet.formatAMANCommands(confidenceMode, scores[groupRange[0]:groupRange[1]])
+                results.append(RecognitionResult(commands, None))
+            except Exception as e:
+                results.append(RecognitionResult(None, '{0}: {1}'.format(type(e).__name__, e)))
+        return results
+
+    def _iterWorkerPool_(self, tasks, numWorkers, context):
+        """
+        Yields the results of recognizing chunks of strings, in order, in a pool of forked worker processes
+        that use this generator and the given context.
+        """
+        global _workerGenerator_, _workerContext_
+        _workerGenerator_ = self
+        _workerContext_ = context
+        pool = Pool(numWorkers)
+        isCompleted = False
+        try:
+            for result in iterPoolResults(pool, _recognizeChunkWorker_, tasks, 2 * numWorkers):
+                yield result
+            isCompleted = True
+        finally:
+            if isCompleted:
+                pool.close()
+            else:  # Consumer stopped early or an error occurred
+                pool.terminate()
+            pool.join()
+            _workerGenerator_ = None
+            _workerContext_ = None
 
     def extractCommand(self, string, isStrict=False):
+        self._refreshAirlines_()
         sentenceFrame = TagFrame.loadFromString(string)
-        return CommandSet(sentenceFrame, self.airlineShorts, self.contextFile, isStrict=isStrict)
+        return CommandSet(sentenceFrame, self.airlineShorts, self.getContext(), isStrict=isStrict)
+
+
+def _getCodeVersion_():
+    """
+    Returns a hash of the code that command generation depends on.
+    """
+    global _codeVersion_
+    if _codeVersion_ is None:
+        modules = [sys.modules[obj.__module__] for obj in (ConceptGenerator, CommandSpec, AMANCommand)]
+        _codeVersion_ = hashModules(modules)
+    return _codeVersion_
+
+
+def _recognizeChunkWorker_(task):
+    """
+    Entry point for worker processes of ConceptGenerator.recognizeBatch.
+    """
+    strings, confidenceMode, isStrict = task
+    return _workerGenerator_._recognizeChunk_(strings, confidenceMode, isStrict, _workerContext_)
+
+
+def getSharedConceptGenerator(airlineFile, contextFile=None):
+    """
+    Returns a ConceptGenerator that is shared by all callers in the process that use the same airline file
+    (with unchanged content) and context file. Paths are resolved like those of ConceptGenerator.
+    """
+    absolutepath = getAbsolutePath()
+    airlineFile = path.join(absolutepath, airlineFile)
+    if contextFile is not None:
+        contextFile = path.realpath(path.join(absolutepath, contextFile))
+    return getSharedResource(RESOURCE_CONCEPT_GENERATOR, airlineFile,
+                             lambda filename: ConceptGenerator(filename, contextFile=contextFile),
+                             extraKey=contextFile)
 
 
 def recognize(sentenceFrame, airlineFile, contextFile=None, confidenceMode=CONFMODE_OFF, isStrict=False):
@@ -1328,7 +2366,7 @@ def recognize(sentenceFrame, airlineFile, contextFile=None, confidenceMode=CONFM
     relative to the called script (i.e. sys.argv[0]), not pwd.
     This usually means you have to move back out of tools/ via ../
     """
-    generator = ConceptGenerator(airlineFile, contextFile=contextFile)
+    generator = getSharedConceptGenerator(airlineFile, contextFile=contextFile)
     return generator.recognize(sentenceFrame, confidenceMode=confidenceMode, isStrict=isStrict)
 
 
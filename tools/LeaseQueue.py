@@ -0,0 +1,346 @@
+"""
+File-based work queue that lets several processes, possibly on different machines sharing a (network) file system,
+work through the same list of items without a scheduler or message broker.
+
+The items are split into shards. A process works on a shard only while it holds the shard's lease, a file that is
+created atomically, so that only one process can hold it at a time. While working, the process renews the lease
+by updating its modification time. If a process crashes, its lease expires and the shard is taken over by another
+process. A finished shard gets a completion marker, which stores the shard's results.
+
+Layout of the queue directory:
+    shards.json         The list of shards. It is written once, by the first process.
+    leases/<shard>      Lease of a shard that is being worked on.
+    leases/<shard>.breaking
+                        Lock of a process that is breaking the expired lease of a shard.
+    done/<shard>        Completion marker of a finished shard.
+    clock/<node>        Used to read the file system's clock, which can differ from the local clock.
+"""
+
+import os
+import json
+import errno
+import socket
+import tempfile
+import threading
+from os import path
+from time import sleep
+
+from FileTools import writeFileAtomic
+
+DEFAULT_LEASE_TIMEOUT = 300  # Seconds after the last renewal that a lease expires
+RENEW_RETRY_DELAY = 1.0  # Seconds before a missing lease is looked for again, as it may be moved back (see Lease.renew)
+BREAK_LOCK_SUFFIX = '.breaking'
+SHARDS_FILENAME = 'shards.json'
+LEASE_DIRNAME = 'leases'
+DONE_DIRNAME = 'done'
+CLOCK_DIRNAME = 'clock'
+
+
+class LeaseLostError(Exception):
+    pass
+
+
+def createFileExclusive(filename, text):
+    """
+    Creates a file with the given text, unless the file already exists.
+    Other processes either see no file or the complete file.
+    Returns True if the file was created, False if it already existed.
+    """
+    directory, basename = path.split(path.abspath(filename))
+    fd, tmpFilename = tempfile.mkstemp(prefix='.{0}.'.format(basename), suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as w:
+            w.write(text)
+            w.flush()
+            os.fsync(w.fileno())
+        try:
+            os.link(tmpFilename, filename)  # Unlike rename, link never replaces an existing file
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        # On NFS, link can report an error even though it succeeded, so check the link count instead
+        return os.stat(tmpFilename).st_nlink == 2
+    finally:
+        os.remove(tmpFilename)
+
+
+def _makeDirs_(directory):
+    try:
+        os.makedirs(directory)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def _inspectFile_(filename):
+    """
+    Returns modification time and content of a file, or None if it doesn't exist.
+    """
+    try:
+        with open(filename) as f:
+            return os.fstat(f.fileno()).st_mtime, f.read()
+    except (IOError, OSError):
+        return None
+
+
+def _readJSON_(filename):
+    """
+    Returns the content of a JSON file, or None if it doesn't exist or can't be parsed.
+    """
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+class LeaseQueue:
+    """
+    Distributes shards of a list of items among processes that share a queue directory.
+    """
+
+    def __init__(self, queueDir, leaseTimeout=DEFAULT_LEASE_TIMEOUT, nodeID=None):
+        """
+        :param queueDir: Directory that stores shards, leases and completion markers.
+        :param leaseTimeout: Number of seconds after which a lease that was not renewed expires.
+                             Leases are renewed three times per timeout period.
+        :param nodeID: Name of this process in leases. Defaults to hostname and process ID.
+        """
+        self.queueDir = queueDir
+        self.leaseTimeout = leaseTimeout
+        if nodeID is None:
+            nodeID = '{0}-{1}'.format(socket.gethostname(), os.getpid())
+        self.nodeID = nodeID
+        self.shards = None
+        for dirname in [LEASE_DIRNAME, DONE_DIRNAME, CLOCK_DIRNAME]:
+            _makeDirs_(path.join(queueDir, dirname))
+
+    def createShards(self, items, shardSize):
+        """
+        Splits items into shards of shardSize items and stores them in the queue.
+        If another process already created the shards, its shards are used instead, so all processes work
+        on the same shards even if their item lists differ.
+        Returns the list of shards (lists of items).
+        """
+        shardSize = max(1, shardSize)
+        shards = [items[i:i + shardSize] for i in range(0, len(items), shardSize)]
+        createFileExclusive(path.join(self.queueDir, SHARDS_FILENAME), json.dumps(dict(shards=shards)))
+        return self.loadShards()
+
+    def loadShards(self):
+        content = _readJSON_(path.join(self.queueDir, SHARDS_FILENAME))
+        if content is None:
+            raise IOError('Queue {0} has no shards'.format(self.queueDir))
+        self.shards = content['shards']
+        return self.shards
+
+    def getShardName(self, shardIndex):
+        return '{0:06d}'.format(shardIndex)
+
+    def _getLeaseFile_(self, shardIndex):
+        return path.join(self.queueDir, LEASE_DIRNAME, self.getShardName(shardIndex))
+
+    def _getDoneFile_(self, shardIndex):
+        return path.join(self.queueDir, DONE_DIRNAME, self.getShardName(shardIndex))
+
+    def isDone(self, shardIndex):
+        return path.exists(self._getDoneFile_(shardIndex))
+
+    def isFinished(self):
+        return all(self.isDone(i) for i in range(len(self.shards)))
+
+    def getResults(self):
+        """
+        Returns a dictionary mapping the indices of finished shards to their results.
+        """
+        results = dict()
+        for i in range(len(self.shards)):
+            marker = _readJSON_(self._getDoneFile_(i))
+            if marker is not None:
+                results[i] = marker['result']
+        return results
+
+    def getFilesystemTime(self):
+        """
+        Returns the current time of the file system clock, which is the clock that lease times are based on.
+        """
+        clockFile = path.join(self.queueDir, CLOCK_DIRNAME, self.nodeID)
+        if not path.exists(clockFile):
+            open(clockFile, 'w').close()
+        os.utime(clockFile, None)
+        return os.stat(clockFile).st_mtime
+
+    def tryAcquire(self, shardIndex):
+        """
+        Tries to get the lease of a shard that is not done yet. Expired leases of other processes are taken over.
+        Returns a Lease, or None if the shard is done or leased by another process.
+        """
+        if self.isDone(shardIndex):
+            return None
+        leaseFile = self._getLeaseFile_(shardIndex)
+        if path.exists(leaseFile + BREAK_LOCK_SUFFIX):
+            # Another process is breaking the lease and may have to give it back
+            self._removeStaleBreakLock_(leaseFile + BREAK_LOCK_SUFFIX)
+            return None
+        if not createFileExclusive(leaseFile, json.dumps(dict(node=self.nodeID))):
+            if not self._breakExpiredLease_(leaseFile):
+                return None
+            if not createFileExclusive(leaseFile, json.dumps(dict(node=self.nodeID))):
+                return None  # Another process was faster
+        if self.isDone(shardIndex):  # Finished by another process just now
+            os.remove(leaseFile)
+            return None
+        return Lease(self, shardIndex, self.shards[shardIndex], leaseFile)
+
+    def _breakExpiredLease_(self, leaseFile):
+        """
+        Removes a lease if it has expired. Returns True if the lease is gone.
+        Only the process that holds the lease's break lock may break it. It moves the lease to a tombstone and
+        only removes it if it is still the expired lease that was inspected. If the owner renewed the lease just
+        before it was moved, the same file is linked back, which the owner's renew waits for.
+        """
+        lease = _inspectFile_(leaseFile)
+        if lease is None:
+            return True  # Lease was released in the meantime
+        if self.getFilesystemTime() - lease[0] <= self.leaseTimeout:
+            return False
+        lockFile = leaseFile + BREAK_LOCK_SUFFIX
+        if not createFileExclusive(lockFile, json.dumps(dict(node=self.nodeID))):
+            self._removeStaleBreakLock_(lockFile)
+            return False
+        try:
+            currentLease = _inspectFile_(leaseFile)
+            if currentLease != lease:
+                return currentLease is None  # Renewed, or released in the meantime
+            tombstone = '{0}.expired-{1}'.format(leaseFile, self.nodeID)
+            try:
+                os.rename(leaseFile, tombstone)
+            except OSError:
+                return True  # Released in the meantime
+            if _inspectFile_(tombstone) == lease:
+                os.remove(tombstone)
+                return True
+            # The owner renewed the lease just before it was moved, so give it back
+            try:
+                os.link(tombstone, leaseFile)  # Keeps modification time and content, never replaces a new lease
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+            os.remove(tombstone)
+            return False
+        finally:
+            try:
+                os.remove(lockFile)
+            except OSError:
+                pass  # Removed as stale by another process
+
+    def _removeStaleBreakLock_(self, lockFile):
+        """
+        Removes the break lock of a process that crashed while breaking a lease. Breaking takes far less than
+        the lease timeout, so older locks are stale.
+        """
+        lock = _inspectFile_(lockFile)
+        if lock is not None and self.getFilesystemTime() - lock[0] > self.leaseTimeout:
+            try:
+                os.remove(lockFile)
+            except OSError:
+                pass
+
+    def iterLeases(self, pollInterval=None):
+        """
+        Yields Leases for shards that are not done yet, until all shards are done.
+        When all remaining shards are leased by other processes, waits for them to be done or to expire.
+        The caller has to complete or release each lease before requesting the next one.
+        """
+        if self.shards is None:
+            self.loadShards()
+        if pollInterval is None:
+            pollInterval = max(1, self.leaseTimeout / 10.0)
+        while True:
+            acquiredAny = False
+            for shardIndex in range(len(self.shards)):
+                lease = self.tryAcquire(shardIndex)
+                if lease is not None:
+                    acquiredAny = True
+                    yield lease
+            if self.isFinished():
+                break
+            if not acquiredAny:
+                sleep(pollInterval)
+
+
+class Lease:
+    """
+    Lease on a shard. Use it as a context manager to renew it in the background while working on the shard.
+    """
+
+    def __init__(self, queue, shardIndex, items, leaseFile):
+        self.queue = queue
+        self.shardIndex = shardIndex
+        self.items = items
+        self.leaseFile = leaseFile
+        self.isLost = False
+        self.isClosed = False
+        self.stopRenewing = threading.Event()
+        self.renewer = None
+
+    def __enter__(self):
+        self.renewer = threading.Thread(target=self._renewRegularly_)
+        self.renewer.daemon = True
+        self.renewer.start()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.stopRenewing.set()
+        self.renewer.join()
+        if not self.isClosed:
+            self.release()
+        return False
+
+    def _renewRegularly_(self):
+        interval = self.queue.leaseTimeout / 3.0
+        while not self.stopRenewing.wait(interval):
+            if not self.renew():
+                break
+
+    def renew(self):
+        """
+        Extends the lease. Returns False if the lease was lost because it expired and was taken over.
+        A missing lease is looked for once more after RENEW_RETRY_DELAY, as a process that tried to break it
+        while it was renewed moves it back (see LeaseQueue._breakExpiredLease_).
+        """
+        for attempt in range(2):
+            try:
+                lease = _readJSON_(self.leaseFile)
+                if lease is None or lease.get('node') != self.queue.nodeID:
+                    raise OSError(errno.ENOENT, 'Lease is held by another process')
+                os.utime(self.leaseFile, None)
+                break
+            except OSError:
+                if attempt > 0 or path.exists(self.leaseFile):
+                    self.isLost = True
+                else:
+                    sleep(RENEW_RETRY_DELAY)
+        return not self.isLost
+
+    def complete(self, result):
+        """
+        Marks the shard as done, storing its (JSON serializable) result, and releases the lease.
+        Raises a LeaseLostError if the lease was lost; the result is then discarded.
+        """
+        if self.isLost or not self.renew():
+            self.isClosed = True
+            raise LeaseLostError('Lease of shard {0} was lost'.format(self.queue.getShardName(self.shardIndex)))
+        writeFileAtomic(self.queue._getDoneFile_(self.shardIndex),
+                        json.dumps(dict(node=self.queue.nodeID, result=result)))
+        self.release()
+
+    def release(self):
+        """
+        Gives up the lease without marking the shard as done, so that it can be taken by another process.
+        """
+        self.isClosed = True
+        if not self.isLost and path.exists(self.leaseFile):
+            lease = _readJSON_(self.leaseFile)
+            if lease is not None and lease.get('node') == self.queue.nodeID:
+                os.remove(self.leaseFile)
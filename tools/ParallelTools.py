@@ -0,0 +1,122 @@
+"""
+Collection of tools that help with distributing work across worker processes.
+"""
+
+from collections import deque
+from multiprocessing import cpu_count
+from Queue import Queue, Empty
+
+POLL_INTERVAL = 1.0  # Seconds between checks for failed tasks and dead worker processes while waiting for results
+
+
+class WorkerDiedError(RuntimeError):
+    """
+    Raised when a process of a worker pool died while tasks were pending. Its tasks would never be finished.
+    """
+    pass
+
+
+def getNumWorkers(workers):
+    """
+    Returns the number of worker processes to use. If workers is None, one worker per CPU core is used.
+    """
+    if workers is None:
+        return cpu_count()
+    else:
+        return max(1, workers)
+
+
+def getWorkerPIDs(pool):
+    """
+    Returns the process IDs of the pool's worker processes.
+    """
+    return frozenset(process.pid for process in pool._pool)
+
+
+def _checkWorkers_(pool, workerPIDs):
+    """
+    Raises a WorkerDiedError if a worker process of the pool was replaced since workerPIDs were taken.
+    Pools whose workers are regularly replaced (maxtasksperchild) are not checked.
+    """
+    if workerPIDs is not None and getWorkerPIDs(pool) != workerPIDs:
+        raise WorkerDiedError('A worker process died while tasks were pending')
+
+
+def _waitForResult_(pool, asyncResult, workerPIDs):
+    """
+    Returns the result of an AsyncResult, or raises its error, checking for dead workers while waiting.
+    """
+    while not asyncResult.ready():
+        asyncResult.wait(POLL_INTERVAL)
+        if not asyncResult.ready():
+            _checkWorkers_(pool, workerPIDs)
+    return asyncResult.get()
+
+
+def _waitForAnyResult_(pool, pending, finished, workerPIDs):
+    """
+    Waits until a task of pending (a dictionary of AsyncResults by task ID) is finished, removes it
+    and returns its result. Raises the error of a failed task, or a WorkerDiedError if a worker process died.
+    """
+    while True:
+        try:
+            taskID = finished.get(timeout=POLL_INTERVAL)
+            return pending.pop(taskID).get()
+        except Empty:
+            for taskID, asyncResult in pending.items():
+                if asyncResult.ready() and not asyncResult.successful():
+                    del pending[taskID]
+                    asyncResult.get()  # Raises the task's error
+            _checkWorkers_(pool, workerPIDs)
+
+
+def iterPoolResults(pool, workerFunction, tasks, maxPending, ordered=True):
+    """
+    Applies workerFunction to every task using a multiprocessing pool and yields the results.
+    Unlike Pool.imap, tasks are only taken from the tasks iterable while fewer than maxPending
+    tasks are waiting to be finished, so arbitrarily long (e.g. streamed) task sequences can be
+    processed in bounded memory.
+    If a task raises an exception, it is raised here. If a worker process dies (e.g. is killed),
+    a WorkerDiedError is raised, as its task would never be finished.
+    @param pool: A multiprocessing.Pool.
+    @param workerFunction: A picklable function that takes a single task. It should not raise exceptions,
+                           errors should be reported as part of its return value instead.
+    @param tasks: An iterable of picklable tasks.
+    @param maxPending: Maximum number of tasks that are submitted but not yet yielded.
+                       A few times the number of pool processes keeps all workers busy.
+    @param ordered: If True (default), results are yielded in the order of their tasks.
+                    If False, they are yielded as soon as they are finished.
+    """
+    maxPending = max(1, maxPending)
+    workerPIDs = None
+    if not getattr(pool, '_maxtasksperchild', None):
+        workerPIDs = getWorkerPIDs(pool)
+
+    if ordered:
+        pending = deque()
+        for task in tasks:
+            pending.append(pool.apply_async(workerFunction, (task,)))
+            if len(pending) >= maxPending:
+                yield _waitForResult_(pool, pending.popleft(), workerPIDs)
+            while len(pending) > 0 and pending[0].ready():
+                yield pending.popleft().get()
+        while len(pending) > 0:
+            yield _waitForResult_(pool, pending.popleft(), workerPIDs)
+    else:
+        # Successful tasks put their ID into the queue; failed tasks are found by checking all pending tasks
+        finished = Queue()
+        pending = dict()
+        for taskID, task in enumerate(tasks):
+            pending[taskID] = pool.apply_async(workerFunction, (task,),
+                                               callback=lambda result, taskID=taskID: finished.put(taskID))
+            if len(pending) >= maxPending:
+                yield _waitForAnyResult_(pool, pending, finished, workerPIDs)
+            while len(pending) > 0:
+                try:
+                    taskID = finished.get_nowait()
+                except Empty:
+                    break
+                yield pending.pop(taskID).get()
+        while len(pending) > 0:
+            yield _waitForAnyResult_(pool, pending, finished, workerPIDs)
+
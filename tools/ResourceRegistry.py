@@ -0,0 +1,94 @@
+"""
+Process-wide registry of loaded resources, such as grammars, airline dictionaries and concept generators.
+
+Asking for a resource that was already loaded from the same file returns the instance that was loaded before,
+as long as the file's content did not change in the meantime. Resources are identified by their kind, the canonical
+path of their file and a hash of the file's content. The hash is only computed again when the file's modification
+time or size change. A resource that was loaded from an outdated version of a file is dropped from the registry.
+
+Resources are shared by all users in the process, so they must not be modified. Worker processes that are forked
+after a resource was loaded share it as well.
+"""
+
+import os
+import threading
+from os import path
+
+from FileTools import hashFile
+
+RESOURCE_GRAMMAR = 'grammar'
+RESOURCE_AIRLINES = 'airlines'
+RESOURCE_CONCEPT_GENERATOR = 'concept generator'
+
+
+class ResourceRegistry:
+    """
+    Hands out shared instances of resources loaded from files.
+    """
+
+    def __init__(self):
+        self.resources = dict()  # (kind, canonical path, extra key) -> (content hash, resource)
+        self.fileHashes = dict()  # canonical path -> ((modification time, size), content hash)
+        self.lock = threading.RLock()
+
+    def getFileKey(self, filename):
+        """
+        Returns a pair (canonical path, content hash) that identifies a file and its current content.
+        """
+        canonicalPath = path.realpath(filename)
+        try:
+            fileStat = os.stat(canonicalPath)
+        except OSError as e:
+            raise IOError(e.errno, e.strerror, filename)
+        fileStamp = (fileStat.st_mtime, fileStat.st_size)
+        with self.lock:
+            cached = self.fileHashes.get(canonicalPath)
+            if cached is None or cached[0] != fileStamp:
+                cached = (fileStamp, hashFile(canonicalPath))
+                self.fileHashes[canonicalPath] = cached
+            return canonicalPath, cached[1]
+
+    def get(self, kind, filename, loader, extraKey=None):
+        """
+        Returns the resource of the given kind for a file. If it was not loaded yet, or the file's content changed
+        since it was loaded, loader(canonicalPath) is called to load it.
+        Errors of the loader are passed on and nothing is stored.
+        :param kind: Name of the kind of resource, e.g. RESOURCE_GRAMMAR.
+        :param filename: File the resource is loaded from.
+        :param loader: Function that takes a filename and returns the resource.
+        :param extraKey: Hashable value that distinguishes resources of the same kind that are loaded from
+                         the same file with different settings.
+        """
+        canonicalPath, contentHash = self.getFileKey(filename)
+        key = (kind, canonicalPath, extraKey)
+        with self.lock:
+            entry = self.resources.get(key)
+            if entry is None or entry[0] != contentHash:
+                entry = (contentHash, loader(canonicalPath))
+                self.resources[key] = entry
+            return entry[1]
+
+    def clear(self):
+        """
+        Forgets all resources, so that they are loaded again when they are needed next.
+        """
+        with self.lock:
+            self.resources.clear()
+            self.fileHashes.clear()
+
+
+_registry = ResourceRegistry()
+
+
+def getRegistry():
+    """
+    Returns the registry that is shared by the whole process.
+    """
+    return _registry
+
+
+def getSharedResource(kind, filename, loader, extraKey=None):
+    """
+    Shortcut for getRegistry().get(...).
+    """
+    return _registry.get(kind, filename, loader, extraKey=extraKey)
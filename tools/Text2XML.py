@@ -10,17 +10,48 @@ Use the various convertXYZ methods of the Text2XMLConverter class.
 import sys
 import os
 import re
+import json
+import errno
+import hashlib
+import argparse
 from os import path
 from signal import signal, alarm, SIGALRM
 from warnings import warn
 from functools import partial
 from operator import itemgetter
+from collections import namedtuple, deque, OrderedDict
+from multiprocessing import Pool
 from vocabularyHandlers import findCommandVocabularies
-from FileTools import loadAirlineCallsigns
+from FileTools import loadAirlineCallsigns, writeFileAtomic, hashFile, hashModules, getContentKey, DedupStats
+from FileTools import iterMBRUtterances
+from ParallelTools import getNumWorkers, iterPoolResults
+from LeaseQueue import LeaseQueue, LeaseLostError, DEFAULT_LEASE_TIMEOUT
+from ResourceRegistry import getSharedResource, getRegistry, RESOURCE_GRAMMAR, RESOURCE_AIRLINES
 
 
 CONF_SEPARATOR = ':'
 
+# Outcomes of converting a single file
+STATUS_SUCCESS = 'success'  # Complete parse was written
+STATUS_PARTIAL = 'partial'  # Parse was aborted by timeout, best partial parse was written
+STATUS_TIMEOUT = 'timeout'  # Parse was aborted by timeout before any parse was found
+STATUS_FAILED = 'failed'  # No parse was found (or input was empty), no file was written
+STATUS_ERROR = 'error'  # Conversion raised an exception
+STATUSES = [STATUS_SUCCESS, STATUS_PARTIAL, STATUS_TIMEOUT, STATUS_FAILED, STATUS_ERROR]
+STATUS_UNCHANGED = 'unchanged'  # Input was converted before and has not changed since (see convertTree)
+
+DEFAULT_MANIFEST_FILENAME = '.text2xml_manifest.jsonl'
+DEFAULT_SHARD_SIZE = 100  # Number of files per shard of convertTreeDistributed
+MAX_HELD_DUPLICATES = 1024  # Number of read sentences that iterConvertSentences holds back before converting again
+
+ConversionResult = namedtuple('ConversionResult', ['inputFile', 'status', 'message'])
+SentenceResult = namedtuple('SentenceResult', ['itemID', 'xml', 'status', 'message'])
+
+# Converter used by worker processes. It is set before the worker pool is forked,
+# so that workers share the memory pages of the loaded grammar instead of loading their own copy.
+_workerConverter_ = None
+_codeVersion_ = None  # See _getCodeVersion_
+
 
 class TimeoutError(Exception):
     pass
@@ -62,6 +93,29 @@ def loadGrammar(filename):
     return grammar
 
 
+def getGrammarVocabulary(grammar):
+    """
+    Returns the set of all (lowercased) output words of a grammar.
+    """
+    words = set()
+    for branches in grammar.itervalues():
+        for outnode, transitions in branches.iteritems():
+            if outnode != 'is_terminal':
+                for transition in transitions:
+                    nodeword = transition['outword'].lower()
+                    words.add(nodeword)
+    return words
+
+
+def loadGrammarData(filename):
+    """
+    Loads a grammar together with the data derived from it.
+    Returns a triple (grammar, vocabulary, command vocabularies).
+    """
+    grammar = loadGrammar(filename)
+    return grammar, getGrammarVocabulary(grammar), findCommandVocabularies(grammar)
+
+
 class SkipFST:
     def __init__(self, airlineFile):
         self.is_xml = re.compile("<.+?>")
@@ -75,8 +129,11 @@ class SkipFST:
 
         absolutepath = getAbsolutePath()
         airlineFile = path.join(absolutepath, airlineFile)
-        airlineDict = loadAirlineCallsigns(airlineFile)
+        airlineDict = getSharedResource(RESOURCE_AIRLINES, airlineFile, loadAirlineCallsigns)
         self.airlines = set(airlineDict.keys())
+        self.airlineHash = getRegistry().getFileKey(airlineFile)[1]  # Content hash of the loaded airline file
+
+        self.parseWasAborted = False  # True if the most recent call to getBestParse was aborted (e.g. by timeout)
 
     def transduceTimerHandler(self, signum, frame, text):
         raise TimeoutError("The following parse took too long:", text)
@@ -87,20 +144,52 @@ class SkipFST:
 
     def getBestParse(self, sentence, grammar, cmdVocabularies=None, callsign_whitelist=None, wxLib=None, wxGUI=None,
                      timeout=0, allowSkip=True, vocabulary=None, ignoreFluffWords=False, airlineCorrectionCutoff=20):
+        parses = self._findParses_(sentence, grammar, cmdVocabularies, callsign_whitelist, wxLib=wxLib, wxGUI=wxGUI,
+                                   timeout=timeout, allowSkip=allowSkip, vocabulary=vocabulary,
+                                   ignoreFluffWords=ignoreFluffWords, airlineCorrectionCutoff=airlineCorrectionCutoff)
+        if len(parses) == 0:
+            return None
+        else:
+            return ' '.join(parses[0][0])
+
+    def getNBestParses(self, sentence, grammar, n, cmdVocabularies=None, callsign_whitelist=None, timeout=0,
+                       allowSkip=True, vocabulary=None, ignoreFluffWords=False, airlineCorrectionCutoff=20):
+        """
+        Like getBestParse, but returns a list of up to n distinct parses, starting with the best one.
+        """
+        parses = self._findParses_(sentence, grammar, cmdVocabularies, callsign_whitelist, timeout=timeout,
+                                   allowSkip=allowSkip, vocabulary=vocabulary, ignoreFluffWords=ignoreFluffWords,
+                                   airlineCorrectionCutoff=airlineCorrectionCutoff)
+        nbest = list()
+        seen = set()
+        for parse in parses:  # Parses are sorted by cost, so the first occurrence of a parse is its cheapest one
+            output = ' '.join(parse[0])
+            if output not in seen:
+                seen.add(output)
+                nbest.append(output)
+                if len(nbest) >= n:
+                    break
+        return nbest
+
+    def _findParses_(self, sentence, grammar, cmdVocabularies=None, callsign_whitelist=None, wxLib=None, wxGUI=None,
+                     timeout=0, allowSkip=True, vocabulary=None, ignoreFluffWords=False, airlineCorrectionCutoff=20):
+        """
+        Transduces the sentence without skipping words and, if that fails and allowSkip is True, with skipping.
+        Returns the sorted parses of transduce.
+        """
         parses = self.transduce(sentence, grammar, False, cmdVocabularies, callsign_whitelist, wxLib=wxLib,
                                 wxGUI=wxGUI, timeout=timeout, vocabulary=vocabulary,
                                 ignoreFluffWords=ignoreFluffWords, airlineCorrectionCutoff=airlineCorrectionCutoff)
+        wasAborted = self.parseWasAborted
         if allowSkip and len(parses) == 0:
             parses = self.transduce(sentence, grammar, True, cmdVocabularies, callsign_whitelist, wxLib=wxLib,
                                     wxGUI=wxGUI, timeout=timeout, vocabulary=vocabulary,
                                     ignoreFluffWords=ignoreFluffWords, airlineCorrectionCutoff=airlineCorrectionCutoff)
+            wasAborted = wasAborted or self.parseWasAborted
         elif wxLib is not None and wxGUI is not None:  # If parse w\o skipping worked, set progress gauge in GUI to full
             wxLib.CallAfter(wxGUI.updateXMLGauge, 100)
-
-        if len(parses) == 0:
-            return None
-        else:
-            return ' '.join(parses[0][0])
+        self.parseWasAborted = wasAborted
+        return parses
 
     def transduce(self, sentence, grammar, allow_skip=True, cmdVocabularies=None, callsign_whitelist=None,
                   wxLib=None, wxGUI=None, timeout=0, vocabulary=None, ignoreFluffWords=False,
@@ -128,6 +217,7 @@ class SkipFST:
                  sentence and cost is itself a tuple (tag-cost,skip-cost).
                  Beware that there might be parses with identical costs.
         """
+        self.parseWasAborted = False
         if len(sentence) == 0:
             return []
 
@@ -321,6 +411,7 @@ class SkipFST:
         # Disable the alarm
         if not useGUI:
             alarm(0)
+        self.parseWasAborted = isAborted
 
         # Process incomplete parses
         if isAborted:
@@ -532,7 +623,11 @@ class Text2XMLConverter:
         self.cmdVocabs = None
         self.vocab = None
         self.grammar_name = None
+        self.grammar_file = None
+        self.grammar_hash = None
         self.has_grammar = False
+        self.conversionWasAborted = False  # True if a parse of the most recent conversion was aborted
+        self.dedupStats = None  # DedupStats of the most recent deduplicating batch conversion
         self.prepareSession(grammarFile)
         self.skipFST = SkipFST(airlineFile)
 
@@ -541,18 +636,21 @@ class Text2XMLConverter:
         Prepares data that will be consistent throughout the session.
         Also ensures the directory for temporary files exists
         """
-        # Generate modified grammar for XML transduction
+        # Load the grammar for XML transduction and its vocabularies, which are shared with other converters
+        self.grammar_hash = None
         try:
-            self.grammar = loadGrammar(grammarFile)
+            self.grammar, self.vocab, self.cmdVocabs = getSharedResource(RESOURCE_GRAMMAR, grammarFile,
+                                                                         loadGrammarData)
+            self.grammar_hash = getRegistry().getFileKey(grammarFile)[1]
             self.has_grammar = True
         except IOError:
             self.grammar = {}
+            self.vocab = self.getVocabularyFromGrammar()
+            self.cmdVocabs = findCommandVocabularies(self.grammar)
             self.has_grammar = False
-        # Load vocabulary
-        self.vocab = self.getVocabularyFromGrammar()
-        self.cmdVocabs = findCommandVocabularies(self.grammar)
         # Load grammar name
         self.grammar_name = path.basename(grammarFile)
+        self.grammar_file = grammarFile
 
     @staticmethod
     def loadGrammarName(filename):
@@ -565,18 +663,28 @@ class Text2XMLConverter:
     def getGrammarName(self):
         return self.grammar_name
 
+    def getGrammarHash(self):
+        """
+        Returns a hash of the grammar file's content, or None if no grammar was loaded.
+        """
+        if self.grammar_hash is None and self.has_grammar:
+            self.grammar_hash = hashFile(self.grammar_file)
+        return self.grammar_hash
+
+    def getVersion(self):
+        """
+        Returns a string that identifies how texts are converted apart from the grammar (see getGrammarHash):
+        it changes with the code of the converter and the content of the airline file.
+        """
+        sha = hashlib.sha1(_getCodeVersion_())
+        sha.update(self.skipFST.airlineHash)
+        return sha.hexdigest()
+
     def getVocabularyFromGrammar(self):
-        words = set()
-        for branches in self.grammar.itervalues():
-            for outnode, transitions in branches.iteritems():
-                if outnode != 'is_terminal':
-                    for transition in transitions:
-                        nodeword = transition['outword'].lower()
-                        words.add(nodeword)
-        return words
+        return getGrammarVocabulary(self.grammar)
 
     def convertDir(self, inputDir, outputDir, inputExtension='tra', outputExtension='xml', timeout=0, allowSkip=True,
-                   isMBR=False, ignoreFluffWords=False):
+                   isMBR=False, ignoreFluffWords=False, workers=1, dedup=True):
         """
         Converts regular texts into their XML representation (given that they are grammatical).
         Reads in every file in inputDir that matches the file extension inputExtension (default "tra").
@@ -587,13 +695,391 @@ class Text2XMLConverter:
         If a conversion failed, the respective file is not generated.
         Will not overwrite input file if dir and extension turn out to be identical.
         Other files (e.g. previous conversions) might be overwritten though.
+
+        :param workers: Number of worker processes. If 1 (default), files are converted one after another in this
+                        process. If None, one worker per CPU core is used. See iterConvertDir for details.
+        :param dedup: If True (default), files with identical content are only converted once (see iterConvertDir).
+        :return: A dictionary mapping each conversion status (see STATUSES) to a list of ConversionResults.
+        """
+        summary = dict((status, list()) for status in STATUSES)
+        for result in self.iterConvertDir(inputDir, outputDir, inputExtension=inputExtension,
+                                          outputExtension=outputExtension, timeout=timeout, allowSkip=allowSkip,
+                                          isMBR=isMBR, ignoreFluffWords=ignoreFluffWords, workers=workers,
+                                          dedup=dedup):
+            summary[result.status].append(result)
+        return summary
+
+    def iterConvertDir(self, inputDir, outputDir, inputExtension='tra', outputExtension='xml', timeout=0,
+                       allowSkip=True, isMBR=False, ignoreFluffWords=False, workers=1, dedup=True):
+        """
+        Generator version of convertDir that yields a ConversionResult for every input file as soon as it is done.
+
+        If workers is not 1, files are converted by a pool of worker processes (None: one per CPU core).
+        The workers are forked after the grammar was loaded, so they share its memory instead of loading it again.
+        Each worker converts one file per task in its own main thread, which means that the timeout (which relies
+        on SIGALRM) applies to every file individually. Results are yielded in order of completion.
+
+        If dedup is True (default), files whose content only differs in whitespace are grouped and only the first
+        file of each group is converted. Its output is copied for the other files of the group, whose results are
+        yielded right after it. How much work was saved is recorded in the converter's dedupStats.
         """
-        for basename in os.listdir(inputDir):
+        inputFiles = list()
+        for basename in sorted(os.listdir(inputDir)):
             _, fileExtension = os.path.splitext(basename)
             if fileExtension[1:] == inputExtension:
-                inputFile = path.join(inputDir, basename)
-                self.convertFile(inputFile, outputDir, outputExtension, timeout=timeout, allowSkip=allowSkip,
-                                 isMBR=isMBR, ignoreFluffWords=ignoreFluffWords)
+                inputFiles.append(path.join(inputDir, basename))
+
+        options = dict(timeout=timeout, allowSkip=allowSkip, isMBR=isMBR, ignoreFluffWords=ignoreFluffWords)
+        tasks = [(inputFile, outputDir, outputExtension, options) for inputFile in inputFiles]
+        for result in self._iterConvertFileTasks_(tasks, workers, dedup):
+            yield result
+
+    def iterConvertSentences(self, items, timeout=0, allowSkip=True, ignoreFluffWords=False, workers=1, ordered=True,
+                             maxPending=None, dedup=False):
+        """
+        Converts a stream of sentences and yields a SentenceResult for each of them.
+        Items are only read from the stream as workers become available, so arbitrarily long streams
+        can be converted in bounded memory.
+
+        :param items: An iterable of (itemID, sentence) pairs. Sentences may contain word:confidence tokens.
+        :param workers: Number of worker processes (see iterConvertDir). If None, one per CPU core is used.
+        :param ordered: If True (default), results are yielded in input order, otherwise as soon as they are done.
+        :param maxPending: Maximum number of sentences that are read but not yet yielded.
+                           Defaults to four times the number of workers.
+        :param dedup: If True, sentences that only differ in whitespace from an earlier sentence are not converted
+                      again, but get the result of the earlier sentence. This requires keeping one result per
+                      distinct sentence in memory. How much work was saved is recorded in the converter's dedupStats.
+                      Sentences that wait for an earlier sentence (and, if ordered, for all sentences before them)
+                      are held back, up to MAX_HELD_DUPLICATES. Beyond that, duplicates are converted again,
+                      so that no more sentences are read than workers can take.
+        """
+        options = dict(timeout=timeout, allowSkip=allowSkip, ignoreFluffWords=ignoreFluffWords)
+        tasks = ((itemID, sentence, options) for itemID, sentence in items)
+        if dedup:
+            for result in self._iterDeduplicatedSentences_(tasks, workers, ordered, maxPending):
+                yield result
+        else:
+            for result in self._iterConvertSentenceTasks_(tasks, workers, ordered, maxPending):
+                yield result
+
+    def _iterConvertSentenceTasks_(self, tasks, workers, ordered, maxPending):
+        if workers == 1:
+            for task in tasks:
+                yield self._convertSentenceTask_(task)
+        else:
+            for result in self._iterWorkerPool_(_convertSentenceWorker_, tasks, workers, ordered=ordered,
+                                                maxPending=maxPending):
+                yield result
+
+    def _iterDeduplicatedSentences_(self, tasks, workers, ordered, maxPending):
+        """
+        Like _iterConvertSentenceTasks_, but only converts the first of several sentences with the same content.
+        """
+        self.dedupStats = DedupStats()
+        finished = dict()  # Content key -> result of the first sentence with that content
+        waiting = dict()  # Content key -> IDs of duplicates waiting for the conversion of their first sentence
+        queued = deque()  # (itemID, key, isFirst) of items that were read but not yet yielded (ordered mode)
+        ready = list()  # Results of duplicates whose first sentence was already converted (unordered mode)
+        numWaiting = [0]  # Number of IDs in waiting (unordered mode)
+
+        def getNumHeld():
+            if ordered:
+                return len(queued)
+            return numWaiting[0] + len(ready)
+
+        def iterFirstTasks():
+            for itemID, sentence, options in tasks:
+                if isinstance(sentence, Exception):
+                    key = None  # Each invalid item gets its own error result
+                else:
+                    key = getContentKey(sentence)
+                isFirst = key is None or (key not in finished and key not in waiting)
+                if not isFirst and getNumHeld() >= MAX_HELD_DUPLICATES:
+                    # Convert the duplicate on its own, so that the worker pool limits how far ahead items are read
+                    key = None
+                    isFirst = True
+                self.dedupStats.add(not isFirst)
+                if ordered:
+                    queued.append((itemID, key, isFirst))
+                elif not isFirst:
+                    if key in finished:
+                        ready.append(finished[key]._replace(itemID=itemID))
+                    else:
+                        waiting[key].append(itemID)
+                        numWaiting[0] += 1
+                if isFirst:
+                    if key is not None:
+                        waiting[key] = list()
+                    yield (itemID, key), sentence, options
+
+        def iterQueuedDuplicates():
+            # Duplicates at the front of the queue come after sentences that were already converted
+            while len(queued) > 0 and not queued[0][2]:
+                itemID, key, _ = queued.popleft()
+                yield finished[key]._replace(itemID=itemID)
+
+        for result in self._iterConvertSentenceTasks_(iterFirstTasks(), workers, ordered, maxPending):
+            (itemID, key) = result.itemID
+            result = result._replace(itemID=itemID)
+            duplicateIDs = list()
+            if key is not None:
+                finished[key] = result
+                duplicateIDs = waiting.pop(key)
+                numWaiting[0] -= len(duplicateIDs)
+            if ordered:
+                for duplicateResult in iterQueuedDuplicates():
+                    yield duplicateResult
+                queued.popleft()  # The item of this result
+                yield result
+            else:
+                yield result
+                for itemID in duplicateIDs:
+                    yield result._replace(itemID=itemID)
+                for readyResult in ready:
+                    yield readyResult
+                del ready[:]
+        for duplicateResult in iterQueuedDuplicates():
+            yield duplicateResult
+        for readyResult in ready:
+            yield readyResult
+
+    def _iterConvertFileTasks_(self, tasks, workers, dedup):
+        """
+        Runs file conversion tasks (see _convertFileTask_) and yields their ConversionResults.
+        If dedup is True, files with the same content are only converted once (see iterConvertDir).
+        """
+        duplicates = dict()
+        if dedup:
+            self.dedupStats = DedupStats()
+            groups = OrderedDict()
+            for task in tasks:
+                key = _getFileTaskKey_(task)
+                if key is None:
+                    key = task[0]  # Convert file on its own
+                self.dedupStats.add(key in groups)
+                groups.setdefault(key, list()).append(task)
+            tasks = list()
+            for group in groups.itervalues():
+                tasks.append(group[0])
+                duplicates[group[0][0]] = (group[0], group[1:])
+
+        if workers == 1 or len(tasks) <= 1:
+            results = (self._convertFileTask_(task) for task in tasks)
+        else:
+            results = self._iterWorkerPool_(_convertFileWorker_, tasks, workers, ordered=False)
+        for result in results:
+            yield result
+            if result.inputFile in duplicates:
+                firstTask, duplicateTasks = duplicates[result.inputFile]
+                for task in duplicateTasks:
+                    yield self._copyFileResult_(result, firstTask, task)
+
+    def _copyFileResult_(self, result, firstTask, task):
+        """
+        Gives a file the conversion result of another file with the same content, as described by their tasks.
+        If the conversion raised an error, which might be specific to the file, the file is converted on its own.
+        """
+        inputFile = task[0]
+        if result.status == STATUS_ERROR:
+            return self._convertFileTask_(task)
+        try:
+            if result.status in [STATUS_SUCCESS, STATUS_PARTIAL]:
+                with open(_getOutputFile_(*firstTask[:3])) as f:
+                    outputText = f.read()
+                writeFileAtomic(_getOutputFile_(*task[:3]), outputText)
+            return ConversionResult(inputFile, result.status, result.message)
+        except Exception as e:
+            return ConversionResult(inputFile, STATUS_ERROR, '{0}: {1}'.format(type(e).__name__, e))
+
+    def _iterWorkerPool_(self, workerFunction, tasks, workers, ordered=True, maxPending=None):
+        """
+        Runs workerFunction on every task in a pool of forked worker processes that use this converter.
+        """
+        global _workerConverter_
+        _workerConverter_ = self
+        numWorkers = getNumWorkers(workers)
+        if maxPending is None:
+            maxPending = 4 * numWorkers
+        pool = Pool(numWorkers)
+        isCompleted = False
+        try:
+            for result in iterPoolResults(pool, workerFunction, tasks, maxPending, ordered=ordered):
+                yield result
+            isCompleted = True
+        finally:
+            if isCompleted:
+                pool.close()
+            else:  # Consumer stopped early or an error occurred
+                pool.terminate()
+            pool.join()
+            _workerConverter_ = None
+
+    def convertTree(self, inputDir, outputDir, inputExtension='tra', outputExtension='xml', timeout=0,
+                    allowSkip=True, isMBR=False, ignoreFluffWords=False, workers=1, manifestFile=None, dedup=True):
+        """
+        Incremental, resumable version of convertDir that also converts all (visible) subdirectories of inputDir.
+        The directory structure of inputDir is recreated in outputDir.
+
+        A manifest records the content hash of every converted input file, together with the grammar hash,
+        the converter version (see getVersion) and the conversion options. Files whose manifest entry is still valid
+        are not converted again, so after changing a few inputs, a repeated call only converts those. Because every
+        entry is written as soon as its file is converted, an interrupted call can simply be repeated to resume the
+        conversion. Files whose conversion raised an error or was aborted by the timeout are converted again
+        by every call, as the outcome may depend on the load of the machine.
+        Output files are written atomically. If an input that was converted before no longer yields a parse,
+        its outdated output file is removed.
+
+        :param manifestFile: Path of the manifest. Defaults to DEFAULT_MANIFEST_FILENAME inside outputDir.
+        :param dedup: If True (default), files with identical content are only converted once (see iterConvertDir).
+        :return: A dictionary mapping each conversion status (see STATUSES and STATUS_UNCHANGED)
+                 to a list of ConversionResults.
+        """
+        if manifestFile is None:
+            manifestFile = path.join(outputDir, DEFAULT_MANIFEST_FILENAME)
+        options = dict(timeout=timeout, allowSkip=allowSkip, isMBR=isMBR, ignoreFluffWords=ignoreFluffWords)
+        optionsKey = json.dumps(dict(options, outputExtension=outputExtension), sort_keys=True)
+        grammarHash = self.getGrammarHash()
+        version = self.getVersion()
+
+        summary = dict((status, list()) for status in STATUSES + [STATUS_UNCHANGED])
+        manifest = ConversionManifest(manifestFile)
+        try:
+            # Find files that need to be converted
+            fileInfos = dict()
+            tasks = list()
+            for inputFile in _findFiles_(inputDir, inputExtension):
+                relativeInput = path.relpath(inputFile, inputDir)
+                fileOutputDir = path.join(outputDir, path.dirname(relativeInput))
+                outputFile = path.join(fileOutputDir, '{0}.{1}'.format(path.splitext(path.basename(inputFile))[0],
+                                                                       outputExtension))
+                stat = os.stat(inputFile)
+                entry = manifest.get(relativeInput)
+                isValid = (entry is not None and entry['grammar'] == grammarHash and entry.get('version') == version
+                           and entry['options'] == optionsKey
+                           and entry['status'] not in [STATUS_ERROR, STATUS_TIMEOUT, STATUS_PARTIAL]
+                           and (path.exists(outputFile) or entry['status'] == STATUS_FAILED))
+                fileHash = None
+                if isValid and (entry['size'], entry['mtime']) != (stat.st_size, stat.st_mtime):
+                    # File was touched, only its content decides whether it changed
+                    fileHash = hashFile(inputFile)
+                    isValid = fileHash == entry['hash']
+                    if isValid:
+                        manifest.add(dict(entry, size=stat.st_size, mtime=stat.st_mtime))
+
+                if isValid:
+                    summary[STATUS_UNCHANGED].append(ConversionResult(inputFile, STATUS_UNCHANGED, None))
+                else:
+                    if fileHash is None:
+                        fileHash = hashFile(inputFile)
+                    if not path.isdir(fileOutputDir):
+                        os.makedirs(fileOutputDir)
+                    tasks.append((inputFile, fileOutputDir, outputExtension, options))
+                fileInfos[inputFile] = (relativeInput, outputFile, stat, fileHash)
+
+            # Convert files
+            for result in self._iterConvertFileTasks_(tasks, workers, dedup):
+                relativeInput, outputFile, stat, fileHash = fileInfos[result.inputFile]
+                if result.status in [STATUS_FAILED, STATUS_TIMEOUT] and path.exists(outputFile):
+                    os.remove(outputFile)  # Remove output of an earlier version of the input
+                manifest.add(dict(input=relativeInput, size=stat.st_size, mtime=stat.st_mtime, hash=fileHash,
+                                  grammar=grammarHash, version=version, options=optionsKey, status=result.status))
+                summary[result.status].append(result)
+
+            manifest.compact(keep=set(info[0] for info in fileInfos.itervalues()))
+        finally:
+            manifest.close()
+        return summary
+
+    def convertTreeDistributed(self, inputDir, outputDir, queueDir, inputExtension='tra', outputExtension='xml',
+                               timeout=0, allowSkip=True, isMBR=False, ignoreFluffWords=False, workers=1, dedup=True,
+                               shardSize=DEFAULT_SHARD_SIZE, leaseTimeout=DEFAULT_LEASE_TIMEOUT, nodeID=None):
+        """
+        Version of convertTree (without manifest) that several processes, possibly on different machines,
+        can run at the same time to share the work. The processes only need to share the file system.
+
+        The input files are split into shards of shardSize files, which are stored in queueDir (see LeaseQueue).
+        Each process converts the shards that no other process is working on. When its lease on a shard expires
+        because the process crashed, the shard is taken over by another process. Once all shards are done,
+        every process returns the results of all shards.
+
+        :param queueDir: Directory shared by all processes. Use a new directory for each conversion job.
+        :param workers: Number of worker processes that this process uses for each shard (see iterConvertDir).
+        :param leaseTimeout: Number of seconds after which the shard of a process that stopped responding is
+                             taken over. Each file must take less time to convert, so it should exceed timeout.
+        :param nodeID: Name of this process in the queue. Defaults to hostname and process ID.
+        :return: A dictionary mapping each conversion status (see STATUSES) to a list of ConversionResults.
+        """
+        options = dict(timeout=timeout, allowSkip=allowSkip, isMBR=isMBR, ignoreFluffWords=ignoreFluffWords)
+        queue = LeaseQueue(queueDir, leaseTimeout=leaseTimeout, nodeID=nodeID)
+        relativeInputs = [path.relpath(inputFile, inputDir) for inputFile in _findFiles_(inputDir, inputExtension)]
+        queue.createShards(relativeInputs, shardSize)
+
+        for lease in queue.iterLeases():
+            with lease:
+                tasks = list()
+                for relativeInput in lease.items:
+                    relativeInput = relativeInput.encode('utf-8')
+                    fileOutputDir = path.join(outputDir, path.dirname(relativeInput))
+                    try:
+                        os.makedirs(fileOutputDir)
+                    except OSError as e:
+                        if e.errno != errno.EEXIST:  # Other processes create directories too
+                            raise
+                    tasks.append((path.join(inputDir, relativeInput), fileOutputDir, outputExtension, options))
+                results = [(path.relpath(result.inputFile, inputDir), result.status, result.message)
+                           for result in self._iterConvertFileTasks_(tasks, workers, dedup)]
+                try:
+                    lease.complete(results)
+                except LeaseLostError as e:
+                    warn('{0}, its results are left to the process that took it over'.format(e))
+
+        summary = dict((status, list()) for status in STATUSES)
+        for shardIndex, shardResults in sorted(queue.getResults().iteritems()):
+            for relativeInput, status, message in shardResults:
+                inputFile = path.join(inputDir, relativeInput.encode('utf-8'))
+                summary[status].append(ConversionResult(inputFile, status, message))
+        return summary
+
+    def _convertFileTask_(self, task):
+        """
+        Converts a single file as described by a task tuple (inputFile, outputDir, outputExtension, options).
+        Never raises an exception, instead errors are reported via the status of the returned ConversionResult.
+        """
+        inputFile, outputDir, outputExtension, options = task
+        try:
+            status = self.convertFile(inputFile, outputDir, outputExtension, **options)
+            return ConversionResult(inputFile, status, None)
+        except Exception as e:
+            return ConversionResult(inputFile, STATUS_ERROR, '{0}: {1}'.format(type(e).__name__, e))
+
+    def _convertSentenceTask_(self, task):
+        """
+        Converts a single sentence as described by a task tuple (itemID, sentence, options).
+        Never raises an exception, instead errors are reported via the status of the returned SentenceResult.
+        """
+        itemID, sentence, options = task
+        if isinstance(sentence, Exception):  # Item could not be read
+            return SentenceResult(itemID, None, STATUS_ERROR, str(sentence))
+        try:
+            xml = self.convertSentence(sentence, **options)
+            return SentenceResult(itemID, xml, self.getConversionStatus(xml), None)
+        except Exception as e:
+            return SentenceResult(itemID, None, STATUS_ERROR, '{0}: {1}'.format(type(e).__name__, e))
+
+    def getConversionStatus(self, outputText):
+        """
+        Returns the status (see STATUSES) of the most recent conversion of this converter, given its output.
+        Must be called right after the conversion, e.g. convertSentence or convertText.
+        """
+        if outputText is None:
+            if self.conversionWasAborted:
+                return STATUS_TIMEOUT
+            else:
+                return STATUS_FAILED
+        elif self.conversionWasAborted:
+            return STATUS_PARTIAL
+        else:
+            return STATUS_SUCCESS
 
     def convertFile(self, inputFile, outputDir, outputExtension='xml', timeout=0, allowSkip=True, isMBR=False,
                     ignoreFluffWords=False):
@@ -605,41 +1091,25 @@ class Text2XMLConverter:
         If the conversion failed, no file is generated.
         Will not overwrite the input file if dir and extension turn out to be identical.
         Other files (e.g. previous conversions) might be overwritten though.
+        Returns the conversion status (see STATUSES).
         """
-        basename = os.path.basename(inputFile)
-        inputFilename, _ = os.path.splitext(basename)
-        outputFilename = "{0}.{1}".format(inputFilename, outputExtension)
-        outputFile = os.path.join(outputDir, outputFilename)
+        outputFile = _getOutputFile_(inputFile, outputDir, outputExtension)
 
         if os.path.isfile(outputFile) and os.path.samefile(inputFile, outputFile):
             info = 'Input and output file would be identical, please change outputDir or fileExtension.'
             warn('{0} Current filename: {1}'.format(info, outputFile))
-            return
-
-        inputText = list()
-        with open(inputFile) as f:
-            if isMBR:
-                tokens = list()
-                for line in f:
-                    items = line.strip().split()
-                    word = items[-2]
-                    confidence = items[-1]
-                    token = word + CONF_SEPARATOR + confidence
-                    token = str(token)
-                    tokens.append(token)
-                sentence = ' '.join(tokens)
-                inputText.append(sentence)
-            else:
-                for line in f:
-                    inputText.append(line.strip())
+            return STATUS_FAILED
 
+        inputText = _readInputText_(inputFile, isMBR)
         if len(inputText) == 0:
             warn('File {0} appears to be empty'.format(inputFile))
-        else:
-            outputText = self.convertText(inputText, timeout=timeout, allowSkip=allowSkip,
-                                          ignoreFluffWords=ignoreFluffWords)
-            with open(outputFile, 'w') as w:
-                w.write(outputText)
+            return STATUS_FAILED
+
+        outputText = self.convertText(inputText, timeout=timeout, allowSkip=allowSkip,
+                                      ignoreFluffWords=ignoreFluffWords)
+        if outputText is not None:
+            writeFileAtomic(outputFile, outputText)
+        return self.getConversionStatus(outputText)
 
     def convertSentence(self, sentence, wxLib=None, wxGUI=None, timeout=0, allowSkip=True, ignoreFluffWords=False):
         """
@@ -659,6 +1129,17 @@ class Text2XMLConverter:
         return self.convertText([sentence], wxLib=wxLib, wxGUI=wxGUI, timeout=timeout, allowSkip=allowSkip,
                                 ignoreFluffWords=ignoreFluffWords)
 
+    def convertSentenceNBest(self, sentence, n=5, timeout=0, allowSkip=True, ignoreFluffWords=False):
+        """
+        Like convertSentence, but returns a list of up to n alternative XML representations, best one first.
+        """
+        words = str(sentence).strip().split()
+        parses = self.skipFST.getNBestParses(words, self.grammar, n, cmdVocabularies=self.cmdVocabs, timeout=timeout,
+                                             allowSkip=allowSkip, vocabulary=self.vocab,
+                                             ignoreFluffWords=ignoreFluffWords)
+        self.conversionWasAborted = self.skipFST.parseWasAborted
+        return [self.skipFST.addMissingWords(words, parse) for parse in parses]
+
     def convertText(self, text, wxLib=None, wxGUI=None, timeout=0, allowSkip=True, ignoreFluffWords=False):
         """
         Converts a regular text into its XML representation, under the condition that it is weakly grammatical.
@@ -674,11 +1155,13 @@ class Text2XMLConverter:
         :return: A string if conversion is successful, otherwise None.
         """
         xml_sentences = []
+        self.conversionWasAborted = False
         for sentence in text:
             words = sentence.strip().split()
             trans = self.skipFST.getBestParse(words, self.grammar, cmdVocabularies=self.cmdVocabs, wxLib=wxLib,
                                               wxGUI=wxGUI, timeout=timeout, allowSkip=allowSkip, vocabulary=self.vocab,
                                               ignoreFluffWords=ignoreFluffWords)
+            self.conversionWasAborted = self.conversionWasAborted or self.skipFST.parseWasAborted
             if trans is not None:
                 xml = self.skipFST.addMissingWords(words, trans)
                 xml_sentences.append(xml)
@@ -686,4 +1169,288 @@ class Text2XMLConverter:
         if len(xml.strip()) > 0:
             return xml
         else:
-            return None
\ No newline at end of file
+            return None
+
+
+class ConversionManifest:
+    """
+    Keeps track of which input files were converted, based on which input content, grammar and options.
+    The manifest is stored as a JSONL file with one entry per line. New entries are appended immediately,
+    so the manifest survives interruptions. When an input has several entries, the last one is valid.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.entries = dict()
+        self.writer = None
+        self.load()
+
+    def load(self):
+        self.entries = dict()
+        if path.exists(self.filename):
+            with open(self.filename) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # Incomplete line written during an interruption
+                    self.entries[entry['input']] = entry
+
+    def get(self, relativeInput):
+        return self.entries.get(relativeInput)
+
+    def add(self, entry):
+        """
+        Adds an entry (a dict that contains at least the key "input") and immediately writes it to the manifest file.
+        """
+        self.entries[entry['input']] = entry
+        if self.writer is None:
+            directory = path.dirname(path.abspath(self.filename))
+            if not path.isdir(directory):
+                os.makedirs(directory)
+            self.writer = open(self.filename, 'a')
+        self.writer.write(json.dumps(entry, sort_keys=True) + '\n')
+        self.writer.flush()
+
+    def compact(self, keep=None):
+        """
+        Rewrites the manifest file so that it only contains one entry per input.
+        If keep is a set of inputs, entries for any other inputs are dropped.
+        """
+        self.close()
+        if keep is not None:
+            for relativeInput in self.entries.keys():
+                if relativeInput not in keep:
+                    del self.entries[relativeInput]
+        lines = [json.dumps(self.entries[relativeInput], sort_keys=True) + '\n'
+                 for relativeInput in sorted(self.entries)]
+        writeFileAtomic(self.filename, ''.join(lines))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+def _getCodeVersion_():
+    """
+    Returns a hash of the code that the conversion of texts depends on.
+    """
+    global _codeVersion_
+    if _codeVersion_ is None:
+        modules = [sys.modules[obj.__module__] for obj in (Text2XMLConverter, iterMBRUtterances)]
+        _codeVersion_ = hashModules(modules)
+    return _codeVersion_
+
+
+def _findFiles_(inputDir, extension):
+    """
+    Recursively lists all files in inputDir with the given extension, skipping hidden directories.
+    """
+    for dirpath, dirnames, filenames in os.walk(inputDir):
+        dirnames[:] = sorted(dirname for dirname in dirnames if not dirname.startswith('.'))
+        for filename in sorted(filenames):
+            if path.splitext(filename)[1][1:] == extension:
+                yield path.join(dirpath, filename)
+
+
+def _getOutputFile_(inputFile, outputDir, outputExtension):
+    """
+    Returns the path of the file that the conversion of inputFile is written to.
+    """
+    inputFilename, _ = os.path.splitext(os.path.basename(inputFile))
+    return os.path.join(outputDir, '{0}.{1}'.format(inputFilename, outputExtension))
+
+
+def _readInputText_(inputFile, isMBR=False):
+    """
+    Reads the sentences of an input file for Text2XMLConverter.convertText.
+    If isMBR is True, the file contains one word per line, followed by its confidence (see iterMBRUtterances).
+    Each utterance of the file becomes a sentence of word:confidence tokens.
+    """
+    inputText = list()
+    if isMBR:
+        for utterance in iterMBRUtterances(inputFile, keepConfidenceStrings=True):
+            inputText.append(' '.join('{0}{1}{2}'.format(token, CONF_SEPARATOR, confidence)
+                                      for token, confidence in zip(utterance.tokens, utterance.confidenceStrings)))
+    else:
+        with open(inputFile) as f:
+            for line in f:
+                inputText.append(line.strip())
+    return inputText
+
+
+def _getFileTaskKey_(task):
+    """
+    Returns the content key of a file conversion task's input, or None if the file should be converted on its own.
+    """
+    inputFile, outputDir, outputExtension, options = task
+    outputFile = _getOutputFile_(inputFile, outputDir, outputExtension)
+    try:
+        if os.path.isfile(outputFile) and os.path.samefile(inputFile, outputFile):
+            return None
+        return getContentKey(_readInputText_(inputFile, options.get('isMBR', False)))
+    except Exception:
+        return None  # Let the conversion itself report the problem
+
+
+def _convertFileWorker_(task):
+    """
+    Entry point for worker processes of Text2XMLConverter.iterConvertDir.
+    """
+    return _workerConverter_._convertFileTask_(task)
+
+
+def _convertSentenceWorker_(task):
+    """
+    Entry point for worker processes of Text2XMLConverter.iterConvertSentences.
+    """
+    return _workerConverter_._convertSentenceTask_(task)
+
+
+def _readLines_(stream):
+    """
+    Reads lines one by one, without the read-ahead buffering of file iteration that delays piped input.
+    """
+    return iter(stream.readline, '')
+
+
+def _parseLineItems_(lines):
+    """
+    Turns plain text lines into (itemID, sentence) pairs. The item ID is the line number, starting at 1.
+    """
+    for i, line in enumerate(lines):
+        yield i + 1, line.strip()
+
+
+class _JSONFloat_(float):
+    """
+    Number of a JSON record that remembers how it was written, so that confidences are passed on unchanged.
+    """
+
+    def __new__(cls, literal):
+        number = float.__new__(cls, literal)
+        number.literal = literal
+        return number
+
+
+def _formatConfidence_(confidence):
+    """
+    Returns a confidence of a JSON record as it was written in the record.
+    Raises a ValueError or TypeError if it is not a number.
+    """
+    number = float(confidence)
+    if isinstance(confidence, _JSONFloat_):
+        return confidence.literal
+    elif isinstance(confidence, basestring):
+        return confidence.strip().encode('utf-8')
+    elif isinstance(confidence, (int, long)) and not isinstance(confidence, bool):
+        return str(confidence)
+    return repr(number)
+
+
+def _parseJSONItems_(lines):
+    """
+    Turns JSONL records into (itemID, sentence) pairs.
+    Each record must contain an "id" and a "text" field. The optional "confidences" field is a list
+    with one confidence value per word of the text, which are attached to their words as word:confidence.
+    Invalid records are passed on as (itemID, error) pairs, where error is a ValueError.
+    """
+    for i, line in enumerate(lines):
+        if len(line.strip()) == 0:
+            continue
+        itemID = i + 1
+        try:
+            record = json.loads(line, parse_float=_JSONFloat_)
+            itemID = record.get('id', itemID)
+            text = record['text']
+            if isinstance(text, unicode):
+                text = text.encode('utf-8')
+            confidences = record.get('confidences')
+            if confidences is not None:
+                words = text.split()
+                if len(words) != len(confidences):
+                    raise ValueError('Found {0} words but {1} confidences'.format(len(words), len(confidences)))
+                text = ' '.join('{0}{1}{2}'.format(word, CONF_SEPARATOR, _formatConfidence_(confidence))
+                                for word, confidence in zip(words, confidences))
+            yield itemID, text
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            yield itemID, ValueError('Invalid record in line {0}: {1}'.format(i + 1, e))
+
+
+def main(args):
+    """
+    Command line interface that converts sentences from a file or stdin into XML.
+    The grammar is only loaded once, results are written as soon as they are finished.
+    """
+    toolDir = path.dirname(path.abspath(args[0]))
+    argparser = argparse.ArgumentParser(description='Convert sentences (one per line) to XML using a grammar.')
+    argparser.add_argument('input', nargs='?', default='-',
+                           help='File with one sentence per line (default: read from stdin).')
+    argparser.add_argument('--output', '-o', default='-', help='Output file (default: write to stdout).')
+    argparser.add_argument('--jsonl', '-j', action='store_true',
+                           help='Read and write JSONL records instead of plain lines. Input records have the fields '
+                                '"id", "text" and optionally "confidences" (one value per word), output records have '
+                                'the fields "id", "xml", "status" and "message".')
+    argparser.add_argument('--unordered', '-u', action='store_true',
+                           help='Write results as soon as they are finished instead of in input order. '
+                                'Plain line output is then prefixed by the line number and a tab.')
+    argparser.add_argument('--workers', '-w', type=int, default=1,
+                           help='Number of worker processes (default: 1, 0: one per CPU core).')
+    argparser.add_argument('--maxpending', type=int, default=None,
+                           help='Maximum number of sentences held in memory (default: 4 per worker).')
+    argparser.add_argument('--timeout', '-t', type=int, default=0,
+                           help='Number of seconds after which the parse of a sentence is aborted (default: 0, never).')
+    argparser.add_argument('--noskip', action='store_true', help='Do not allow the parser to skip words.')
+    argparser.add_argument('--ignorefluff', action='store_true', help='Remove out-of-grammar words before parsing.')
+    argparser.add_argument('--dedup', '-d', action='store_true',
+                           help='Convert each distinct sentence only once and reuse its result for repetitions. '
+                                'Keeps one result per distinct sentence in memory. '
+                                'The number of saved conversions is reported on stderr.')
+    argparser.add_argument('--grammar', '--grammarfile', '-g',
+                           default=path.join(toolDir, '..', 'data', 'grammars', 'default.fst'),
+                           help='Path to file storing OpenFST-formatted grammar.')
+    argparser.add_argument('--airlines', '--airlinesfile', '-i',
+                           default=path.join(toolDir, '..', 'data', 'airlines', 'callsigns.txt'),
+                           help='Path to file storing airline callsign information.')
+    pargs = argparser.parse_args(args[1:])
+
+    converter = Text2XMLConverter(pargs.grammar, path.abspath(pargs.airlines))
+    if not converter.has_grammar:
+        sys.exit('Could not load grammar file {0}'.format(pargs.grammar))
+    workers = pargs.workers
+    if workers == 0:
+        workers = None
+
+    reader = sys.stdin if pargs.input == '-' else open(pargs.input)
+    writer = sys.stdout if pargs.output == '-' else open(pargs.output, 'w')
+    try:
+        if pargs.jsonl:
+            items = _parseJSONItems_(_readLines_(reader))
+        else:
+            items = _parseLineItems_(_readLines_(reader))
+        results = converter.iterConvertSentences(items, timeout=pargs.timeout, allowSkip=not pargs.noskip,
+                                                 ignoreFluffWords=pargs.ignorefluff, workers=workers,
+                                                 ordered=not pargs.unordered, maxPending=pargs.maxpending,
+                                                 dedup=pargs.dedup)
+        for result in results:
+            if pargs.jsonl:
+                line = json.dumps(dict(id=result.itemID, xml=result.xml, status=result.status,
+                                       message=result.message))
+            elif pargs.unordered:
+                line = '{0}\t{1}'.format(result.itemID, result.xml or '')
+            else:
+                line = result.xml or ''
+            writer.write(line + '\n')
+            writer.flush()
+        if pargs.dedup:
+            sys.stderr.write('Deduplication: {0}\n'.format(converter.dedupStats))
+    finally:
+        if reader is not sys.stdin:
+            reader.close()
+        if writer is not sys.stdout:
+            writer.close()
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -9,8 +9,34 @@ Will only compare cmd files for which tra files are available.
 """
 import os
 import re
+import sys
 from os import path
-from FileTools import stripXML
+from collections import namedtuple
+from multiprocessing import Pool
+from StringIO import StringIO
+from FileTools import stripXML, getContentKey, hashModules, DedupStats
+from AMANRecords import AMANCommand, formatCommands
+from ParallelTools import getNumWorkers, iterPoolResults
+from EvaluationCache import EvaluationCache, UtteranceResult
+from CorpusIndex import CorpusIndex, getMaskExtensions
+
+EVAL_SHARD_SIZE = 100  # Number of utterances that a worker process of CommandEvaluator evaluates at a time
+
+# Result of evaluating a shard of utterances in a worker process:
+#   results: UtteranceResults of the shard's utterances, in order. If an error occurred, those evaluated before it.
+#   error: Error message, or None.
+ShardResult = namedtuple('ShardResult', ['results', 'error'])
+
+# Evaluator and utterances used by worker processes. They are set before the worker pool is forked.
+_workerEvaluator_ = None
+_workerItems_ = None
+
+
+def sortUtterances(utterances):
+    """
+    Returns utterances sorted by their path, the order in which they are evaluated and printed.
+    """
+    return sorted(utterances, key=lambda utterance: utterance.absolute_root)
 
 
 def textsEqual(text1, text2):
@@ -44,12 +70,26 @@ class Utterance:
         self.tra = None
         self.cmd = None
         self.genCmd = None
+        self.cmdRecords = None  # AMANCommands of cmd
+        self.genRecords = None  # AMANCommands of genCmd
         self.cmdCallsign = None
         self.genCallsign = None
         self.cmdConcepts = None
         self.genConcepts = None
         self.cmdTypes = None
         self.genTypes = None
+        self.dirIndex = None  # DirIndex that the utterance was found in, if its file stats were indexed
+
+    @classmethod
+    def fromIndex(cls, dirIndex, root, mask):
+        """
+        Creates the utterance of a root of a DirIndex, given its extension bitmask.
+        """
+        utterance = cls(dirIndex.dirpath, root)
+        utterance.extensions = set(extension[1:] for extension in getMaskExtensions(mask))
+        if dirIndex.offsets is not None:
+            utterance.dirIndex = dirIndex
+        return utterance
 
     def _loadFile_(self, extension, makeList=False):
         absolute_root = path.join(self.dirpath, self.root)
@@ -66,6 +106,18 @@ class Utterance:
     def has(self, extension):
         return extension in self.extensions
 
+    def getFileStamp(self, extension):
+        """
+        Returns (modification time, size) of the utterance's file with an extension,
+        as indexed or, if its stats were not indexed, as it is now.
+        """
+        if self.dirIndex is not None:
+            fileStamp = self.dirIndex.getFileStat(self.root, extension)
+            if fileStamp is not None:
+                return fileStamp
+        fileStat = os.stat('{0}.{1}'.format(self.absolute_root, extension))
+        return fileStat.st_mtime, fileStat.st_size
+
     def getCor(self):
         if not self.has('cor'):
             return None
@@ -85,10 +137,16 @@ class Utterance:
             return None
         elif self.cmd is None:
             self.cmd = self._loadFile_('cmd', makeList=True)
-            self.cmdCallsign, self.cmdConcepts = self._parseCmds_(self.cmd)
-            self.cmdTypes = self._extractCmdTypes_(self.cmdConcepts)
+            self.cmdRecords = [AMANCommand.fromString(cmd) for cmd in self.cmd]
+            self.cmdCallsign, self.cmdConcepts = self._parseCmds_(self.cmdRecords)
+            self.cmdTypes = self._extractCmdTypes_(self.cmdRecords)
         return self.cmd
 
+    def getCmdRecords(self):
+        if self.cmdRecords is None:
+            self.getCmd()
+        return self.cmdRecords
+
     def getCmdCallsign(self):
         if self.cmdCallsign is None:
             self.getCmd()
@@ -110,11 +168,23 @@ class Utterance:
             if tra is None or generator is None:
                 return None
             else:
-                self.genCmd = generator.recognizeString(tra)
-                self.genCallsign, self.genConcepts = self._parseCmds_(self.genCmd)
-                self.genTypes = self._extractCmdTypes_(self.genConcepts)
+                self.setGeneratedCmd(generator.recognizeString(tra, asRecords=True))
         return self.genCmd
 
+    def setGeneratedCmd(self, records):
+        """
+        :param records: List of AMANCommands generated from the tra annotation.
+        """
+        self.genRecords = records
+        self.genCmd = formatCommands(records)
+        self.genCallsign, self.genConcepts = self._parseCmds_(self.genRecords)
+        self.genTypes = self._extractCmdTypes_(self.genRecords)
+
+    def getGeneratedRecords(self, generator):
+        if self.genRecords is None:
+            self.generateCmd(generator)
+        return self.genRecords
+
     def getGeneratedCallsign(self, generator):
         if self.genCallsign is None:
             self.generateCmd(generator)
@@ -130,29 +200,36 @@ class Utterance:
             self.generateCmd(generator)
         return self.genTypes
 
-    def _parseCmds_(self, cmds):
+    def _parseCmds_(self, records):
         callsign = None
         cpts = []
-        for cmd in cmds:
-            parts = cmd.split(' ', 1)
-            if len(parts) == 1:
+        for record in records:
+            parts = record.getConceptParts()
+            if len(parts) == 0:
                 print "WARNING: Cmd is missing either callsign or command:", self.absolute_root
-                cpts.append(parts[0])
+                cpts.append(record.callsign)
             else:
-                cpts.append(parts[1])
+                cpts.append(' '.join(parts))
                 if callsign is None:
-                    callsign = parts[0]
-                elif callsign != parts[0]:
+                    callsign = record.callsign
+                elif callsign != record.callsign:
                     print "WARNING: Different callsigns in commands of single utterance found:", self.absolute_root
         return callsign, cpts
 
     @staticmethod
-    def _extractCmdTypes_(cpts):
-        types = set()
-        for cpt in cpts:
-            parts = cpt.split(' ', 1)
-            types.add(parts[0])
-        return types
+    def _splitConcept_(record):
+        """
+        Returns the type of a command and the remainder of its concept (value, metric and confidences) as string.
+        Commands without concept are typed by their only token.
+        """
+        parts = record.getConceptParts()
+        if len(parts) == 0:
+            return record.callsign, ''
+        return parts[0], ' '.join(parts[1:])
+
+    @classmethod
+    def _extractCmdTypes_(cls, records):
+        return set(cls._splitConcept_(record)[0] for record in records)
 
     def xmlIsInferrable(self, xmlCommands, keywords, cmdMustBeInAnnotation=False):
         """
@@ -197,17 +274,12 @@ class Utterance:
 
     def listIncorrectValues(self, generator):
         incorrectValues = []
-        for gen in self.getGeneratedConcepts(generator):
-            genParts = gen.split(' ', 1)
-            for cmd in self.getCmdConcepts():
-                cmdParts = cmd.split(' ', 1)
-                if genParts[0] == cmdParts[0]:
-                    if len(genParts) == 1:
-                        genParts.append('')
-                    if len(cmdParts) == 1:
-                        cmdParts.append('')
-                    if genParts[1] != cmdParts[1]:
-                        incorrectValues.append(genParts)
+        cmdItems = [self._splitConcept_(record) for record in self.getCmdRecords()]
+        for genRecord in self.getGeneratedRecords(generator):
+            genType, genValue = self._splitConcept_(genRecord)
+            for cmdType, cmdValue in cmdItems:
+                if genType == cmdType and genValue != cmdValue:
+                    incorrectValues.append([genType, genValue])
         return incorrectValues
 
 
@@ -242,7 +314,11 @@ class DirStats:
         return self.dirItems.get(dirname, None)
 
     def dirItemIterator(self):
-        return self.dirItems.iteritems()
+        """
+        Yields (dirname, items) pairs, sorted by dirname.
+        """
+        for dirname in sorted(self.dirItems):
+            yield dirname, self.dirItems[dirname]
 
     def printStatList(self, countername):
         print 'Total of {0} {1}'.format(self.total, countername)
@@ -251,7 +327,7 @@ class DirStats:
                 numUtterances = len(utterances)
                 if numUtterances > 0:
                     print "{1} {2} in {0}:".format(dirpath, numUtterances, countername)
-                    for utterance in utterances:
+                    for utterance in sortUtterances(utterances):
                         print "   {0.root}".format(utterance)
 
     def printCmdList(self, countername):
@@ -261,12 +337,12 @@ class DirStats:
                 numUtterances = len(utterances)
                 if numUtterances > 0:
                     print "{1} {2} in {0}:".format(dirpath, numUtterances, countername)
-                    for utterance in utterances:
+                    for utterance in sortUtterances(utterances):
                         print "   {0.root}   {0.genCmd} instead of {0.cmd}".format(utterance)
 
     def printStatDetails(self):
         showedInstance = False
-        for utterance in self.items:
+        for utterance in sortUtterances(self.items):
             showedInstance = True
             print "File:              ", utterance.absolute_root
             print "Transcription:     ", utterance.getTra()
@@ -278,8 +354,29 @@ class DirStats:
 
 
 class CommandEvaluator:
-    def __init__(self, conceptGenerator):
+    # Names of the DirStats attributes that collect the results of the checks
+    STAT_NAMES = ['error', 'mismatch', 'mismatchCorTra',
+                  'missingCallsigns', 'incompleteCallsigns', 'incorrectCallsigns',
+                  'mismatchMisc', 'falseReduceTag', 'reduceCmdInferred', 'aboveBelowUntagged', 'turnNoDir',
+                  'ilsMismatch', 'incorrectValue', 'deprecatedTag', 'missingTra', 'missingCmd']
+
+    def __init__(self, conceptGenerator, workers=1, shardSize=EVAL_SHARD_SIZE, cacheFile=None):
+        """
+        :param conceptGenerator: ConceptGenerator used to generate commands from tra annotations, or None.
+        :param workers: Number of worker processes that evaluate utterances. If None, one per CPU core is used.
+                        Each worker process generates commands with its own copy of the concept generator,
+                        so an AnnotationClient can only be used with a single worker.
+        :param shardSize: Number of utterances that are sent to a worker process at a time.
+        :param cacheFile: sqlite file of an EvaluationCache. If given, only utterances whose cor, tra or cmd file
+                          changed since they were last evaluated with the same code and concept generator
+                          are evaluated again. Requires a ConceptGenerator (not an AnnotationClient), or None.
+        """
+        if cacheFile is not None and conceptGenerator is not None and not hasattr(conceptGenerator, 'getVersion'):
+            raise ValueError('Evaluation results can only be cached for a local ConceptGenerator')
         self.generator = conceptGenerator
+        self.workers = workers
+        self.shardSize = max(1, shardSize)
+        self.cacheFile = cacheFile
 
         self.utteranceDirs = None
         self.error = None
@@ -299,6 +396,9 @@ class CommandEvaluator:
         self.missingTra = None
         self.missingCmd = None
 
+        self.dedupStats = None
+        self.traKeys = None
+
         self.reset()
 
     def reset(self):
@@ -325,13 +425,61 @@ class CommandEvaluator:
         self.missingTra = DirStats()
         self.missingCmd = DirStats()
 
+        self.dedupStats = DedupStats()
+        self.traKeys = set()
+
+    def getVersion(self):
+        """
+        Returns a string that identifies the code of the evaluator and the version of its concept generator.
+        """
+        generatorVersion = 'none'
+        if self.generator is not None:
+            generatorVersion = self.generator.getVersion()
+        return '{0}-{1}'.format(hashModules([sys.modules[__name__]]), generatorVersion)
+
+    def getStats(self):
+        """
+        Returns a dictionary mapping the names in STAT_NAMES to their DirStats.
+        """
+        return dict((name, getattr(self, name)) for name in self.STAT_NAMES)
+
     def evaluate(self, dirContents, verbose=True):
-        relevantDirs = set()
-        for dirpath, utterances in dirContents.iteritems():
-            if len(utterances) > 0:
-                self._evaluateDir_(dirpath, utterances)
-                relevantDirs.add(dirpath)
-        self.utteranceDirs = sorted(relevantDirs)
+        """
+        Evaluates all utterances, in order of their directory and file root.
+        With several workers, shards of utterances are evaluated in parallel and their results are applied
+        in the same order, so that output and statistics are identical to those of a single worker.
+        With a cache file, the results of unchanged utterances are taken from the cache.
+        """
+        items = list()
+        for dirpath in sorted(dirContents):
+            for utterance in sortUtterances(dirContents[dirpath].itervalues()):
+                items.append((dirpath, utterance))
+
+        cache = None
+        cacheLookups = [(None, None)] * len(items)
+        if self.cacheFile is not None:
+            cache = EvaluationCache(self.cacheFile)
+            version = self.getVersion()
+            cacheLookups = [cache.lookup(utterance, version) for _, utterance in items]
+        try:
+            pendingItems = [item for item, (result, _) in zip(items, cacheLookups) if result is None]
+            pendingResults = self._iterResults_(pendingItems)
+            for (dirpath, utterance), (result, fileStates) in zip(items, cacheLookups):
+                if result is None:
+                    result = next(pendingResults)
+                    if cache is not None:
+                        cache.store(utterance, version, fileStates, result)
+                sys.stdout.write(result.output)
+                self._applyResult_(dirpath, utterance, result)
+                if result.traKey is not None:
+                    self.dedupStats.add(result.traKey in self.traKeys)
+                    self.traKeys.add(result.traKey)
+            if cache is not None:
+                cache.commit()
+        finally:
+            if cache is not None:
+                cache.close()
+        self.utteranceDirs = sorted(set(dirpath for dirpath, _ in items))
 
         if verbose:
             print "=== Miscellaneous mismatches between cmd annotation and commands generated from tra annotation ==="
@@ -378,111 +526,231 @@ class CommandEvaluator:
 
             print ''
 
-    def _evaluateDir_(self, dirpath, utterances):
-        for utterance in sorted(utterances.itervalues()):
-            if utterance.has('tra'):
-                deprecatedTags = ['fix']
-                for deprecatedTag in deprecatedTags:
-                    if '<%s>' % deprecatedTag in utterance.getTra():
-                        self.deprecatedTag.addItem(dirpath, utterance)
-                deprecatedCommands = ['descent_rate',
-                                      'cleared',
-                                      'heading_command',
-                                      'contact',
-                                      'turn_cleared',
-                                      'speed_boundary',
-                                      'maintain_level',
-                                      'level_cleared']
-                for deprecatedCommand in deprecatedCommands:
-                    if '<command="%s">' % deprecatedCommand in utterance.getTra():
-                        self.deprecatedTag.addItem(dirpath, utterance)
-
-            if utterance.has('cor') and utterance.has('tra'):
-                tra = utterance.getTra()
-                cor = utterance.getCor()
-                tra = stripXML(tra)
-                while '  ' in tra:
-                    tra = tra.replace('  ', ' ')
-                while '  ' in cor:
-                    cor = cor.replace('  ', ' ')
-                if cor != tra:
-                    self.mismatchCorTra.addItem(dirpath, utterance)
-                    self.error.addItem(dirpath, utterance)
+    def _iterResults_(self, items):
+        """
+        Evaluates a list of (dirpath, utterance) pairs, in worker processes if there are enough of them,
+        and yields their UtteranceResults in order.
+        """
+        numWorkers = getNumWorkers(self.workers)
+        if numWorkers == 1 or len(items) <= self.shardSize:
+            evaluator = CommandEvaluator(self.generator, shardSize=self.shardSize)
+            for result in evaluator._evaluateItems_(items):
+                yield result
+        else:
+            shards = [(start, min(start + self.shardSize, len(items)))
+                      for start in range(0, len(items), self.shardSize)]
+            for shardResult in self._iterWorkerPool_(items, shards, numWorkers):
+                for result in shardResult.results:
+                    yield result
+                if shardResult.error is not None:
+                    raise ValueError(shardResult.error)
+
+    def _evaluateItems_(self, items):
+        """
+        Generates the commands of a list of (dirpath, utterance) pairs, evaluates them one by one
+        and yields their UtteranceResults. Their output is captured instead of printed.
+        """
+        utteranceCommands = self._generateCmds_([utterance for _, utterance in items])
+        for (dirpath, utterance), (traKey, commands) in zip(items, utteranceCommands):
+            totals = [getattr(self, name).total for name in self.STAT_NAMES]
+            output = StringIO()
+            stdout = sys.stdout
+            sys.stdout = output
+            try:
+                if commands is not None:
+                    utterance.setGeneratedCmd(commands)
+                self._evaluateUtterance_(dirpath, utterance)
+            finally:
+                sys.stdout = stdout
+            statCounts = dict()
+            for name, total in zip(self.STAT_NAMES, totals):
+                count = getattr(self, name).total - total
+                if count > 0:
+                    statCounts[name] = count
+            yield UtteranceResult(statCounts, traKey, commands, output.getvalue())
+
+    def _applyResult_(self, dirpath, utterance, result):
+        """
+        Adds the UtteranceResult of an utterance that was evaluated elsewhere (by a worker process or an earlier run)
+        to the statistics and sets its generated commands, so that it can be printed like an evaluated utterance.
+        """
+        output = StringIO()
+        stdout = sys.stdout
+        sys.stdout = output  # Warnings about the commands were already part of the result's output
+        try:
+            if result.commands is not None:
+                utterance.setGeneratedCmd(result.commands)
+            if len(result.statCounts) > 0:
+                utterance.getCmd()
+        finally:
+            sys.stdout = stdout
+        for name, count in result.statCounts.iteritems():
+            stats = getattr(self, name)
+            for _ in range(count):
+                stats.addItem(dirpath, utterance)
+
+    def _iterWorkerPool_(self, items, shards, numWorkers):
+        """
+        Yields the ShardResults of (start, end) ranges of items, in order, in a pool of forked worker processes.
+        """
+        global _workerEvaluator_, _workerItems_
+        _workerEvaluator_ = self
+        _workerItems_ = items
+        pool = Pool(numWorkers)
+        isCompleted = False
+        try:
+            for result in iterPoolResults(pool, _evaluateShardWorker_, shards, 2 * numWorkers):
+                yield result
+            isCompleted = True
+        finally:
+            if isCompleted:
+                pool.close()
+            else:  # Consumer stopped early or an error occurred
+                pool.terminate()
+            pool.join()
+            _workerEvaluator_ = None
+            _workerItems_ = None
+
+    def _generateCmds_(self, utterances):
+        """
+        Generates the commands of all utterances that have a tra file.
+        Commands are only generated once for tra annotations that only differ in whitespace or case.
+        Returns a (traKey, commands) pair per utterance: the content key of its tra annotation and the list of
+        AMANCommands generated from it, or None for both if it has no tra file or there is no concept generator.
+        """
+        if self.generator is None:
+            return [(None, None)] * len(utterances)
+        traKeys = dict()
+        uniqueTras = list()
+        utteranceKeys = list()
+        for utterance in utterances:
+            tra = utterance.getTra()
+            if tra is None:
+                utteranceKeys.append(None)
+                continue
+            key = getContentKey(tra, ignoreCase=True)
+            if key not in traKeys:
+                traKeys[key] = len(uniqueTras)
+                uniqueTras.append((utterance, tra))
+            utteranceKeys.append(key)
+
+        results = self.generator.recognizeBatch([tra for _, tra in uniqueTras], asRecords=True)
+        for (utterance, _), result in zip(uniqueTras, results):
+            if result.error is not None:
+                raise ValueError('Could not generate commands for {0}: {1}'.format(utterance.absolute_root,
+                                                                                   result.error))
+        utteranceCommands = list()
+        for key in utteranceKeys:
+            if key is None:
+                utteranceCommands.append((None, None))
+            else:
+                utteranceCommands.append((key, list(results[traKeys[key]].commands)))
+        return utteranceCommands
+
+    def _evaluateUtterance_(self, dirpath, utterance):
+        if utterance.has('tra'):
+            deprecatedTags = ['fix']
+            for deprecatedTag in deprecatedTags:
+                if '<%s>' % deprecatedTag in utterance.getTra():
+                    self.deprecatedTag.addItem(dirpath, utterance)
+            deprecatedCommands = ['descent_rate',
+                                  'cleared',
+                                  'heading_command',
+                                  'contact',
+                                  'turn_cleared',
+                                  'speed_boundary',
+                                  'maintain_level',
+                                  'level_cleared']
+            for deprecatedCommand in deprecatedCommands:
+                if '<command="%s">' % deprecatedCommand in utterance.getTra():
+                    self.deprecatedTag.addItem(dirpath, utterance)
+
+        if utterance.has('cor') and utterance.has('tra'):
+            tra = utterance.getTra()
+            cor = utterance.getCor()
+            tra = stripXML(tra)
+            while '  ' in tra:
+                tra = tra.replace('  ', ' ')
+            while '  ' in cor:
+                cor = cor.replace('  ', ' ')
+            if cor != tra:
+                self.mismatchCorTra.addItem(dirpath, utterance)
+                self.error.addItem(dirpath, utterance)
 
-            if utterance.has('tra') and utterance.has('cmd'):
-                cmds_gold = utterance.getCmd()
-                cmds_hyp = utterance.generateCmd(self.generator)
-                if not self.isEqualList(cmds_gold, cmds_hyp):
-                    # Inspection of mismatched callsigns
-                    cmdCS = utterance.getCmdCallsign(self.generator)
-                    genCS = utterance.getGeneratedCallsign(self.generator)
-                    if not textsEqual(genCS, cmdCS):
-                        self.mismatch.addItem(dirpath, utterance)
-                        self.error.addItem(dirpath, utterance)
-                        if genCS == 'NO_CALLSIGN':
-                            self.missingCallsigns.addItem(dirpath, utterance)
-                        elif genCS.startswith('NO_AIRLINE_'):
-                            self.incompleteCallsigns.addItem(dirpath, utterance)
-                        elif genCS.endswith('_NO_FLIGHTNUMBER'):
-                            self.incompleteCallsigns.addItem(dirpath, utterance)
-                        else:
-                            self.incorrectCallsigns.addItem(dirpath, utterance)
-
-                    # Inspection of mismatched command concepts
-                    cmdCpts = utterance.getCmdConcepts(self.generator)
-                    genCpts = utterance.getGeneratedConcepts(self.generator)
-                    if not self.isEqualList(cmdCpts, genCpts):
-                        self.mismatch.addItem(dirpath, utterance)
-                        self.error.addItem(dirpath, utterance)
-                        isSpecial = False
-                        if not utterance.xmlIsInferrable(['reduce'], ['reduce']):
-                            self.falseReduceTag.addItem(dirpath, utterance)
-                            isSpecial = True
-                        commands = ['REDUCE_OR_BELOW', 'REDUCE_NOT_BELOW',
-                                    'INCREASE_OR_ABOVE', 'INCREASE_NOT_ABOVE',
-                                    'SPEED_OR_ABOVE', 'SPEED_OR_BELOW',
-                                    'DESCEND_OR_BELOW', 'DESCEND_NOT_BELOW',
-                                    'RATE_OF_DESCENT_OR_ABOVE', 'RATE_OF_DESCENT_NOT_ABOVE',
-                                    'CLIMB_OR_ABOVE', 'CLIMB_NOT_ABOVE',
-                                    'RATE_OF_CLIMB_OR_BELOW', 'RATE_OF_CLIMB_NOT_BELOW',
-                                    'ALTITUDE_OR_ABOVE', 'ALTITUDE_OR_BELOW']
-                        keywords = ['<more>', '<less>', '<greater>', '<above>', '<below>']
-                        if not utterance.commandIsInferrable(commands, keywords):
-                            self.aboveBelowUntagged.addItem(dirpath, utterance)
-                            isSpecial = True
-                        if not utterance.commandIsInferrable(['REDUCE', 'REDUCE_OR_BELOW', 'REDUCE_NOT_BELOW'],
-                                                             ['reduce']):
-                            self.reduceCmdInferred.addItem(dirpath, utterance)
-                            isSpecial = True
-                        if not utterance.commandIsInferrable(['TURN_LEFT_HEADING'],
-                                                             ['left']) or not utterance.commandIsInferrable(
-                                ['TURN_RIGHT_HEADING'], ['right']):
-                            self.turnNoDir.addItem(dirpath, utterance)
-                            isSpecial = True
-
-                        incorrectValues = utterance.listIncorrectValues(self.generator)
-                        for cpt, val in incorrectValues:
-                            self.incorrectValue.addItem(dirpath, utterance)
-                            isSpecial = True
-                            if cpt in ["CLEARED_ILS", "CLEARED"]:
-                                pass  # Todo
-
-                        if not isSpecial:
-                            self.mismatchMisc.addItem(dirpath, utterance)
-            elif utterance.has('tra'):
-                # Has tra, but no cmd
-                cmds_hyp = utterance.generateCmd(self.generator)
-                if cmds_hyp != 'NO_CALLSIGN NO_CONCEPT':
-                    self.missingCmd.addItem(dirpath, utterance)
+        if utterance.has('tra') and utterance.has('cmd'):
+            cmds_gold = utterance.getCmd()
+            cmds_hyp = utterance.generateCmd(self.generator)
+            if not self.isEqualList(cmds_gold, cmds_hyp):
+                # Inspection of mismatched callsigns
+                cmdCS = utterance.getCmdCallsign()
+                genCS = utterance.getGeneratedCallsign(self.generator)
+                if not textsEqual(genCS, cmdCS):
+                    self.mismatch.addItem(dirpath, utterance)
                     self.error.addItem(dirpath, utterance)
-
-            elif utterance.has('cmd'):
-                # Has cmd, but no tra
-                self.missingTra.addItem(dirpath, utterance)
+                    if genCS == 'NO_CALLSIGN':
+                        self.missingCallsigns.addItem(dirpath, utterance)
+                    elif genCS.startswith('NO_AIRLINE_'):
+                        self.incompleteCallsigns.addItem(dirpath, utterance)
+                    elif genCS.endswith('_NO_FLIGHTNUMBER'):
+                        self.incompleteCallsigns.addItem(dirpath, utterance)
+                    else:
+                        self.incorrectCallsigns.addItem(dirpath, utterance)
+
+                # Inspection of mismatched command concepts
+                cmdCpts = utterance.getCmdConcepts()
+                genCpts = utterance.getGeneratedConcepts(self.generator)
+                if not self.isEqualList(cmdCpts, genCpts):
+                    self.mismatch.addItem(dirpath, utterance)
+                    self.error.addItem(dirpath, utterance)
+                    isSpecial = False
+                    if not utterance.xmlIsInferrable(['reduce'], ['reduce']):
+                        self.falseReduceTag.addItem(dirpath, utterance)
+                        isSpecial = True
+                    commands = ['REDUCE_OR_BELOW', 'REDUCE_NOT_BELOW',
+                                'INCREASE_OR_ABOVE', 'INCREASE_NOT_ABOVE',
+                                'SPEED_OR_ABOVE', 'SPEED_OR_BELOW',
+                                'DESCEND_OR_BELOW', 'DESCEND_NOT_BELOW',
+                                'RATE_OF_DESCENT_OR_ABOVE', 'RATE_OF_DESCENT_NOT_ABOVE',
+                                'CLIMB_OR_ABOVE', 'CLIMB_NOT_ABOVE',
+                                'RATE_OF_CLIMB_OR_BELOW', 'RATE_OF_CLIMB_NOT_BELOW',
+                                'ALTITUDE_OR_ABOVE', 'ALTITUDE_OR_BELOW']
+                    keywords = ['<more>', '<less>', '<greater>', '<above>', '<below>']
+                    if not utterance.commandIsInferrable(commands, keywords):
+                        self.aboveBelowUntagged.addItem(dirpath, utterance)
+                        isSpecial = True
+                    if not utterance.commandIsInferrable(['REDUCE', 'REDUCE_OR_BELOW', 'REDUCE_NOT_BELOW'],
+                                                         ['reduce']):
+                        self.reduceCmdInferred.addItem(dirpath, utterance)
+                        isSpecial = True
+                    if not utterance.commandIsInferrable(['TURN_LEFT_HEADING'],
+                                                         ['left']) or not utterance.commandIsInferrable(
+                            ['TURN_RIGHT_HEADING'], ['right']):
+                        self.turnNoDir.addItem(dirpath, utterance)
+                        isSpecial = True
+
+                    incorrectValues = utterance.listIncorrectValues(self.generator)
+                    for cpt, val in incorrectValues:
+                        self.incorrectValue.addItem(dirpath, utterance)
+                        isSpecial = True
+                        if cpt in ["CLEARED_ILS", "CLEARED"]:
+                            pass  # Todo
+
+                    if not isSpecial:
+                        self.mismatchMisc.addItem(dirpath, utterance)
+        elif utterance.has('tra'):
+            # Has tra, but no cmd
+            cmds_hyp = utterance.generateCmd(self.generator)
+            if cmds_hyp != 'NO_CALLSIGN NO_CONCEPT':
+                self.missingCmd.addItem(dirpath, utterance)
                 self.error.addItem(dirpath, utterance)
-            else:
-                # Has neither cmd, nor tra
-                pass
+
+        elif utterance.has('cmd'):
+            # Has cmd, but no tra
+            self.missingTra.addItem(dirpath, utterance)
+            self.error.addItem(dirpath, utterance)
+        else:
+            # Has neither cmd, nor tra
+            pass
 
     @staticmethod
     def isEqualList(cmds_gold, cmds_hyp):
@@ -533,33 +801,43 @@ class CommandEvaluator:
                                  self.deprecatedTag.total)
         print summary_missing.format(self.missingTra.total, self.missingCmd.total)
         print summary_misc.format(self.mismatchMisc.total)
+        print '\nCommand generation for tra files: {0}'.format(self.dedupStats)
 
 
-def prepareDirInfos(filedir, recurse=True):
+def _evaluateShardWorker_(shard):
+    """
+    Entry point for worker processes of CommandEvaluator. Evaluates the (start, end) range of the items
+    with an evaluator of its own and returns a ShardResult.
+    """
+    start, end = shard
+    evaluator = CommandEvaluator(_workerEvaluator_.generator, shardSize=_workerEvaluator_.shardSize)
+    results = list()
+    try:
+        for result in evaluator._evaluateItems_(_workerItems_[start:end]):
+            results.append(result)
+        error = None
+    except Exception as e:
+        error = str(e) if isinstance(e, ValueError) else '{0}: {1}'.format(type(e).__name__, e)
+    return ShardResult(results, error)
+
+
+def prepareDirInfos(filedir, recurse=True, statFiles=False):
+    """
+    Returns a dictionary that maps each directory with utterance files to a dictionary of its Utterances by root.
+    :param statFiles: If True, the utterances know the modification times and sizes of their files.
+    """
     dirContents = dict()
-    # Top down search through directory tree
-    for dirpath, dirnames, filenames in os.walk(filedir, topdown=True):
-        # Restrict search to visible directories
-        for i, subdir in enumerate(dirnames[:]):
-            if subdir.startswith('.'):
-                del dirnames[i]
-        # Prepare file info in this dir
-        if len(filenames) > 0:
-            utterances = dict()
-            for filename in filenames:
-                root, ext = path.splitext(filename)
-                if len(ext) > 0:
-                    utterance = utterances.setdefault(root, Utterance(dirpath, root))
-                    utterance.addExtension(ext[1:])
-            dirContents[dirpath] = utterances
-        if not recurse:
-            break
+    for dirIndex in CorpusIndex(filedir, recurse=recurse, statFiles=statFiles).iterDirs():
+        utterances = dict()
+        for root, mask in dirIndex.iterItems():
+            utterances[root] = Utterance.fromIndex(dirIndex, root, mask)
+        dirContents[dirIndex.dirpath] = utterances
     return dirContents
 
 
-def listErroneousUtterances(filedir, conceptGenerator):
-    dirContents = prepareDirInfos(filedir, recurse=False)
-    cmdEval = CommandEvaluator(conceptGenerator)
+def listErroneousUtterances(filedir, conceptGenerator, cacheFile=None):
+    dirContents = prepareDirInfos(filedir, recurse=False, statFiles=cacheFile is not None)
+    cmdEval = CommandEvaluator(conceptGenerator, cacheFile=cacheFile)
     cmdEval.evaluate(dirContents, verbose=False)
     dirItems = cmdEval.error.dirItems
     if len(dirItems) > 1:
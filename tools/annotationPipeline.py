@@ -0,0 +1,420 @@
+"""
+Headless annotation pipeline that pre-annotates whole corpora without the annotation tool.
+
+For every utterance in a directory tree, the same steps are run that the annotation tool runs on a button click:
+The text annotation (.cor) or, if there is none, the recogniser's hypothesis (.txt) without its XML tags
+is converted to an XML annotation (.tra), from which the command annotation (.cmd) is generated.
+Existing XML annotations are not overwritten (unless requested), but are used to generate missing commands.
+When overwriting, annotations of utterances that could not be converted (or whose commands could not be generated)
+are removed, so that no annotations of an earlier run are left.
+
+The conversion and recognition stages run in separate worker pools, so that commands are generated
+while further utterances are still being converted. The time spent in each stage is reported at the end.
+"""
+
+import sys
+import os
+import argparse
+from os import path, walk
+from time import time
+from collections import namedtuple, OrderedDict
+from multiprocessing import Pool
+
+from FileTools import stripXML, alphanum_key, writeFileAtomic, getContentKey, DedupStats
+from FileTools import HYP_EXT, TEXT_ANNO_EXT, XML_ANNO_EXT, CMD_ANNO_EXT
+from Text2XML import Text2XMLConverter, STATUS_SUCCESS, STATUS_PARTIAL, STATUS_ERROR, STATUS_UNCHANGED, STATUSES
+from GenerateConcept import ConceptGenerator, CONFMODE_OFF, CONFIDENCE_SUM_MODES, parseConfidenceMode
+from ParallelTools import getNumWorkers, iterPoolResults
+
+NO_COMMAND = 'NO_COMMAND'
+MAX_FINISHED_INPUTS = 16384  # Number of finished inputs whose annotations are kept for later duplicates
+
+STAGE_READ = 'read'
+STAGE_CONVERT = 'convert'
+STAGE_RECOGNIZE = 'recognize'
+STAGE_WRITE = 'write'
+STAGES = [STAGE_READ, STAGE_CONVERT, STAGE_RECOGNIZE, STAGE_WRITE]
+
+# Pipeline used by worker processes. It is set before the worker pools are forked.
+_workerPipeline_ = None
+
+# State of an utterance as it passes through the pipeline:
+#   fileroot: Path of the utterance without file extension.
+#   text: Plain text that is converted to XML, or None if an existing XML annotation is used.
+#   xml: XML annotation, or None if it was not (yet) created.
+#   commands: Command annotation text, or None if it was not (yet) created.
+#   status: Conversion status (see Text2XML.STATUSES), or STATUS_UNCHANGED for existing XML annotations.
+#   message: Error message, or None.
+#   timings: Dictionary mapping stage names to the number of seconds spent in them.
+PipelineItem = namedtuple('PipelineItem', ['fileroot', 'text', 'xml', 'commands', 'status', 'message', 'timings'])
+
+
+class PipelineStats:
+    """
+    Summary of a pipeline run.
+    """
+
+    def __init__(self):
+        self.statusCounts = dict((status, 0) for status in STATUSES + [STATUS_UNCHANGED])
+        self.stageTimes = dict((stage, 0.0) for stage in STAGES)
+        self.stageCounts = dict((stage, 0) for stage in STAGES)
+        self.skipped = 0
+        self.wallTime = 0.0
+        self.dedupStats = DedupStats()
+
+    def add(self, item):
+        self.statusCounts[item.status] += 1
+        for stage, seconds in item.timings.iteritems():
+            self.stageTimes[stage] += seconds
+            self.stageCounts[stage] += 1
+
+    def getNumProcessed(self):
+        return sum(self.statusCounts.itervalues())
+
+    def printout(self, stream=sys.stderr):
+        numProcessed = self.getNumProcessed()
+        stream.write('Processed {0} utterances in {1:.2f} seconds ({2} already annotated)\n'.format(
+            numProcessed, self.wallTime, self.skipped))
+        for status in STATUSES + [STATUS_UNCHANGED]:
+            if self.statusCounts[status] > 0:
+                stream.write('  {0:<10} {1:>7}\n'.format(status, self.statusCounts[status]))
+        stream.write('{0:<10} {1:>7} {2:>12} {3:>10}\n'.format('Stage', 'Items', 'Total [s]', 'Mean [ms]'))
+        for stage in STAGES:
+            count = self.stageCounts[stage]
+            mean = 1000 * self.stageTimes[stage] / count if count > 0 else 0.0
+            stream.write('{0:<10} {1:>7} {2:>12.2f} {3:>10.1f}\n'.format(stage, count, self.stageTimes[stage], mean))
+        if self.dedupStats.numItems > 0:
+            stream.write('Deduplication: {0}\n'.format(self.dedupStats))
+
+
+class AnnotationPipeline:
+    """
+    Creates XML and command annotations for all utterances of a corpus.
+    """
+
+    def __init__(self, grammarFile, airlineFile, contextFile=None, timeout=0, allowSkip=True,
+                 ignoreFluffWords=False, confidenceMode=CONFMODE_OFF, isStrict=False):
+        """
+        :param grammarFile: Path to file storing OpenFST-formatted grammar.
+        :param airlineFile: Path to file storing airline callsign information.
+        :param contextFile: Path to a current_callsign context file, or None.
+        :param timeout: Maximum number of seconds spent on converting an utterance. 0 means no timeout.
+        :param allowSkip: See Text2XMLConverter.convertSentence.
+        :param ignoreFluffWords: See Text2XMLConverter.convertSentence.
+        :param confidenceMode: See ConceptGenerator.recognize.
+        :param isStrict: See ConceptGenerator.recognize.
+        """
+        self.converter = Text2XMLConverter(grammarFile, airlineFile)
+        self.generator = ConceptGenerator(airlineFile, contextFile=contextFile)
+        self.timeout = timeout
+        self.allowSkip = allowSkip
+        self.ignoreFluffWords = ignoreFluffWords
+        self.confidenceMode = confidenceMode
+        self.isStrict = isStrict
+
+    def run(self, corpusDir, overwrite=False, convertWorkers=1, recognizeWorkers=1, verbose=False, dedup=True):
+        """
+        Annotates all utterances in corpusDir and its subdirectories.
+        :param overwrite: If True, existing XML and command annotations are replaced.
+        :param convertWorkers: Number of worker processes for XML conversion. If None, one per CPU core is used.
+        :param recognizeWorkers: Number of worker processes for command generation.
+                                 If None, one per CPU core is used.
+        :param verbose: If True, the outcome for each utterance is printed to stderr.
+        :param dedup: If True (default), utterances whose input only differs in whitespace from an earlier utterance
+                      (or, for existing XML annotations, in whitespace and case) are not processed again,
+                      but get the annotations of the earlier utterance.
+        :return: A PipelineStats object.
+        """
+        global _workerPipeline_
+        stats = PipelineStats()
+        startTime = time()
+
+        items = self._iterItems_(corpusDir, overwrite, stats)
+        duplicates = None
+        if dedup:
+            duplicates = _DuplicateTracker_(stats.dedupStats)
+            items = duplicates.filterItems(items)
+        convertWorkers = getNumWorkers(convertWorkers)
+        recognizeWorkers = getNumWorkers(recognizeWorkers)
+
+        # Workers are forked after the pipeline was set, so they share its loaded grammar and airline data
+        _workerPipeline_ = self
+        convertPool = Pool(convertWorkers) if convertWorkers > 1 else None
+        recognizePool = Pool(recognizeWorkers) if recognizeWorkers > 1 else None
+        pools = [pool for pool in [convertPool, recognizePool] if pool is not None]
+        success = False
+        try:
+            if convertPool is None:
+                items = (self.convertItem(item) for item in items)
+            else:
+                items = iterPoolResults(convertPool, _convertWorker_, items, 4 * convertWorkers, ordered=False)
+            if recognizePool is None:
+                items = (self.recognizeItem(item) for item in items)
+            else:
+                items = iterPoolResults(recognizePool, _recognizeWorker_, items, 4 * recognizeWorkers,
+                                        ordered=False)
+
+            for item in items:
+                self._finishItem_(item, stats, verbose, overwrite)
+                if duplicates is not None:
+                    for duplicate in duplicates.getFinishedDuplicates(item):
+                        self._finishItem_(duplicate, stats, verbose, overwrite)
+            if duplicates is not None:
+                for duplicate in duplicates.getFinishedDuplicates():
+                    self._finishItem_(duplicate, stats, verbose, overwrite)
+            success = True
+        finally:
+            for pool in pools:
+                if success:
+                    pool.close()
+                else:
+                    pool.terminate()
+                pool.join()
+            _workerPipeline_ = None
+
+        stats.wallTime = time() - startTime
+        return stats
+
+    def _finishItem_(self, item, stats, verbose, overwrite):
+        item = self.writeItem(item, overwrite)
+        stats.add(item)
+        if verbose:
+            message = '' if item.message is None else ': {0}'.format(item.message)
+            sys.stderr.write('{0}\t{1}{2}\n'.format(item.status, item.fileroot, message))
+
+    def _iterItems_(self, corpusDir, overwrite, stats):
+        for fileroot in findUtterances(corpusDir):
+            item = self.readItem(fileroot, overwrite)
+            if item is None:
+                stats.skipped += 1
+            else:
+                yield item
+
+    def readItem(self, fileroot, overwrite=False):
+        """
+        Loads the input of an utterance.
+        Returns None if the utterance is already fully annotated or has no text to convert.
+        """
+        startTime = time()
+        xmlFile = fileroot + XML_ANNO_EXT
+        cmdFile = fileroot + CMD_ANNO_EXT
+        text = None
+        xml = None
+        status = None
+        if not overwrite:
+            xml = _readText_(xmlFile)
+        if xml is not None:
+            if _readText_(cmdFile) is not None:
+                return None  # Nothing left to do
+            status = STATUS_UNCHANGED
+        else:
+            text = _readText_(fileroot + TEXT_ANNO_EXT)
+            if text is None:
+                hypothesis = _readText_(fileroot + HYP_EXT)
+                if hypothesis is not None:
+                    text = stripXML(hypothesis)
+            if not text:
+                return None  # Nothing to convert
+        return PipelineItem(fileroot, text, xml, None, status, None, {STAGE_READ: time() - startTime})
+
+    def convertItem(self, item):
+        """
+        Converts the text of an item to XML. Items that already have XML are returned unchanged.
+        """
+        if item.text is None or item.status is not None:
+            return item
+        startTime = time()
+        try:
+            xml = self.converter.convertSentence(item.text, timeout=self.timeout, allowSkip=self.allowSkip,
+                                                 ignoreFluffWords=self.ignoreFluffWords)
+            item = item._replace(xml=xml, status=self.converter.getConversionStatus(xml))
+        except Exception as e:
+            item = item._replace(status=STATUS_ERROR, message='{0}: {1}'.format(type(e).__name__, e))
+        return _addTiming_(item, STAGE_CONVERT, startTime)
+
+    def recognizeItem(self, item):
+        """
+        Generates the command annotation for the XML of an item.
+        """
+        if item.xml is None or item.status == STATUS_ERROR:
+            return item
+        startTime = time()
+        try:
+            commands = self.generator.recognizeString(item.xml, confidenceMode=self.confidenceMode,
+                                                      isStrict=self.isStrict)
+            if len(commands) > 0:
+                item = item._replace(commands='\n'.join(commands))
+            else:
+                item = item._replace(commands=NO_COMMAND)
+        except Exception as e:
+            item = item._replace(status=STATUS_ERROR, message='{0}: {1}'.format(type(e).__name__, e))
+        return _addTiming_(item, STAGE_RECOGNIZE, startTime)
+
+    def writeItem(self, item, overwrite=False):
+        """
+        Writes the XML and command annotations of an item.
+        :param overwrite: If True, existing annotations that were not replaced by new ones are removed.
+        """
+        startTime = time()
+        xmlFile = item.fileroot + XML_ANNO_EXT
+        cmdFile = item.fileroot + CMD_ANNO_EXT
+        if item.status in [STATUS_SUCCESS, STATUS_PARTIAL]:
+            writeFileAtomic(xmlFile, item.xml)
+        elif overwrite and path.exists(xmlFile):
+            os.remove(xmlFile)  # Conversion failed, remove the annotation of an earlier run
+        if item.commands is not None:
+            writeFileAtomic(cmdFile, item.commands)
+        elif overwrite and path.exists(cmdFile):
+            os.remove(cmdFile)
+        return _addTiming_(item, STAGE_WRITE, startTime)
+
+
+class _DuplicateTracker_:
+    """
+    Lets only the first of several items with the same input pass through the pipeline
+    and gives its annotations to the other items once it is finished.
+    Only the most recently finished maxFinished inputs are remembered, later duplicates of older inputs
+    are processed again.
+    """
+
+    def __init__(self, dedupStats, maxFinished=MAX_FINISHED_INPUTS):
+        self.dedupStats = dedupStats
+        self.maxFinished = maxFinished
+        self.finished = OrderedDict()  # Input key -> finished first item with that input, least recently used first
+        self.waiting = dict()  # Input key -> duplicates waiting for their first item to finish
+        self.ready = list()  # Duplicates whose first item was already finished
+
+    @staticmethod
+    def getKey(item):
+        if item.text is not None:
+            return 'text', getContentKey(item.text)
+        else:
+            return 'xml', getContentKey(item.xml, ignoreCase=True)  # Command generation ignores case
+
+    def filterItems(self, items):
+        """
+        Yields only the first item for each input. Duplicates are held back until the first item is finished.
+        """
+        for item in items:
+            key = self.getKey(item)
+            if key in self.finished:
+                self.dedupStats.add(True)
+                firstItem = self.finished.pop(key)
+                self.finished[key] = firstItem
+                self.ready.append(self._copyResult_(firstItem, item))
+            elif key in self.waiting:
+                self.dedupStats.add(True)
+                self.waiting[key].append(item)
+            else:
+                self.dedupStats.add(False)
+                self.waiting[key] = list()
+                yield item
+
+    def getFinishedDuplicates(self, item=None):
+        """
+        Returns the duplicates that can be written now, including those of the given item, which just finished.
+        """
+        duplicates = list()
+        if item is not None:
+            key = self.getKey(item)
+            self.finished[key] = item
+            while len(self.finished) > self.maxFinished:
+                self.finished.popitem(last=False)
+            duplicates.extend(self._copyResult_(item, duplicate) for duplicate in self.waiting.pop(key))
+        duplicates.extend(self.ready)
+        del self.ready[:]
+        return duplicates
+
+    @staticmethod
+    def _copyResult_(firstItem, item):
+        return item._replace(xml=firstItem.xml, commands=firstItem.commands, status=firstItem.status,
+                             message=firstItem.message)
+
+
+def findUtterances(corpusDir):
+    """
+    Yields the file roots (paths without extension) of all utterances in corpusDir and its subdirectories
+    that have a text annotation or recogniser hypothesis. Hidden directories are ignored.
+    """
+    for dirpath, dirnames, filenames in walk(corpusDir):
+        dirnames[:] = sorted([d for d in dirnames if not d.startswith('.')], key=alphanum_key)
+        fileroots = set()
+        for filename in filenames:
+            root, ext = path.splitext(filename)
+            if ext in [HYP_EXT, TEXT_ANNO_EXT]:
+                fileroots.add(root)
+        for root in sorted(fileroots, key=alphanum_key):
+            yield path.join(dirpath, root)
+
+
+def _readText_(filename):
+    """
+    Returns the stripped content of a file, or None if the file does not exist or is empty.
+    """
+    if not path.exists(filename):
+        return None
+    with open(filename) as f:
+        text = f.read().strip()
+    if len(text) == 0:
+        return None
+    return text
+
+
+def _addTiming_(item, stage, startTime):
+    timings = dict(item.timings)
+    timings[stage] = time() - startTime
+    return item._replace(timings=timings)
+
+
+def _convertWorker_(item):
+    return _workerPipeline_.convertItem(item)
+
+
+def _recognizeWorker_(item):
+    return _workerPipeline_.recognizeItem(item)
+
+
+def main(args):
+    toolDir = path.dirname(path.abspath(args[0]))
+    argparser = argparse.ArgumentParser(description='Create XML and command annotations for all utterances in '
+                                                    'a corpus directory tree.')
+    argparser.add_argument('corpus', help='Root directory of the corpus.')
+    argparser.add_argument('--overwrite', action='store_true',
+                           help='Replace existing XML and command annotations.')
+    argparser.add_argument('--workers', '-w', type=int, default=0,
+                           help='Number of worker processes for XML conversion (default: 0, one per CPU core).')
+    argparser.add_argument('--recognizers', '-r', type=int, default=1,
+                           help='Number of worker processes for command generation (default: 1).')
+    argparser.add_argument('--timeout', '-t', type=int, default=0,
+                           help='Maximum number of seconds spent on converting an utterance (default: 0, no timeout).')
+    argparser.add_argument('--noskip', action='store_true',
+                           help='Only accept parses that use all words of a sentence.')
+    argparser.add_argument('--ignorefluff', action='store_true', help='Ignore fluff words during conversion.')
+    argparser.add_argument('--confidence', choices=sorted(CONFIDENCE_SUM_MODES.keys()), default='off',
+                           help='How to compute command confidences (default: off).')
+    argparser.add_argument('--strict', action='store_true', help='Use strict command generation.')
+    argparser.add_argument('--verbose', '-v', action='store_true', help='Print the outcome for each utterance.')
+    argparser.add_argument('--nodedup', action='store_true',
+                           help='Process every utterance, even if an earlier utterance had the same input.')
+    argparser.add_argument('--grammar', '--grammarfile', '-g',
+                           default=path.join(toolDir, '..', 'data', 'grammars', 'default.fst'),
+                           help='Path to file storing OpenFST-formatted grammar.')
+    argparser.add_argument('--airlines', '--airlinesfile', '-i',
+                           default=path.join(toolDir, '..', 'data', 'airlines', 'callsigns.txt'),
+                           help='Path to file storing airline callsign information.')
+    argparser.add_argument('--context', '-c', default=None, help='Path to a current_callsign context file.')
+    pargs = argparser.parse_args(args[1:])
+
+    contextFile = None if pargs.context is None else path.abspath(pargs.context)
+    pipeline = AnnotationPipeline(pargs.grammar, path.abspath(pargs.airlines), contextFile=contextFile,
+                                  timeout=pargs.timeout, allowSkip=not pargs.noskip,
+                                  ignoreFluffWords=pargs.ignorefluff,
+                                  confidenceMode=parseConfidenceMode(pargs.confidence), isStrict=pargs.strict)
+    stats = pipeline.run(pargs.corpus, overwrite=pargs.overwrite, convertWorkers=pargs.workers or None,
+                         recognizeWorkers=pargs.recognizers or None, verbose=pargs.verbose,
+                         dedup=not pargs.nodedup)
+    stats.printout()
+
+
+if __name__ == '__main__':
+    main(sys.argv)
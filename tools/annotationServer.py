@@ -0,0 +1,440 @@
+"""
+Long-running annotation server that keeps a Text2XMLConverter and a ConceptGenerator in memory,
+so that scripts and the annotation tool don't have to load the grammar and airline files themselves.
+
+The server listens on a Unix domain socket. Requests and responses are JSON objects, one per line:
+    request:  {"id": 1, "method": "convert", "params": {"sentence": "lufthansa one two three"}}
+    response: {"id": 1, "result": {"xml": "<s> ... </s>", "status": "success"}}
+    error:    {"id": 1, "error": "Server is busy"}
+Supported methods:
+    info:      Returns the grammar name and whether a grammar was loaded.
+    convert:   Converts a sentence to XML (params: sentence, timeout, allowSkip, ignoreFluffWords).
+    nbest:     Returns up to n alternative XML conversions (params: sentence, n, timeout, allowSkip,
+               ignoreFluffWords).
+    recognize: Generates commands for an XML string (params: xml, confidenceMode, isStrict, records).
+               With records, each command is returned as an array [callsign, concept, value, metric, [confidences]]
+               instead of a string.
+Every request may set "deadline", the number of seconds after which the server gives up on it.
+
+Requests are handled concurrently by a pool of worker processes that are forked after all data was loaded.
+If more than the allowed number of requests are pending, new requests are rejected as busy. A request that exceeds
+its deadline stays pending until its worker finished it, as the worker can't be interrupted.
+
+Use AnnotationClient to talk to the server. It offers the same conversion and recognition methods as
+Text2XMLConverter and ConceptGenerator and can be used in their place.
+"""
+
+import sys
+import os
+import json
+import socket
+import argparse
+import signal
+import tempfile
+import threading
+from os import path
+from math import floor
+from multiprocessing import Pool, Array
+from timeit import default_timer
+from SocketServer import ThreadingMixIn, UnixStreamServer, StreamRequestHandler
+
+from Text2XML import Text2XMLConverter
+from GenerateConcept import ConceptGenerator, RecognitionResult, CONFMODE_OFF, parseConfidenceMode
+from AMANRecords import AMANCommand
+from ParallelTools import getNumWorkers, getWorkerPIDs, POLL_INTERVAL
+
+DEFAULT_SOCKET = path.join(tempfile.gettempdir(), 'atc_anno.sock')
+DEFAULT_DEADLINE = 60
+DEADLINE_MARGIN = 1  # Seconds before the deadline at which the parser gives up on a request
+METHODS = ['info', 'convert', 'nbest', 'recognize']
+
+# Converter and generator used by worker processes. They are set before the worker pool is forked.
+_workerConverter_ = None
+_workerGenerator_ = None
+# Shared array with the process ID of the worker that handles the request of each pending slot (0 if not started)
+_workerSlotPIDs_ = None
+
+
+class ServerError(Exception):
+    pass
+
+
+def _handleRequestWorker_(task):
+    """
+    Entry point for worker processes. Handles a (slot, method, params) task.
+    Returns a (result, error) pair, where error is None on success.
+    """
+    slot, method, params = task
+    _workerSlotPIDs_[slot] = os.getpid()
+    try:
+        if method == 'convert':
+            xml = _workerConverter_.convertSentence(params['sentence'], timeout=params.get('timeout', 0),
+                                                    allowSkip=params.get('allowSkip', True),
+                                                    ignoreFluffWords=params.get('ignoreFluffWords', False))
+            result = dict(xml=xml, status=_workerConverter_.getConversionStatus(xml))
+        elif method == 'nbest':
+            parses = _workerConverter_.convertSentenceNBest(params['sentence'], n=params.get('n', 5),
+                                                            timeout=params.get('timeout', 0),
+                                                            allowSkip=params.get('allowSkip', True),
+                                                            ignoreFluffWords=params.get('ignoreFluffWords', False))
+            result = dict(parses=parses)
+        elif method == 'recognize':
+            confidenceMode = params.get('confidenceMode', CONFMODE_OFF)
+            if not isinstance(confidenceMode, int):
+                confidenceMode = parseConfidenceMode(confidenceMode)
+            asRecords = params.get('records', False)
+            commands = _workerGenerator_.recognizeString(params['xml'], confidenceMode=confidenceMode,
+                                                         isStrict=params.get('isStrict', False), asRecords=asRecords)
+            if asRecords:
+                commands = [command.getFields() for command in commands]
+            result = dict(commands=commands)
+        else:
+            raise ServerError('Unknown method: {0}'.format(method))
+        return result, None
+    except Exception as e:
+        return None, '{0}: {1}'.format(type(e).__name__, e)
+
+
+class _RequestHandler_(StreamRequestHandler):
+    """
+    Handles a client connection, which may send any number of requests.
+    """
+
+    def handle(self):
+        for line in iter(self.rfile.readline, ''):
+            if len(line.strip()) == 0:
+                continue
+            response = self.server.annotationServer.handleLine(line)
+            try:
+                self.wfile.write(json.dumps(response) + '\n')
+                self.wfile.flush()
+            except socket.error:
+                break  # Client disconnected
+
+
+class _ThreadingUnixServer_(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+class AnnotationServer:
+    """
+    Serves conversion and recognition requests over a Unix domain socket.
+    """
+
+    def __init__(self, grammarFile, airlineFile, contextFile=None, workers=None, maxPending=None,
+                 deadline=DEFAULT_DEADLINE, contextLog=None):
+        """
+        :param contextFile: Path to a current_callsign context file, or None.
+        :param contextLog: Path to a log of callsign events that is followed while serving, or None.
+        :param workers: Number of worker processes. If None, one per CPU core is used.
+        :param maxPending: Maximum number of requests that are handled at the same time. Further requests are
+                           rejected until a request is finished. Defaults to four times the number of workers.
+        :param deadline: Default number of seconds after which a request is aborted.
+        """
+        self.converter = Text2XMLConverter(grammarFile, airlineFile)
+        self.generator = ConceptGenerator(airlineFile, contextFile=contextFile, contextLog=contextLog)
+        self.workers = getNumWorkers(workers)
+        if maxPending is None:
+            maxPending = 4 * self.workers
+        self.freeSlots = range(maxPending)
+        self.overdueRequests = dict()  # slot -> AsyncResult of requests that exceeded their deadline
+        self.slotLock = threading.Lock()
+        self.deadline = deadline
+        self.pool = None
+        self.server = None
+
+    def serve(self, socketFile=DEFAULT_SOCKET):
+        """
+        Starts the worker pool and serves requests until the server is shut down.
+        """
+        global _workerConverter_, _workerGenerator_, _workerSlotPIDs_
+        if path.exists(socketFile):
+            if _isSocketAlive_(socketFile):
+                raise ServerError('Another server is already listening on {0}'.format(socketFile))
+            os.remove(socketFile)  # Left over from a server that was not shut down properly
+
+        _workerConverter_ = self.converter
+        _workerGenerator_ = self.generator
+        _workerSlotPIDs_ = Array('l', len(self.freeSlots), lock=False)
+        self.pool = Pool(self.workers)
+        try:
+            self.server = _ThreadingUnixServer_(socketFile, _RequestHandler_)
+            self.server.annotationServer = self
+            self.server.serve_forever()
+        finally:
+            self.pool.terminate()
+            self.pool.join()
+            if self.server is not None:
+                self.server.server_close()
+            if path.exists(socketFile):
+                os.remove(socketFile)
+
+    def shutdown(self):
+        if self.server is not None:
+            self.server.shutdown()
+
+    def handleLine(self, line):
+        """
+        Handles a single request line and returns the response as a dictionary.
+        """
+        requestID = None
+        try:
+            request = json.loads(line)
+            requestID = request.get('id')
+            result = self.handleRequest(request.get('method'), request.get('params', dict()),
+                                        deadline=request.get('deadline', self.deadline))
+            return dict(id=requestID, result=result)
+        except Exception as e:
+            return dict(id=requestID, error=str(e))
+
+    def handleRequest(self, method, params, deadline=None):
+        if method not in METHODS:
+            raise ServerError('Unknown method: {0}'.format(method))
+        if method == 'info':
+            return dict(grammarName=self.converter.getGrammarName(), hasGrammar=self.converter.has_grammar)
+
+        params = _encodeStrings_(params)
+        if deadline is None:
+            deadline = self.deadline
+        if method in ['convert', 'nbest']:
+            # Let the parser give up shortly before the deadline, so that the worker becomes available again.
+            # Parser timeouts are whole seconds of at least one second, so very short deadlines get no margin.
+            parserTimeout = max(1, int(floor(deadline)) - DEADLINE_MARGIN)
+            if params.get('timeout', 0) > 0:
+                parserTimeout = min(parserTimeout, max(1, int(floor(params['timeout']))))
+            params['timeout'] = parserTimeout
+
+        slot = self._acquireSlot_()
+        try:
+            asyncResult = self.pool.apply_async(_handleRequestWorker_, ((slot, method, params),))
+            end = default_timer() + deadline
+            while not asyncResult.ready():
+                remaining = end - default_timer()
+                if remaining <= 0:
+                    with self.slotLock:
+                        self.overdueRequests[slot] = asyncResult
+                    slot = None  # Released once the worker finished the request, see _acquireSlot_
+                    raise ServerError('Request exceeded deadline of {0} seconds, it keeps a worker busy until '
+                                      'it is finished'.format(deadline))
+                asyncResult.wait(min(remaining, POLL_INTERVAL))
+                if not asyncResult.ready() and self._hasWorkerDied_(slot):
+                    raise ServerError('Worker process died while handling the request')
+            try:
+                result, error = asyncResult.get()
+            except Exception as e:  # Errors that the worker could not catch, e.g. if the result can't be pickled
+                raise ServerError('{0}: {1}'.format(type(e).__name__, e))
+        finally:
+            if slot is not None:
+                self._releaseSlot_(slot)
+        if error is not None:
+            raise ServerError(error)
+        return result
+
+    def _acquireSlot_(self):
+        """
+        Returns a free slot for a request, or raises a ServerError if the server is busy.
+        Slots of overdue requests are freed once their worker finished them or died.
+        """
+        with self.slotLock:
+            for slot, asyncResult in self.overdueRequests.items():
+                if asyncResult.ready() or self._hasWorkerDied_(slot):
+                    del self.overdueRequests[slot]
+                    self.freeSlots.append(slot)
+            if len(self.freeSlots) == 0:
+                raise ServerError('Server is busy')
+            slot = self.freeSlots.pop()
+            _workerSlotPIDs_[slot] = 0
+            return slot
+
+    def _releaseSlot_(self, slot):
+        with self.slotLock:
+            self.freeSlots.append(slot)
+
+    def _hasWorkerDied_(self, slot):
+        """
+        Returns True if the worker process that started the request of a slot is no longer part of the pool.
+        The pool replaces dead workers, but the request they were handling is never finished.
+        """
+        pid = _workerSlotPIDs_[slot]
+        return pid != 0 and pid not in getWorkerPIDs(self.pool)
+
+
+def _encodeStrings_(data):
+    """
+    Turns the unicode strings that json produces into UTF-8 encoded str objects.
+    """
+    if isinstance(data, unicode):
+        return data.encode('utf-8')
+    elif isinstance(data, dict):
+        return dict((_encodeStrings_(key), _encodeStrings_(value)) for key, value in data.iteritems())
+    elif isinstance(data, list):
+        return [_encodeStrings_(item) for item in data]
+    else:
+        return data
+
+
+def _isSocketAlive_(socketFile):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socketFile)
+        return True
+    except socket.error:
+        return False
+    finally:
+        sock.close()
+
+
+class AnnotationClient:
+    """
+    Client for an AnnotationServer.
+    Offers the conversion methods of Text2XMLConverter and the recognition methods of ConceptGenerator,
+    so it can be used in their place.
+    """
+
+    def __init__(self, socketFile=DEFAULT_SOCKET, deadline=None):
+        """
+        :param deadline: Number of seconds after which the server should give up on a request.
+                         If None, the server's default deadline is used.
+        """
+        self.socketFile = socketFile
+        self.deadline = deadline
+        self.lock = threading.Lock()
+        self.sock = None
+        self.reader = None
+        self.requestCount = 0
+
+        info = self.request('info')
+        self.grammar_name = info['grammarName']
+        self.has_grammar = info['hasGrammar']
+
+    def _connect_(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.socketFile)
+        self.reader = self.sock.makefile('r')
+
+    def close(self):
+        if self.sock is not None:
+            self.reader.close()
+            self.sock.close()
+            self.sock = None
+            self.reader = None
+
+    def request(self, method, **params):
+        """
+        Sends a request to the server and returns its result. Raises a ServerError if the request failed.
+        """
+        with self.lock:
+            self.requestCount += 1
+            request = dict(id=self.requestCount, method=method, params=params)
+            if self.deadline is not None:
+                request['deadline'] = self.deadline
+            line = json.dumps(request) + '\n'
+            for attempt in range(2):  # Reconnect once if the connection was lost
+                try:
+                    if self.sock is None:
+                        self._connect_()
+                    self.sock.sendall(line)
+                    responseLine = self.reader.readline()
+                    if len(responseLine) == 0:
+                        raise socket.error('Connection closed by server')
+                    break
+                except socket.error:
+                    self.close()
+                    if attempt > 0:
+                        raise
+        response = _encodeStrings_(json.loads(responseLine))
+        if 'error' in response:
+            raise ServerError(response['error'])
+        return response['result']
+
+    # Text2XMLConverter interface
+    def getGrammarName(self):
+        return self.grammar_name
+
+    def convertSentence(self, sentence, wxLib=None, wxGUI=None, timeout=0, allowSkip=True, ignoreFluffWords=False):
+        """
+        See Text2XMLConverter.convertSentence. GUI progress updates and aborts are not supported.
+        """
+        result = self.request('convert', sentence=str(sentence), timeout=timeout, allowSkip=allowSkip,
+                              ignoreFluffWords=ignoreFluffWords)
+        return result['xml']
+
+    def convertSentenceNBest(self, sentence, n=5, timeout=0, allowSkip=True, ignoreFluffWords=False):
+        result = self.request('nbest', sentence=str(sentence), n=n, timeout=timeout, allowSkip=allowSkip,
+                              ignoreFluffWords=ignoreFluffWords)
+        return result['parses']
+
+    # ConceptGenerator interface
+    def recognizeString(self, string, confidenceMode=CONFMODE_OFF, isStrict=False, asRecords=False):
+        if string is None:
+            string = ''
+        result = self.request('recognize', xml=str(string), confidenceMode=confidenceMode, isStrict=isStrict,
+                              records=asRecords)
+        if asRecords:
+            return [AMANCommand.fromFields(fields) for fields in result['commands']]
+        return result['commands']
+
+    def recognizeBatch(self, strings, workers=1, confidenceMode=CONFMODE_OFF, isStrict=False, asRecords=False):
+        """
+        See ConceptGenerator.recognizeBatch. Strings are sent to the server one at a time; workers is ignored,
+        as the server uses its own worker processes.
+        """
+        results = list()
+        for string in strings:
+            try:
+                commands = self.recognizeString(string, confidenceMode=confidenceMode, isStrict=isStrict,
+                                                asRecords=asRecords)
+                results.append(RecognitionResult(commands, None))
+            except ServerError as e:
+                results.append(RecognitionResult(None, str(e)))
+        return results
+
+
+def main(args):
+    toolDir = path.dirname(path.abspath(args[0]))
+    argparser = argparse.ArgumentParser(description='Serve XML conversion and command recognition requests.')
+    argparser.add_argument('--socket', '-s', default=DEFAULT_SOCKET,
+                           help='Path of the Unix domain socket (default: {0}).'.format(DEFAULT_SOCKET))
+    argparser.add_argument('--workers', '-w', type=int, default=0,
+                           help='Number of worker processes (default: 0, one per CPU core).')
+    argparser.add_argument('--maxpending', type=int, default=None,
+                           help='Maximum number of concurrent requests before requests are rejected as busy '
+                                '(default: 4 per worker).')
+    argparser.add_argument('--deadline', '-d', type=float, default=DEFAULT_DEADLINE,
+                           help='Default number of seconds after which a request is aborted '
+                                '(default: {0}).'.format(DEFAULT_DEADLINE))
+    argparser.add_argument('--grammar', '--grammarfile', '-g',
+                           default=path.join(toolDir, '..', 'data', 'grammars', 'default.fst'),
+                           help='Path to file storing OpenFST-formatted grammar.')
+    argparser.add_argument('--airlines', '--airlinesfile', '-i',
+                           default=path.join(toolDir, '..', 'data', 'airlines', 'callsigns.txt'),
+                           help='Path to file storing airline callsign information.')
+    contextGroup = argparser.add_mutually_exclusive_group()
+    contextGroup.add_argument('--context', '-c', default=None, help='Path to a current_callsign context file.')
+    contextGroup.add_argument('--contextlog', default=None,
+                              help='Path to an append-only log of callsign events ("add <airline> <flightnumber>", '
+                                   '"remove <airline> <flightnumber>") that is followed while serving.')
+    pargs = argparser.parse_args(args[1:])
+
+    contextFile = None if pargs.context is None else path.abspath(pargs.context)
+    contextLog = None if pargs.contextlog is None else path.abspath(pargs.contextlog)
+    server = AnnotationServer(pargs.grammar, path.abspath(pargs.airlines), contextFile=contextFile,
+                              workers=pargs.workers or None, maxPending=pargs.maxpending, deadline=pargs.deadline,
+                              contextLog=contextLog)
+    print 'Serving on {0} with {1} workers'.format(pargs.socket, server.workers)
+    serverPID = os.getpid()
+
+    def stop(signum, frame):
+        if os.getpid() == serverPID:  # Worker processes inherit this handler
+            raise SystemExit(0)
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        server.serve(pargs.socket)
+    except KeyboardInterrupt:
+        pass
+    except ServerError as e:
+        sys.exit(str(e))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
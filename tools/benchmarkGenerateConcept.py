@@ -0,0 +1,306 @@
+"""
+Benchmarks the stages of command generation (tools/GenerateConcept.py) on generated XML utterances
+of increasing length and number of commands, so that slowdowns are caught before they reach the batch evaluator.
+
+Stages:
+    loadFromString:     Tokenizing an XML string and building its TagFrame.
+    repairTagStructure: Closing the tags of a tokenized utterance (a third of the utterances lack closing tags).
+    CommandSet:         Extracting callsign and commands from a TagFrame.
+    parseNumberWords:   Converting the number words of the utterances to digits, without cache.
+    parseNumber:        The same, with the cache that is used during recognition.
+    getAMANStrings:     Scoring and formatting the commands of a CommandSet.
+
+For every stage and utterance size, the best time of several repetitions is reported as throughput.
+If tracemalloc is available (Python 3, or the pytracemalloc backport for Python 2), each stage is also run once
+while tracing memory: "blocks" is the number of memory blocks per utterance that are still allocated afterwards
+(all results are kept, so these are the allocations of the results) and "peak" the peak of traced memory.
+
+Results can be saved and compared with those of an earlier run:
+    python tools/benchmarkGenerateConcept.py --save before.json
+    python tools/benchmarkGenerateConcept.py --compare before.json
+With --compare, the exit status is 1 if a stage became slower (or allocates more) than allowed by --tolerance.
+Use --profile to print the functions that take the most time in each stage.
+"""
+
+import sys
+import gc
+import json
+import random
+import argparse
+import cProfile
+import pstats
+import platform
+from os import path
+from timeit import default_timer
+from StringIO import StringIO
+
+from GenerateConcept import TagFrame, TagIndex, CommandSet, UtteranceUnit, CONFIDENCE_SUM_MODES
+from FileTools import loadAirlineCallsigns
+
+try:
+    import tracemalloc
+except ImportError:  # tracemalloc is optional, allocations are then not reported
+    tracemalloc = None
+
+STAGES = ['loadFromString', 'repairTagStructure', 'CommandSet', 'parseNumberWords', 'parseNumber', 'getAMANStrings']
+DEFAULT_COMMAND_COUNTS = [1, 2, 4, 8]
+DEFAULT_TOLERANCE = 0.15
+
+AIRLINE_WORDS = ['lufthansa', 'air_france', 'klm', 'swiss', 'hansa', 'speedbird']
+NUMBER_WORDS = ['zero', 'one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine']
+NOISE_WORDS = ['_spn_', 'aeh', 'and', 'please', 'now', '_nsn_']
+COMMAND_TEMPLATES = [
+    '<command="descend"> descend <flightlevel> {number} </flightlevel> </command>',
+    '<command="climb"> climb <altitude> {number} thousand </altitude> feet </command>',
+    '<command="reduce"> reduce <speed> {number} </speed> knots <less> or less </less> </command>',
+    '<command="turn_heading"> turn <direction> left </direction> heading <degree_absolute> {number} '
+    '</degree_absolute> </command>',
+    '<command="direct_to"> proceed direct to <waypoint> metma </waypoint> </command>',
+    '<command="rate_of_descent"> rate of descent <feet_per_minute> {number} hundred </feet_per_minute> </command>',
+    '<command="handover"> contact <frequency> one one nine decimal {number} </frequency> </command>',
+    '<command="init_response"> good morning </command>',
+]
+
+
+class BenchmarkData:
+    """
+    Generated utterances of one size and the inputs that each stage needs.
+    """
+
+    def __init__(self, numCommands, numUtterances, airlineShorts, confidenceMode, seed=0):
+        rng = random.Random('{0}-{1}'.format(seed, numCommands))
+        self.numCommands = numCommands
+        self.numbers = list()
+        self.strings = [self._generateUtterance_(rng, numCommands) for _ in range(numUtterances)]
+        self.tokenPairs = [TagFrame.tokenizeString(string) for string in self.strings]
+        self.frames = [TagFrame.loadFromString(string) for string in self.strings]
+        self.commandSets = [CommandSet(frame, airlineShorts, None) for frame in self.frames]
+        self.airlineShorts = airlineShorts
+        self.confidenceMode = confidenceMode
+
+    def getLabel(self):
+        return '{0} cmds'.format(self.numCommands)
+
+    def _generateUtterance_(self, rng, numCommands):
+        parts = ['<s>', '<callsign>', '<airline>', rng.choice(AIRLINE_WORDS), '</airline>',
+                 '<flightnumber>', self._generateNumber_(rng, 3), '</flightnumber>', '</callsign>', '<commands>']
+        for _ in range(numCommands):
+            parts.extend(rng.choice(NOISE_WORDS) for _ in range(rng.randint(0, 2)))
+            parts.append(rng.choice(COMMAND_TEMPLATES).format(number=self._generateNumber_(rng, rng.randint(1, 3))))
+        parts.extend(['</commands>', '</s>'])
+        tokens = ' '.join(parts).split()
+        if rng.random() < 0.33:  # Broken tag structure, as produced by annotators or partial parses
+            tokens = [token for token in tokens if not token.startswith('</') or rng.random() < 0.5]
+        return ' '.join(self._addConfidence_(rng, token) for token in tokens)
+
+    def _generateNumber_(self, rng, length):
+        words = tuple(rng.choice(NUMBER_WORDS) for _ in range(length))
+        self.numbers.append(words)
+        return ' '.join(words)
+
+    @staticmethod
+    def _addConfidence_(rng, token):
+        if token.startswith('<'):
+            return token
+        return '{0}:{1:.2f}'.format(token, rng.uniform(0.3, 1.0))
+
+
+def _runStage_(stage, data):
+    """
+    Runs a stage on all items of the data and returns the list of results.
+    """
+    if stage == 'loadFromString':
+        return [TagFrame.loadFromString(string) for string in data.strings]
+    elif stage == 'repairTagStructure':
+        return [TagFrame.repairTagStructure(pairs, TagIndex()) for pairs in data.tokenPairs]
+    elif stage == 'CommandSet':
+        return [CommandSet(frame, data.airlineShorts, None) for frame in data.frames]
+    elif stage == 'parseNumberWords':
+        return [UtteranceUnit.parseNumberWords(words) for words in data.numbers]
+    elif stage == 'parseNumber':
+        unit = UtteranceUnit(None)
+        return [unit.parseNumber(words, isFrame=False) for words in data.numbers]
+    elif stage == 'getAMANStrings':
+        return [commandSet.getAMANStrings(data.confidenceMode) for commandSet in data.commandSets]
+    else:
+        raise ValueError('Unknown stage: {0}'.format(stage))
+
+
+def _getNumItems_(stage, data):
+    if stage in ['parseNumberWords', 'parseNumber']:
+        return len(data.numbers)
+    return len(data.strings)
+
+
+def measureStage(stage, data, repeat):
+    """
+    Returns a dictionary with the timing (and, if possible, allocation) results of a stage.
+    """
+    numItems = _getNumItems_(stage, data)
+    _runStage_(stage, data)  # Warm up caches
+    times = list()
+    isGCEnabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            startTime = default_timer()
+            _runStage_(stage, data)
+            times.append(default_timer() - startTime)
+    finally:
+        if isGCEnabled:
+            gc.enable()
+    bestTime = min(times)
+    result = dict(items=numItems,
+                  usPerItem=1e6 * bestTime / numItems,
+                  itemsPerSecond=numItems / bestTime if bestTime > 0 else None)
+
+    if tracemalloc is not None:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            before = tracemalloc.take_snapshot()
+            results = _runStage_(stage, data)
+            after = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        blocks = sum(stat.count_diff for stat in after.compare_to(before, 'filename'))
+        result['blocksPerItem'] = float(blocks) / numItems
+        result['peakKiB'] = peak / 1024.0
+        del results
+    return result
+
+
+def profileStage(stage, data, repeat, stream=sys.stdout, limit=15):
+    """
+    Prints the functions that take the most time when running a stage.
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    for _ in range(repeat):
+        _runStage_(stage, data)
+    profiler.disable()
+    statStream = StringIO()
+    pstats.Stats(profiler, stream=statStream).sort_stats('cumulative').print_stats(limit)
+    stream.write('=== Profile of {0} ({1}) ===\n'.format(stage, data.getLabel()))
+    stream.write(statStream.getvalue())
+
+
+def runBenchmarks(stages, datasets, repeat):
+    """
+    Returns the results as nested dictionaries: stage -> dataset label -> measurements.
+    """
+    results = dict()
+    for stage in stages:
+        for data in datasets:
+            results.setdefault(stage, dict())[data.getLabel()] = measureStage(stage, data, repeat)
+    return results
+
+
+def printResults(results, datasets, stream=sys.stdout):
+    header = '{0:<20} {1:>9} {2:>8} {3:>12} {4:>12}'.format('Stage', 'Size', 'Items', 'us/item', 'items/s')
+    if tracemalloc is not None:
+        header += ' {0:>12} {1:>10}'.format('blocks/item', 'peak KiB')
+    stream.write(header + '\n')
+    for stage in STAGES:
+        if stage not in results:
+            continue
+        for data in datasets:
+            measurement = results[stage][data.getLabel()]
+            line = '{0:<20} {1:>9} {2:>8} {3:>12.2f} {4:>12.0f}'.format(
+                stage, data.getLabel(), measurement['items'], measurement['usPerItem'],
+                measurement['itemsPerSecond'] or 0)
+            if 'blocksPerItem' in measurement:
+                line += ' {0:>12.1f} {1:>10.1f}'.format(measurement['blocksPerItem'], measurement['peakKiB'])
+            stream.write(line + '\n')
+    if tracemalloc is None:
+        stream.write('(Allocations not measured: tracemalloc is not available)\n')
+
+
+def compareResults(results, baseline, tolerance, stream=sys.stdout):
+    """
+    Compares results with those of an earlier run and prints the changes.
+    Returns the list of (stage, size, metric) whose value grew by more than the tolerance.
+    """
+    regressions = list()
+    stream.write('{0:<20} {1:>9} {2:>12} {3:>12} {4:>8}\n'.format('Stage', 'Size', 'before', 'after', 'change'))
+    for stage in STAGES:
+        for label, measurement in sorted(results.get(stage, dict()).iteritems()):
+            before = baseline.get(stage, dict()).get(label)
+            if before is None:
+                continue
+            for metric in ['usPerItem', 'blocksPerItem']:
+                if metric not in measurement or metric not in before or before[metric] <= 0:
+                    continue
+                change = measurement[metric] / before[metric] - 1
+                flag = ''
+                if change > tolerance:
+                    flag = '  REGRESSION'
+                    regressions.append((stage, label, metric))
+                stream.write('{0:<20} {1:>9} {2:>12.2f} {3:>12.2f} {4:>+7.1%}{5}\n'.format(
+                    stage if metric == 'usPerItem' else '  ' + metric, label, before[metric], measurement[metric],
+                    change, flag))
+    return regressions
+
+
+def main(args):
+    toolDir = path.dirname(path.abspath(args[0]))
+    argparser = argparse.ArgumentParser(description='Benchmark the stages of command generation.')
+    argparser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES,
+                           help='Stages to benchmark (default: all).')
+    argparser.add_argument('--commands', type=int, nargs='+', default=DEFAULT_COMMAND_COUNTS,
+                           help='Numbers of commands per utterance, one utterance size per number '
+                                '(default: {0}).'.format(' '.join(str(n) for n in DEFAULT_COMMAND_COUNTS)))
+    argparser.add_argument('--utterances', '-n', type=int, default=300,
+                           help='Number of generated utterances per size (default: 300).')
+    argparser.add_argument('--repeat', '-r', type=int, default=5,
+                           help='Number of timed repetitions, of which the best is reported (default: 5).')
+    argparser.add_argument('--confidence', default='prod', choices=sorted(CONFIDENCE_SUM_MODES),
+                           help='Confidence mode used by getAMANStrings (default: prod).')
+    argparser.add_argument('--seed', type=int, default=0, help='Seed of the utterance generator (default: 0).')
+    argparser.add_argument('--save', default=None, help='Write the results to this JSON file.')
+    argparser.add_argument('--compare', default=None, help='Compare the results with those of this JSON file.')
+    argparser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                           help='Relative growth of time or allocations per item that --compare reports as '
+                                'regression (default: {0}).'.format(DEFAULT_TOLERANCE))
+    argparser.add_argument('--profile', action='store_true',
+                           help='Print profiles of the stages on the largest utterances instead of benchmarking.')
+    argparser.add_argument('--airlines', '--airlinesfile', '-i',
+                           default=path.join(toolDir, '..', 'data', 'airlines', 'callsigns.txt'),
+                           help='Path to file storing airline callsign information.')
+    pargs = argparser.parse_args(args[1:])
+
+    airlineShorts = loadAirlineCallsigns(pargs.airlines)
+    confidenceMode = CONFIDENCE_SUM_MODES[pargs.confidence]
+    datasets = [BenchmarkData(numCommands, pargs.utterances, airlineShorts, confidenceMode, seed=pargs.seed)
+                for numCommands in sorted(set(pargs.commands))]
+
+    if pargs.profile:
+        for stage in pargs.stages:
+            profileStage(stage, datasets[-1], pargs.repeat)
+        return
+
+    results = runBenchmarks(pargs.stages, datasets, pargs.repeat)
+    print 'Python {0}, {1} utterances per size, best of {2}'.format(platform.python_version(), pargs.utterances,
+                                                                  pargs.repeat)
+    printResults(results, datasets)
+
+    if pargs.save is not None:
+        with open(pargs.save, 'w') as f:
+            json.dump(dict(python=platform.python_version(), utterances=pargs.utterances, seed=pargs.seed,
+                           results=results), f, indent=1, sort_keys=True)
+
+    if pargs.compare is not None:
+        with open(pargs.compare) as f:
+            baseline = json.load(f)
+        print
+        regressions = compareResults(results, baseline['results'], pargs.tolerance)
+        if len(regressions) > 0:
+            print '\n{0} regressions beyond a tolerance of {1:.0%}'.format(len(regressions), pargs.tolerance)
+            sys.exit(1)
+        else:
+            print '\nNo regressions beyond a tolerance of {0:.0%}'.format(pargs.tolerance)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
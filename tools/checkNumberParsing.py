@@ -0,0 +1,175 @@
+"""
+Conformance check of the conversion of number words to digits (UtteranceUnit.parseNumberWords in
+tools/GenerateConcept.py) against the reference implementation that it replaced.
+
+The reference rewrote the list of words in loops that rescanned it from the start after every replacement.
+parseNumberWords makes single passes instead and must return the same digits for every input.
+The check enumerates every sequence of words from the number vocabulary (plus a word outside of it, which must be
+filtered out) up to a maximum length and compares both implementations:
+    python tools/checkNumberParsing.py --length 3
+
+The reference never terminates for some inputs (a multiplier followed by another multiplier, e.g. "double triple").
+These inputs are counted, but not compared. The exit status is 1 if any other input yields different digits.
+"""
+
+import sys
+import argparse
+import itertools
+from timeit import default_timer
+
+from GenerateConcept import UtteranceUnit
+
+DEFAULT_LENGTH = 3
+ROGUE_WORD = '_spn_'  # Stands for all words outside of the number vocabulary
+MAX_REFERENCE_STEPS = 1000  # Steps after which the reference is considered not to terminate
+
+
+class ReferenceDidNotTerminate(Exception):
+    pass
+
+
+def _countStep_(steps):
+    steps[0] += 1
+    if steps[0] > MAX_REFERENCE_STEPS:
+        raise ReferenceDidNotTerminate()
+
+
+def referenceParseNumberWords(words):
+    """
+    The previous implementation of UtteranceUnit.parseNumber, unchanged except for counting loop steps
+    (see MAX_REFERENCE_STEPS).
+    """
+    self = UtteranceUnit
+    steps = [0]
+    items = words
+
+    # Filter out rogue words (e.g. silence markers and hesitation words)
+    items = [item for item in items if (item in self.NUMBER_VOCABULARY)]
+
+    # Prepare
+    while 'and' in items:  # Remove "and"
+        items.remove('and')
+    # if speaker dropped the digit before thousand/hundred, it was a one
+    if len(items) > 0 and items[0] in ['thousand', 'hundred']:
+        items.insert(0, 'one')
+    # Thousands
+    while 'thousand' in items:
+        _countStep_(steps)
+        i = items.index('thousand')
+        nxt = i + 1
+        nxt2 = nxt + 1
+        # thousand was last item
+        if nxt >= len(items):
+            items.extend(['zero'] * 3)
+        # if "x thousand y hundred", move on to parse "x y hundred"
+        elif nxt2 < len(items) and items[nxt2] == 'hundred':
+            pass
+        else:
+            if items[nxt] not in self.TENS_DIGITS and items[nxt] not in self.TEEN_DIGITS:
+                if items[nxt] not in self.SINGLE_DIGITS:
+                    items.insert(nxt, 'zero')
+                items.insert(nxt, 'zero')
+            items.insert(nxt, 'zero')
+        items.pop(i)
+    # Hundreds
+    while 'hundred' in items:
+        _countStep_(steps)
+        i = items.index('hundred')
+        nxt = i + 1
+        if nxt >= len(items):  # hundred was last item
+            items.extend(['zero'] * 2)
+        elif items[nxt] not in self.TENS_DIGITS and items[nxt] not in self.TEEN_DIGITS:
+            if items[nxt] not in self.SINGLE_DIGITS:
+                items.insert(nxt, 'zero')
+            items.insert(nxt, 'zero')
+        items.pop(i)
+
+    for multiple, multiplier in self.MULTIPLIERS.iteritems():
+        while multiple in items:
+            _countStep_(steps)
+            i = items.index(multiple)
+            nxt = i + 1
+            if nxt < len(items):  # multiple wasn't last word
+                next_item = items[nxt]
+                for _ in range(1, multiplier):
+                    items.insert(nxt, next_item)
+            items.pop(i)
+
+    # Tens
+    for tenner, tenval in self.TENS_DIGITS.iteritems():
+        while tenner in items:
+            _countStep_(steps)
+            i = items.index(tenner)
+            nxt = i + 1
+            items[i] = tenval
+            if nxt >= len(items):  # Tenner was last item
+                items.append('zero')
+            elif items[nxt] not in self.SINGLE_DIGITS or items[nxt] == 'zero':
+                items.insert(nxt, 'zero')
+    # Teen values (11-19)
+    for teen, teenval in self.TEEN_DIGITS.iteritems():
+        while teen in items:
+            _countStep_(steps)
+            i = items.index(teen)
+            items[i] = teenval
+            items.insert(i, 'one')
+    # Parse
+    num = []
+    for i, item in enumerate(items):
+        if item in self.ALPHANUM:
+            num += self.ALPHANUM[item]
+    return ''.join(num)
+
+
+def getVocabulary():
+    """
+    Returns the words that sequences are built from: the number vocabulary and ROGUE_WORD.
+    """
+    return sorted(UtteranceUnit.NUMBER_VOCABULARY) + [ROGUE_WORD]
+
+
+def checkSequences(vocabulary, maxLength, maxReported=20):
+    """
+    Compares both implementations on every sequence of vocabulary words of length 1 to maxLength.
+    Prints the first maxReported differences and returns a tuple (number of sequences, number of differences,
+    number of sequences for which the reference does not terminate).
+    """
+    numSequences = 0
+    numDifferences = 0
+    numUnterminated = 0
+    for length in range(1, maxLength + 1):
+        for words in itertools.product(vocabulary, repeat=length):
+            numSequences += 1
+            try:
+                expected = referenceParseNumberWords(list(words))
+            except ReferenceDidNotTerminate:
+                numUnterminated += 1
+                continue
+            actual = UtteranceUnit.parseNumberWords(words)
+            if actual != expected:
+                numDifferences += 1
+                if numDifferences <= maxReported:
+                    print 'DIFFERENCE: {0}: {1!r} instead of {2!r}'.format(' '.join(words), actual, expected)
+    return numSequences, numDifferences, numUnterminated
+
+
+def main(args):
+    argparser = argparse.ArgumentParser(description='Compares UtteranceUnit.parseNumberWords with its reference '
+                                                    'implementation on all number word sequences up to a length.')
+    argparser.add_argument('--length', '-l', type=int, default=DEFAULT_LENGTH,
+                           help='Maximum length of the sequences (default: {0}). '
+                                'Each additional word multiplies the run time by about 60.'.format(DEFAULT_LENGTH))
+    pargs = argparser.parse_args(args[1:])
+
+    vocabulary = getVocabulary()
+    start = default_timer()
+    numSequences, numDifferences, numUnterminated = checkSequences(vocabulary, pargs.length)
+    print '{0} sequences of up to {1} of {2} words checked in {3:.1f}s: {4} differences, ' \
+          '{5} not terminating in the reference'.format(numSequences, pargs.length, len(vocabulary),
+                                                        default_timer() - start, numDifferences, numUnterminated)
+    if numDifferences > 0:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
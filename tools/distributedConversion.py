@@ -0,0 +1,72 @@
+"""
+Converts a directory tree of text files to XML, sharing the work among several processes that can run on
+different machines, as long as they share the file system (e.g. via NFS).
+
+Start the same command on every machine. The first process splits the input files into shards, after which each
+process converts shards that no other process is working on. Shards of crashed processes are taken over once
+their lease expires. Processes that are started later join in, processes that finish early wait until the
+remaining shards are done and then print the summary of the whole conversion.
+
+Example:
+    python tools/distributedConversion.py corpus/ xml/ /shared/queue --workers 8
+"""
+
+import sys
+import argparse
+from os import path
+
+from Text2XML import Text2XMLConverter, STATUSES, STATUS_SUCCESS, DEFAULT_SHARD_SIZE
+from LeaseQueue import DEFAULT_LEASE_TIMEOUT
+
+
+def main(args):
+    toolDir = path.dirname(path.abspath(args[0]))
+    argparser = argparse.ArgumentParser(description='Convert a directory tree of text files to XML, '
+                                                    'sharing the work among processes on several machines.')
+    argparser.add_argument('inputdir', help='Directory tree with input files.')
+    argparser.add_argument('outputdir', help='Directory in which the directory tree of XML files is created.')
+    argparser.add_argument('queuedir', help='Directory for coordinating the processes. '
+                                            'Must be shared by all processes and new for each conversion job.')
+    argparser.add_argument('--inext', default='tra', help='Extension of input files (default: tra).')
+    argparser.add_argument('--outext', default='xml', help='Extension of output files (default: xml).')
+    argparser.add_argument('--mbr', action='store_true', help='Input files are in MBR format.')
+    argparser.add_argument('--workers', '-w', type=int, default=1,
+                           help='Number of worker processes on this machine (default: 1, 0: one per CPU core).')
+    argparser.add_argument('--shardsize', type=int, default=DEFAULT_SHARD_SIZE,
+                           help='Number of files per shard (default: {0}).'.format(DEFAULT_SHARD_SIZE))
+    argparser.add_argument('--lease', type=int, default=DEFAULT_LEASE_TIMEOUT,
+                           help='Number of seconds after which shards of unresponsive processes are taken over '
+                                '(default: {0}).'.format(DEFAULT_LEASE_TIMEOUT))
+    argparser.add_argument('--node', default=None, help='Name of this process (default: hostname and process ID).')
+    argparser.add_argument('--timeout', '-t', type=int, default=0,
+                           help='Number of seconds after which the parse of a file is aborted (default: 0, never).')
+    argparser.add_argument('--noskip', action='store_true', help='Do not allow the parser to skip words.')
+    argparser.add_argument('--ignorefluff', action='store_true', help='Remove out-of-grammar words before parsing.')
+    argparser.add_argument('--nodedup', action='store_true', help='Convert files with identical content separately.')
+    argparser.add_argument('--grammar', '--grammarfile', '-g',
+                           default=path.join(toolDir, '..', 'data', 'grammars', 'default.fst'),
+                           help='Path to file storing OpenFST-formatted grammar.')
+    argparser.add_argument('--airlines', '--airlinesfile', '-i',
+                           default=path.join(toolDir, '..', 'data', 'airlines', 'callsigns.txt'),
+                           help='Path to file storing airline callsign information.')
+    pargs = argparser.parse_args(args[1:])
+
+    converter = Text2XMLConverter(pargs.grammar, path.abspath(pargs.airlines))
+    if not converter.has_grammar:
+        sys.exit('Could not load grammar file {0}'.format(pargs.grammar))
+    summary = converter.convertTreeDistributed(pargs.inputdir, pargs.outputdir, pargs.queuedir,
+                                               inputExtension=pargs.inext, outputExtension=pargs.outext,
+                                               timeout=pargs.timeout, allowSkip=not pargs.noskip, isMBR=pargs.mbr,
+                                               ignoreFluffWords=pargs.ignorefluff, workers=pargs.workers or None,
+                                               dedup=not pargs.nodedup, shardSize=pargs.shardsize,
+                                               leaseTimeout=pargs.lease, nodeID=pargs.node)
+    for status in STATUSES:
+        print '{0}: {1}'.format(status, len(summary[status]))
+        if status != STATUS_SUCCESS:
+            for result in summary[status]:
+                message = '' if result.message is None else ' ({0})'.format(result.message)
+                print '   {0}{1}'.format(result.inputFile, message)
+
+
+if __name__ == '__main__':
+    main(sys.argv)